@@ -206,6 +206,17 @@ class _sql(logstream):
         logstream.__init__(self)
         self.buffer_size = 0
         self.queries = []
+
+    def __nonzero__(self):
+        """
+        Return True if SQL is either logged or buffered. Callers check
+        this before formatting their statements, so a disabled sql log
+        costs nothing::
+
+           if sqllog:
+              print >> sqllog, command
+        """
+        return self.verbose or self.buffer_size > 0
         
     sql_element_re = re.compile(r"('.*?'|[^ \n]+)", re.DOTALL)
     def normalize_sql_whitespace(self, sql):
@@ -214,6 +225,9 @@ class _sql(logstream):
         return join(result, " ")
     
     def write(self, s):
+        if not self:
+            return
+        
         t = self.normalize_sql_whitespace(s)
         if s[-1] == "\n":
             s = t + "\n"
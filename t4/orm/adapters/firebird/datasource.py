@@ -42,6 +42,10 @@ import datatypes
 
 class datasource(orm2.datasource.datasource_base):
 
+    # Firebird knows only single-row INSERTs and fetches generator values
+    # one by one in insert() anyway
+    multi_row_insert = False
+
     encodings = {"ascii": "ascii",
                  "iso8859_1": "iso-8859-1",
                  "iso8859_2": "iso-8859-2",
@@ -59,6 +59,9 @@ class datasource(datasource_base):
     An orm database adapter for gadfly.
     """
     no_fetchone = True
+
+    # Gadfly knows only single-row INSERTs
+    multi_row_insert = False
     
     def __init__(self, dbname="tmp", directory="/tmp",
                  encoding = "iso-8859-1"):
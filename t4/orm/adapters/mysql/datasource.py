@@ -206,4 +206,37 @@ class datasource(t4.orm.datasource.datasource_base, sql.mysql_backend):
         
         return where
 
+    def select_after_insert_many_clauses(self, relation, dbobjs):
+        """
+        After a multi-row INSERT, LAST_INSERT_ID() returns the
+        AUTO_INCREMENT value of the first row. The others follow
+        auto_increment_increment apart, which is more than 1 on
+        multi-master setups.
+        """
+        dbobj = dbobjs[0]
+        if dbobj.__primary_key__ is None: return None
+        
+        primary_key_attributes = tuple(dbobj.__primary_key__.attributes())
+        if len(primary_key_attributes) != 1: return None
+        primary_key_attribute = primary_key_attributes[0]
+        
+        if isinstance(primary_key_attribute, datatypes.auto_increment) or \
+               isinstance(primary_key_attribute, common_serial):
+            column = primary_key_attribute.column
+            increment = int(self.query_one(
+                    "SELECT @@auto_increment_increment"))
+            where = sql.where(column, " >= LAST_INSERT_ID() AND ",
+                              column, " < LAST_INSERT_ID() + ",
+                              sql.integer_literal(len(dbobjs) * increment))
+            if increment > 1:
+                # Skip the rows inserted by other connections (or
+                # servers) in between.
+                where = sql.where.and_(where, sql.where(
+                        "MOD(", column, " - LAST_INSERT_ID(), ",
+                        sql.integer_literal(increment), ") = 0"))
+                
+            return ( where, sql.order_by(column), )
+        else:
+            return None
+
 
@@ -34,6 +34,7 @@ It works with psycopg (in theory), psycopg2 and bpqsql.
 
 # Python
 import sys, re
+from collections import OrderedDict
 from types import *
 from string import *
 
@@ -80,9 +81,49 @@ import datatypes
 
 _typeoid = {}
 
+_placeholder_re = re.compile(r"%(%|s)")
+_explain_rows_re = re.compile(r"rows=(\d+)")
+
+def _numbered_placeholders(command):
+    """
+    Replace the pyformat placeholders in COMMAND with PostgreSQL's
+    numbered parameters ($1, $2, ...) as used by PREPARE.
+    """
+    count = [ 0, ]
+    def replace(match):
+        if match.group(1) == "%":
+            return "%"
+        else:
+            count[0] += 1
+            return "$%i" % count[0]
+        
+    return _placeholder_re.sub(replace, command)
+
+class cursor_wrapper(sql.cursor_wrapper):
+    """
+    A cursor wrapper that runs bound statements (see t4.sql.bound) as
+    prepared statements if its datasource's prepare_statements
+    attribute is set.
+    """
+    def execute(self, command, params=None):
+        if self._ds.prepare_statements and isinstance(command, sql.bound):
+            command, params = self._ds.__prepared__(self, command)
+            
+        sql.cursor_wrapper.execute(self, command, params)
+
 class datasource(t4.orm.datasource.datasource_base, sql.pgsql_backend):
     _dbfailures = 0
     _ERRORS_BEFORE_RECONNECT = 50
+    _stream_cursor_counter = 0
+
+    # If set, bound statements, that is the ORM's primary key SELECTs,
+    # select_after_insert() and UPDATEs, are PREPAREd once per
+    # connection and run through EXECUTE afterwards.
+    prepare_statements = False
+
+    # Maximum number of statements prepared on a connection. The least
+    # recently used ones are DEALLOCATEd.
+    prepared_statements_max = 100
     
     # Map PostgreSQL to Python encoding names. (From the PostgreSQL
     # documentation)
@@ -196,6 +237,10 @@ class datasource(t4.orm.datasource.datasource_base, sql.pgsql_backend):
             
         self._dsn = dsn        
         self._encoding = None
+        self._column_types = {}
+        self._prepared = OrderedDict()
+        self._prepared_counter = 0
+        self._deallocate_all = False
         self.connect()
 
     def _from_params(params):
@@ -265,7 +310,65 @@ class datasource(t4.orm.datasource.datasource_base, sql.pgsql_backend):
             
         return self._modify_cursor
 
-    def execute(self, query, cursor=None):
+    def cursor(self):
+        """
+        Return a newly created dbi cursor that knows about prepared
+        statements.
+        """
+        return cursor_wrapper(self, self._dbconn().cursor())
+
+    def stream_cursor(self, batch_size):
+        """
+        Return a named (server side) psycopg2 cursor, which retrieves
+        BATCH_SIZE rows per round trip. Other DBAPI modules get a
+        regular cursor. Bound statements are not prepared on these
+        cursors, because DECLARE needs the query itself.
+        """
+        if psycopg2_version is None:
+            return self.cursor()
+        
+        self._stream_cursor_counter += 1
+        cursor = self._dbconn().cursor("t4_stream_%i" %
+                                       self._stream_cursor_counter)
+        cursor.itersize = batch_size
+        return sql.cursor_wrapper(self, cursor)
+    
+    def __prepared__(self, cursor, statement):
+        """
+        Return a pair as ( command, params, ) that EXECUTEs the prepared
+        version of STATEMENT, a sql.bound instance, with its literals as
+        parameters. If the statement has not been prepared on this
+        connection, yet, it is PREPAREd using CURSOR.
+        """
+        runner = sql.sql(self, parameterized=True)
+        command = runner(statement)
+        
+        name = self._prepared.pop(command, None)
+        if name is None:
+            if self._deallocate_all:
+                # The connection has been used by someone else before.
+                cursor.execute("DEALLOCATE ALL")
+                self._deallocate_all = False
+                
+            while len(self._prepared) >= self.prepared_statements_max:
+                old_command, old_name = self._prepared.popitem(last=False)
+                cursor.execute("DEALLOCATE " + old_name)
+
+            self._prepared_counter += 1
+            name = "t4_prepared_%i" % self._prepared_counter
+            cursor.execute("PREPARE %s AS %s" % (
+                name, _numbered_placeholders(command), ))
+
+        # (Re-)inserting the command makes it the most recently used.
+        self._prepared[command] = name
+
+        if len(runner.params) == 0:
+            return "EXECUTE " + name, ()
+        else:
+            return "EXECUTE %s (%s)" % ( name, join(
+                    [ "%s", ] * len(runner.params), ", "), ), runner.params
+
+    def execute(self, query, params=(), modify=False, on_primary=False):
         """
         Run a query on the database connection.
 
@@ -275,8 +378,8 @@ class datasource(t4.orm.datasource.datasource_base, sql.pgsql_backend):
         if type(query) == UnicodeType:
             query = query.encode(self.backend_encoding())            
         try:            
-            cursor = t4.orm.datasource.datasource_base.execute(self,
-                                                               query, cursor)
+            cursor = t4.orm.datasource.datasource_base.execute(
+                self, query, params, modify, on_primary)
             
         except dbapi.ProgrammingError, err:
             # In any case rollback the current transaction.
@@ -300,16 +403,63 @@ class datasource(t4.orm.datasource.datasource_base, sql.pgsql_backend):
                     self.connect()
                 except:
                     raise sys.exc_type, sys.exc_value, sys.exc_traceback
-                
-                cursor.execute(query)
+
+                # Statements prepared on the new connection by connect()
+                # are prepared again on first use.
+                cursor = t4.orm.datasource.datasource_base.execute(
+                    self, query, params, modify)
             else:
                 raise sys.exc_type, sys.exc_value, sys.exc_traceback
             
         return cursor 
     
+    def estimate_count(self, select):
+        """
+        Return the planner's estimate of the number of rows SELECT
+        returns. For a single relation without clauses this is
+        pg_class.reltuples, as maintained by VACUUM and ANALYZE,
+        otherwise the row count of the top node of the select's EXPLAIN
+        output. Returns None if there is no estimate.
+        """
+        relations = select.relations
+        if type(relations) in ( TupleType, ListType, ) and \
+               len(relations) == 1:
+            relations = relations[0]
+
+        if len(select.clauses) == 0 and \
+               not isinstance(relations, sql.subquery_as_relation) and \
+               isinstance(relations, ( StringType, sql.relation, )):
+            query = sql.select(sql.expression("reltuples::bigint"),
+                               sql.relation("pg_class"),
+                               sql.where("oid = ",
+                                         sql.string_literal(str(relations)),
+                                         "::regclass"))
+            row = self.query_one(query)
+            # reltuples is -1 (0 before PostgreSQL 14) for relations
+            # that have never been analyzed.
+            if row and row[0] > 0:
+                return int(row[0])
+
+        runner = sql.sql(self)
+        command = runner(select)
+        cursor = self.execute("EXPLAIN " + command, runner.params)
+        plan = cursor.fetchone()
+        cursor.close()
+        
+        if plan is not None:
+            match = _explain_rows_re.search(plan[0])
+            if match is not None:
+                return int(match.group(1))
+            
+        return None
+
     def connect(self):
         if self._dsn is not None:
             self._conn = dbapi.connect(self._dsn)
+            
+            # Prepared statements don't survive the connection.
+            self._prepared = OrderedDict()
+            self._modify_cursor = None
 
 
     def backend_version(self):
@@ -404,7 +554,125 @@ class datasource(t4.orm.datasource.datasource_base, sql.pgsql_backend):
             raise PrimaryKeyNotKnown()
         
         return where
-    
+
+    def _insert_many(self, relation, columns, dbobjs, values, dont_select):
+        """
+        PostgreSQL returns the values provided by the backend for all
+        rows of a multi-row INSERT through its RETURNING clause, in the
+        order of the VALUES.
+        """
+        need_select = []
+        returning = []
+        for dbobj in dbobjs:
+            if dont_select or dbobj.__primary_key__ is None:
+                properties = []
+            else:
+                properties = filter(lambda p: p.__select_after_insert__(dbobj),
+                                    dbobj.__dbproperties__())
+            need_select.append(properties)
+
+            for property in properties:
+                if property not in returning:
+                    returning.append(property)
+
+        runner = sql.sql(self)
+        command = runner(sql.insert(relation, columns, *values))
+        if len(returning) > 0:
+            command += " RETURNING " + join(map(
+                lambda p: runner(p.column), returning), ", ")
+
+        cursor = self.execute(command, runner.params)
+        for dbobj in dbobjs:
+            dbobj.__insert__(self)
+
+        if len(returning) > 0:
+            result = cursor.fetchall()
+            if len(result) != len(dbobjs):
+                raise ObjectWasNotInserted()
+
+            for dbobj, properties, tpl in zip(dbobjs, need_select, result):
+                for property, value in zip(returning, tpl):
+                    if property in properties:
+                        property.__set_from_result__(self, dbobj, value)
+
+    def column_types(self, relation):
+        """
+        Return a dict as { 'column_name': 'sql type' } for RELATION,
+        as reported by the system catalog. The result is cached.
+        """
+        runner = sql.sql(self)
+        relation_name = runner(relation)
+
+        if not self._column_types.has_key(relation_name):
+            query = sql.select( ( "attname",
+                                  "format_type(atttypid, atttypmod)", ),
+                                "pg_catalog.pg_attribute",
+                                sql.where("attrelid = ",
+                                          sql.string_literal(relation_name),
+                                          "::regclass AND attnum > 0 ",
+                                          "AND NOT attisdropped") )
+            cursor = self.execute(query)
+            self._column_types[relation_name] = dict(cursor.fetchall())
+
+        return self._column_types[relation_name]
+
+    def batch_update(self, cursor, relation, key_columns, columns, rows):
+        """
+        Use PostgreSQL's UPDATE ... FROM (VALUES ...) to update several
+        rows with one statement. The values are cast to the column
+        types found in the system catalog, because PostgreSQL would
+        otherwise take quoted literals for text.
+        """
+        types = self.column_types(relation)
+
+        def type_name(column):
+            # Unquoted identifyers are folded to lower case by PostgreSQL
+            name = column._name.name()
+            if not column._name.quotes(): name = lower(name)
+            return name
+        
+        names = map(type_name, key_columns + columns)
+
+        if len(rows) == 1 or filter(lambda n: not types.has_key(n), names):
+            t4.orm.datasource.datasource_base.batch_update(
+                self, cursor, relation, key_columns, columns, rows)
+            return
+
+        runner = sql.sql(self)
+
+        def value_sql(value):
+            if isinstance(value, sql.expression):
+                return "(%s)" % runner(value)
+            else:
+                return runner(value)
+
+        values = []
+        for key_literals, literals in rows:
+            values.append("(%s)" % join(map(value_sql,
+                                            key_literals + literals), ", "))
+
+        aliases = map(lambda idx: "_k%i" % idx, range(len(key_columns))) + \
+                  map(lambda idx: "_c%i" % idx, range(len(columns)))
+
+        assignments = []
+        for column, alias in zip(columns, aliases[len(key_columns):]):
+            assignments.append("%s = _v.%s::%s" % (
+                runner(column._name), alias, types[type_name(column)], ))
+
+        conditions = []
+        for column, alias in zip(key_columns, aliases):
+            conditions.append("_t.%s = _v.%s::%s" % (
+                runner(column._name), alias, types[type_name(column)], ))
+
+        command = "UPDATE %s AS _t SET %s FROM (VALUES %s) AS _v(%s) " \
+                  "WHERE %s" % ( runner(relation),
+                                 join(assignments, ", "),
+                                 join(values, ", "),
+                                 join(aliases, ", "),
+                                 join(conditions, " AND "), )
+
+        cursor.execute(command, runner.params)
+
     def string_quotes(self, string):
         if "\\" in string:
             return "E'%s'" % string
@@ -424,6 +692,7 @@ class zpsycopg_db_conn(datasource):
         self._ERRORS_BEFORE_RECONNECT = 3
         
     def _dbconn(self):
+        self._check_thread()
         if self._conn is None:
             zpsycopg_obj = self.context.restrictedTraverse(
                 self.ds_name)
@@ -480,66 +749,3 @@ class zpsycopg_db_conn(datasource):
         db = getattr(self._conn, "db", None)
         if db is not None:
             db.rollback()
-        
-
-try:
-    from psycopg2.pool import ThreadedConnectionPool
-    
-    class pool:
-        class pooled_ds(datasource):
-            def __init__(self, pool, backend_encoding):
-                t4.orm.datasource.datasource_base.__init__(self)
-                
-                self._pool = pool
-                self._conn = pool.getconn()
-                self._encoding = backend_encoding
-
-            def __enter__(self):
-                return self
-
-            def __exit__(self, type, value, tb):
-                self.rollback()
-                self._pool.putconn(self._conn)
-
-        def __init__(self, params, min=4, max=10):
-            if params.has_key("db"):
-                dbname = params["db"]
-                del params["db"]
-                params["dbname"] = dbname
-
-            pool = params["pool"]
-            pool_params_re = re.compile(r"(\d+),(\d+)")
-            match = pool_params_re.match(pool)
-            if match is not None:
-                min, max = match.groups()
-                min = int(min)
-                max = int(min)
-            else:
-                min = 5
-                max = 10
-                
-            del params["pool"]
-                
-            dsn = []
-            for a in params.items():
-                dsn.append("%s=%s" % a)
-                
-            dsn = join(dsn, " ")
-            
-            self.pool = ThreadedConnectionPool(min, max, dsn)
-            self._backend_encoding = None
-
-        def ds(self):
-            ds = self.pooled_ds(self.pool, self._backend_encoding)
-            if self._backend_encoding is None:
-                self._backend_encoding = ds.backend_encoding()
-            return ds
-
-        __call__ = ds
-        
-except ImportError:
-    pass
-    
-        
-
-
@@ -115,7 +115,14 @@ class money_literal(sql.literal):
     database and converted to MONEY there. 
     """
     def __init__(self, value):
-        sql.literal.__init__(self, str(value) + "::money")
+        self._content = str(value)
+        sql.literal.__init__(self, self._content + "::money")
+
+    def __sql__(self, runner):
+        if runner.parameterized:
+            return runner.param(self._content) + "::money"
+        else:
+            return self._sql
 
 
 class money(datatype):
@@ -131,8 +138,8 @@ class money(datatype):
         return value
 
     def __set_from_result__(self, ds, dbobj, value):
-        setattr(dbobj, self.data_attribute_name(),
-                self.__convert__(value))    
+        self.store_value(dbobj,
+                         self.__convert__(value))    
 
     def select_expression(self, dbclass, full_column_names):
         identifyer = "%s-money-expression" % self.column.name()
@@ -175,7 +182,14 @@ def _pair_of_floats(p):
     
 class point_literal(sql.literal):    
     def __init__(self, p):
-        self._sql = "POINT( %f, %f )" % _pair_of_floats(p)
+        self._content = _pair_of_floats(p)
+        self._sql = "POINT( %f, %f )" % self._content
+
+    def __sql__(self, runner):
+        if runner.parameterized:
+            return "POINT( %s, %s )" % tuple(map(runner.param, self._content))
+        else:
+            return self._sql
 
 class point(datatype):
     """
@@ -200,7 +214,10 @@ class uuid_literal(sql.literal):
         self._content = u
 
     def __sql__(self, runner):
-        return "'" + str(self._content) + "'"
+        if runner.parameterized:
+            return runner.param(str(self._content))
+        else:
+            return "'" + str(self._content) + "'"
         
 
 class uuid(datatype):
@@ -270,10 +287,10 @@ class tsvector(datatype):
                                  "tsvector_data instance.")
         
             self.check_dbobj(dbobj)
-            setattr(dbobj, self.data_attribute_name(), value)
+            self.store_value(dbobj, value)
                          
     def sql_literal(self, dbobj):
-        data = getattr(dbobj, self.data_attribute_name(), None)
+        data = self.stored_value(dbobj, None)
         return to_tsvector_expression(data.configuration_name,
                                       data.texts)
 
@@ -314,7 +331,7 @@ class json(datatype):
         if value is None and self.empty_object_on_null: value = "{}"
         if type(value) == types.StringType:
             raise ValueError("STRING " + self.attribute_name)
-        setattr(dbobj, self.data_attribute_name(), value)
+        self.store_value(dbobj, value)
 
     def __convert__(self, value):
         """
@@ -352,7 +369,7 @@ class jsonb(json):
         if type(value) == types.StringType:
             raise ValueError("STRING " + self.attribute_name)
         
-        setattr(dbobj, self.data_attribute_name(), value)
+        self.store_value(dbobj, value)
 
     def __convert__(self, value):
         """
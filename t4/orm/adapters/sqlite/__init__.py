@@ -0,0 +1,14 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+t4.orm's SQLite adapter. It uses the sqlite3 module from Python's
+standard library, so it needs no database server and is well suited
+for testing and benchmarking. Use it like this::
+
+   ds = datasource("adapter=sqlite file=/tmp/test.db")
+
+or, for a database that lives in memory only::
+
+   ds = datasource("adapter=sqlite file=:memory:")
+"""
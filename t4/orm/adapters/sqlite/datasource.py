@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file COPYING
+
+__docformat__ = "epytext en"
+
+"""
+This datasource module defines a datasource class for SQLite databases
+using the sqlite3 module.
+
+SQLite stores dates and times as ISO 8601 text. The date, datetime
+and time datatypes parse the strings they retrieve, so no sqlite3
+converters are registered.
+"""
+
+# Python
+from types import *
+from string import *
+
+import sqlite3
+
+# orm
+from t4.orm.exceptions import *
+from t4 import sql
+import t4.orm.datasource
+
+
+class datasource(t4.orm.datasource.datasource_base, sql.sqlite_backend):
+    """
+    An orm database adapter for SQLite.
+    """
+    def __init__(self, file=":memory:", timeout=5.0):
+        """
+        @param file: Name of the database file. The default, ':memory:',
+           creates a database in memory that lives as long as the
+           datasource.
+        @param timeout: Number of seconds to wait for other connections'
+           locks on the database.
+        """
+        t4.orm.datasource.datasource_base.__init__(self)
+
+        self._file = file
+        self._timeout = timeout
+        self.connect()
+
+    def _from_params(params):
+        """
+        A sqlite connection string knows the file and timeout
+        keywords. As an alias for file you may use db or dbname.
+        """
+        file = params.get("file",
+                          params.get("dbname", params.get("db", ":memory:")))
+        timeout = float(params.get("timeout", 5.0))
+        
+        return datasource(file, timeout)
+    from_params = staticmethod(_from_params)
+
+    def _from_connection(conn):
+        ds = datasource.__new__(datasource)
+        t4.orm.datasource.datasource_base.__init__(ds)
+        ds._file = None
+        ds._conn = conn
+        return ds
+    from_connection = staticmethod(_from_connection)
+    
+    def connect(self):
+        # A datasource may be used by several threads one after the
+        # other, when it is pooled for instance (see t4.orm.pool).
+        self._conn = sqlite3.connect(self._file, timeout=self._timeout,
+                                     check_same_thread=False)
+        # Strings are returned as they have been stored (utf-8 encoded,
+        # see backend_encoding()), the Unicode datatype decodes them.
+        self._conn.text_factory = str
+
+    def file(self):
+        """
+        Return the name of the database file this datasource has been
+        initialized with.
+        """
+        return self._file
+
+    def backend_encoding(self):
+        return "utf-8"
+
+    def backend_version(self):
+        return tuple(map(int, split(sqlite3.sqlite_version, ".")))
+
+    def select_after_insert_where(self, dbobj):
+        """
+        If the primary key is known, we use it to identify the new
+        row. Otherwise it is the last one inserted, which works for
+        INTEGER PRIMARY KEY columns as common_serial and serial, which
+        are aliases for SQLite's rowid.
+        """
+        if dbobj.__primary_key__ is None: raise PrimaryKeyNotKnown()
+
+        if dbobj.__primary_key__.isset():
+            return dbobj.__primary_key__.where()
+        else:
+            return sql.where("rowid = last_insert_rowid()")
+
+    def select_after_insert_many_clauses(self, relation, dbobjs):
+        """
+        The rows inserted by a multi-row INSERT get consecutive rowids,
+        the last of which is last_insert_rowid().
+        """
+        return ( sql.where("rowid > last_insert_rowid() - ",
+                           sql.integer_literal(len(dbobjs))),
+                 sql.order_by("rowid"), )
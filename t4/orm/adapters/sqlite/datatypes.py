@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file COPYING
+
+__docformat__ = "epytext en"
+
+"""
+This module implements datatype classes that are specific to SQLite.
+"""
+
+# Python
+import types
+
+# orm
+from t4 import sql
+from t4.orm.datatypes import *
+from t4.orm.exceptions import ORMException, ObjectAlreadyInserted
+
+class SerialNotMutableException(ORMException):
+    pass
+
+class serial(integer):
+    """
+    Datatype class for INTEGER PRIMARY KEY columns, whoes values are
+    provided by SQLite (they are aliases for the rowid).
+    """
+    def __init__(self, column=None):
+        integer.__init__(self, column=column, title=None,
+                         validators=(), has_default=True)
+                
+    def __select_after_insert__(self, dbobj):
+        # When we've already got a value, we can't be inserted again.
+        if self.isset(dbobj):
+            tpl = ( self.attribute_name,
+                    self.dbclass.__name__,
+                    repr(dbobj.__primary_key__), )
+            
+            raise ObjectAlreadyInserted(
+                "Attribute %s of '%s' (%s) has already been set." % tpl)
+        
+        return True
+
+    def __set__(self, dbobj, value):
+        if self.isset(dbobj):
+            raise SerialNotMutableException("A serial property is not "
+                                            "mutable once it is set on object "
+                                            "creation." )
+        else:
+            integer.__set__(self, dbobj, value)
+
+
+class blob_literal(sql.direct_literal):
+    """
+    Binary data is passed to sqlite3 as a parameter, so it is stored
+    as a BLOB.
+    """
+    def __init__(self, bindata):
+        if type(bindata) != types.BufferType:
+            bindata = buffer(bindata)
+            
+        sql.direct_literal.__init__(self, bindata)
+
+class blob(datatype):
+    python_class = str
+    sql_literal_class = blob_literal
+
+binary = blob
@@ -0,0 +1,623 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+
+"""
+This module implements a non-blocking front end for datasources of
+any adapter. An async_datasource runs the DB-API work on a bounded
+number of worker threads, each of which owns a datasource (and
+thereby a connection) created by a factory function. Its methods
+return future objects right away::
+
+   from t4.orm.async_datasource import async_datasource
+
+   ads = async_datasource(
+       lambda: datasource('adapter=pgsql dbname=test'), workers=4)
+
+   cursor = ads.select(person, where).result()
+   for batch in cursor.batches():
+       ...
+
+   tx = ads.transaction()
+   tx.insert(person(name=u'Kai'))
+   tx.flush_updates()
+   tx.commit().result()
+
+All requests of a transaction run on the same worker, which does not
+serve other requests until the transaction is committed or rolled
+back. A cursor returned by select() holds its worker the same way
+until it is exhausted or closed. Objects retrieved through a
+transaction belong to its worker's datasource and should only be
+modified while no request of the transaction is pending.
+
+Each worker binds its datasource to its thread (see
+datasource_base.bind_thread()). The dbobjs a cursor returns must be
+loaded completely on the worker: Lazy loading a relationship, a
+delayed column or a container on any other thread raises
+WrongThread rather than sharing the worker's connection. Pass the
+relationships and delayed columns you are going to use to select()::
+
+   cursor = ads.select(person, where, prefetch=( 'emails', ),
+                       undefer=( 'portrait', )).result()
+
+or load them through a request of the same transaction.
+
+The stats() method reports the number of busy and pinned workers, the
+length of the queue and the time requests spent waiting in it.
+"""
+
+import sys, time, threading
+from collections import deque
+from types import *
+
+from t4.debug import debug
+from exceptions import *
+
+class FutureTimeout(ORMException):
+    """
+    Raised by future.result() if the request has not completed within
+    the timeout.
+    """
+
+class future:
+    """
+    The pending result of a request. The methods resemble those of
+    the futures of Python 3's concurrent.futures module.
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self._done.isSet()
+
+    def result(self, timeout=None):
+        """
+        Wait for the request to complete and return its result or
+        re-raise its exception.
+        """
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        if self._exc_info is None:
+            return None
+        else:
+            return self._exc_info[1]
+
+    def add_done_callback(self, callback):
+        """
+        Call CALLBACK with the future as its argument once the request
+        has completed. The callback runs on the worker thread, or
+        right away, if the future is done already.
+        """
+        self._lock.acquire()
+        try:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        finally:
+            self._lock.release()
+
+        callback(self)
+
+    def _wait(self, timeout):
+        self._done.wait(timeout)
+        if not self.done():
+            raise FutureTimeout("Request not completed after %.1f seconds" % \
+                                    timeout)
+
+    def _set(self, result, exc_info):
+        self._lock.acquire()
+        try:
+            self._result = result
+            self._exc_info = exc_info
+            self._done.set()
+            callbacks = self._callbacks
+            self._callbacks = []
+        finally:
+            self._lock.release()
+
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception, e:
+                print >> debug, "Future callback failed:", repr(e)
+
+class _request:
+    """
+    A function to be called with a worker's datasource, along with the
+    future that receives its result.
+    """
+    def __init__(self, function, session=None, release=False):
+        self.function = function
+        self.session = session
+        self.release = release
+        self.future = future()
+        self.queued = time.time()
+
+class _worker(threading.Thread):
+    def __init__(self, owner, number):
+        threading.Thread.__init__(self, name="async_datasource-%i" % number)
+        self.setDaemon(True)
+        self.owner = owner
+        self.ds = None
+        self.requests = deque() # Requests of the session that pins us
+        self.session = None
+        self.busy = False
+
+    def run(self):
+        owner = self.owner
+        try:
+            self.ds = owner.factory()
+            self.ds.bind_thread(self)
+        except:
+            owner._worker_failed(self, sys.exc_info())
+            return
+
+        while True:
+            request = owner._next_request(self)
+            if request is None: break
+            owner._run(self, request)
+
+        owner._worker_stopped(self)
+        
+        try:
+            self.ds.close()
+        except Exception, e:
+            print >> debug, "Closing worker datasource failed:", repr(e)
+
+class session:
+    """
+    A sequence of requests that run on the same worker. The first
+    request pins a worker to the session, a request submitted with
+    release=True returns it when it is done.
+    """
+    def __init__(self, owner):
+        self.owner = owner
+        self.worker = None
+        self.pending = deque() # Requests submitted before we got a worker
+
+    def submit(self, function, release=False):
+        """
+        Run FUNCTION with the session's datasource and return a future
+        for its result.
+        """
+        return self.owner._submit(_request(function, self, release))
+
+class transaction(session):
+    """
+    A database transaction. Returned by async_datasource.transaction().
+    Committing or rolling it back frees its worker, the transaction
+    may be used again afterwards.
+    """
+    def select(self, dbclass, *clauses, **kw):
+        """
+        Like async_datasource.select(), but the cursor runs in the
+        transaction and does not free the worker when it is done.
+        """
+        return self.owner._select(self, False, dbclass, clauses, kw)
+
+    def insert(self, dbobj, dont_select=False):
+        return self.submit(lambda ds: ds.insert(dbobj, dont_select))
+
+    def execute(self, command, params=(), modify=False):
+        return self.submit(lambda ds: ds.execute(command, params, modify))
+
+    def flush_updates(self):
+        return self.submit(lambda ds: ds.flush_updates())
+
+    def commit(self, *dbobjs):
+        return self.submit(lambda ds: ds.commit(*dbobjs), release=True)
+
+    def rollback(self):
+        return self.submit(lambda ds: ds.rollback(), release=True)
+
+class cursor:
+    """
+    The result of a SELECT query, fetched in batches. Returned by
+    async_datasource.select() and transaction.select().
+    """
+    def __init__(self, session, iterator, batch_size, owns_session):
+        self.session = session
+        self.iterator = iterator
+        self.batch_size = batch_size
+        self.owns_session = owns_session
+        self.closed = False
+
+    def fetch(self):
+        """
+        Return a future for a list of the next batch_size dbobjs. The
+        list is empty once the result is exhausted.
+        """
+        def fetch(ds):
+            ret = []
+            if not self.closed:
+                for dbobj in self.iterator:
+                    ret.append(dbobj)
+                    if len(ret) == self.batch_size: break
+
+            if len(ret) < self.batch_size:
+                self._finish()
+                
+            return ret
+
+        return self.session.submit(fetch)
+
+    def batches(self, timeout=None):
+        """
+        Iterate over the result's batches, waiting for each of them.
+        The next batch is requested before the current one is yielded.
+        """
+        next = self.fetch()
+        while True:
+            batch = next.result(timeout)
+            if not batch: break
+            next = self.fetch()
+            yield batch
+
+    def __iter__(self):
+        for batch in self.batches():
+            for dbobj in batch:
+                yield dbobj
+
+    def close(self):
+        """
+        Discard the rest of the result and free the worker.
+        """
+        return self.session.submit(lambda ds: self._finish())
+
+    def _finish(self):
+        # Runs on the worker. A request submitted after the cursor has
+        # finished may have pinned a worker again, so release anyway.
+        self.closed = True
+        self.iterator = None
+        if self.owns_session and self.session.worker is not None:
+            self.session.owner._release(self.session.worker)
+        
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+class async_datasource:
+    """
+    Run requests on a datasource per worker thread.
+    """
+    def __init__(self, factory, workers=4, queue_size=None,
+                 batch_size=100):
+        """
+        @param factory: Function that returns a new datasource. It is
+           called on each worker thread.
+        @param workers: Number of worker threads and datasources.
+        @param queue_size: Maximum number of requests waiting for a
+           worker. If the queue is full, submitting blocks. Requests of
+           a session that holds a worker are not counted. None means
+           no limit.
+        @param batch_size: Default number of dbobjs a cursor fetches
+           at a time.
+        """
+        if workers < 1:
+            raise ValueError("Illegal number of workers: %i" % workers)
+        
+        self.factory = factory
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+
+        self._lock = threading.Condition(threading.Lock())
+        self._queue = deque()
+        self._closing = False
+        self._failure = None
+        self._running = workers
+        
+        self._stats = { "submitted": 0,
+                        "completed": 0,
+                        "failed": 0,
+                        "max_queued": 0,
+                        "queue_full_waits": 0,
+                        "wait_time": 0.0,
+                        "max_wait_time": 0.0,
+                        "run_time": 0.0, }
+        
+        self._workers = []
+        for a in range(workers):
+            worker = _worker(self, a)
+            self._workers.append(worker)
+            worker.start()
+
+    def submit(self, function):
+        """
+        Run FUNCTION with the datasource of the next free worker and
+        return a future for its result.
+        """
+        return self._submit(_request(function))
+
+    def transaction(self):
+        return transaction(self)
+    
+    def select(self, dbclass, *clauses, **kw):
+        """
+        Return a future for a cursor that fetches the dbobjs selected
+        by ds.select(dbclass, *clauses, **kw). The cursor holds its
+        worker until it is exhausted or closed. The dbobjs remain bound
+        to the worker's thread; use the prefetch and undefer keyword
+        arguments for what they need to have loaded.
+
+        @param batch_size: Number of dbobjs per batch, defaults to the
+           async_datasource's batch_size.
+        """
+        return self._select(session(self), True, dbclass, clauses, kw)
+
+    def insert(self, dbobj, dont_select=False):
+        """
+        Insert DBOBJ and commit.
+        """
+        def insert(ds):
+            ds.insert(dbobj, dont_select)
+            ds.commit()
+        return self.submit(insert)
+
+    def execute(self, command, params=(), modify=False):
+        """
+        Execute COMMAND and commit.
+        """
+        def execute(ds):
+            ds.execute(command, params, modify)
+            ds.commit()
+        return self.submit(execute)
+
+    def stats(self):
+        """
+        Return a dict containing the number of workers, busy and pinned
+        workers, queued requests, the maximum number of requests that
+        were queued, requests submitted, completed and failed, how
+        often submitting waited for a full queue, the total and maximum
+        time in seconds requests waited for a worker and the total time
+        workers spent running requests.
+        """
+        self._lock.acquire()
+        try:
+            ret = self._stats.copy()
+            ret["workers"] = len(self._workers)
+            ret["busy"] = len(filter(lambda w: w.busy, self._workers))
+            ret["pinned"] = len(filter(lambda w: w.session is not None,
+                                       self._workers))
+            ret["queued"] = len(self._queue)
+        finally:
+            self._lock.release()
+
+        return ret
+
+    def close(self, wait=True):
+        """
+        Stop the workers once the queued requests have been run and
+        close their datasources. Workers held by a session run the
+        requests the session has submitted so far and stop. Requests
+        that are still queued when the last worker has stopped fail.
+        """
+        self._lock.acquire()
+        try:
+            self._closing = True
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+        if wait:
+            for worker in self._workers:
+                if worker is not threading.current_thread():
+                    worker.join()
+
+    # Internals.
+    
+    def _select(self, session, owns_session, dbclass, clauses, kw):
+        batch_size = kw.pop("batch_size", self.batch_size)
+        def select(ds):
+            iterator = iter(ds.select(dbclass, *clauses, **kw))
+            return cursor(session, iterator, batch_size, owns_session)
+
+        ret = session.submit(select)
+        if owns_session:
+            # Free the worker if the query fails.
+            def failed(future):
+                if future.exception() is not None:
+                    session.submit(lambda ds: None, release=True)
+            ret.add_done_callback(failed)
+                
+        return ret
+
+    def _submit(self, request):
+        self._lock.acquire()
+        try:
+            if self._closing:
+                raise ORMException("async_datasource has been closed.")
+            if self._running == 0:
+                if self._failure is not None:
+                    raise self._failure[0], self._failure[1], \
+                          self._failure[2]
+                raise ORMException("async_datasource has no workers left.")
+
+            self._stats["submitted"] += 1
+            
+            session = request.session
+            if session is not None and session.worker is not None:
+                session.worker.requests.append(request)
+            elif session is not None and session.pending:
+                # The session's first request is still queued.
+                session.pending.append(request)
+            else:
+                if self.queue_size is not None:
+                    if len(self._queue) >= self.queue_size:
+                        self._stats["queue_full_waits"] += 1
+                    while len(self._queue) >= self.queue_size:
+                        self._lock.wait()
+                        
+                self._queue.append(request)
+                if session is not None:
+                    session.pending.append(request)
+                self._stats["max_queued"] = max(self._stats["max_queued"],
+                                                len(self._queue))
+            
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+        return request.future
+
+    def _next_request(self, worker):
+        """
+        Return the next request for WORKER, or None if it should stop.
+        """
+        self._lock.acquire()
+        try:
+            while True:
+                if worker.requests:
+                    request = worker.requests.popleft()
+                    break
+                
+                if worker.session is None and self._queue:
+                    request = self._queue.popleft()
+                    session = request.session
+                    if session is not None:
+                        # Pin the worker and move the session's other
+                        # requests over.
+                        session.worker = worker
+                        worker.session = session
+                        session.pending.popleft()
+                        worker.requests.extend(session.pending)
+                        session.pending.clear()
+                    break
+
+                if self._closing:
+                    return None
+                
+                self._lock.wait()
+
+            wait = time.time() - request.queued
+            self._stats["wait_time"] += wait
+            self._stats["max_wait_time"] = max(self._stats["max_wait_time"],
+                                               wait)
+            worker.busy = True
+            self._lock.notifyAll() # There may be room in the queue.
+            return request
+        finally:
+            self._lock.release()
+
+    def _run(self, worker, request):
+        start = time.time()
+        try:
+            result = request.function(worker.ds)
+            exc_info = None
+        except:
+            result = None
+            exc_info = sys.exc_info()
+
+        if request.release:
+            self._release(worker)
+            
+        self._lock.acquire()
+        try:
+            worker.busy = False
+            self._stats["run_time"] += time.time() - start
+            if exc_info is None:
+                self._stats["completed"] += 1
+            else:
+                self._stats["failed"] += 1
+        finally:
+            self._lock.release()
+
+        request.future._set(result, exc_info)
+
+    def _release(self, worker):
+        """
+        Free WORKER from its session. Requests the session submits
+        later on pin the next free worker.
+        """
+        self._lock.acquire()
+        try:
+            session = worker.session
+            if session is None: return
+            
+            worker.session = None
+            session.worker = None
+
+            # Requests submitted meanwhile start the session over.
+            leftover = list(worker.requests)
+            worker.requests.clear()
+            if leftover:
+                first = leftover[0]
+                self._queue.append(first)
+                session.pending.extend(leftover)
+                
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+    def _worker_failed(self, worker, exc_info):
+        """
+        The factory has failed on WORKER. Later submissions re-raise
+        its exception.
+        """
+        self._lock.acquire()
+        try:
+            self._failure = exc_info
+            self._workers.remove(worker)
+        finally:
+            self._lock.release()
+
+        self._worker_stopped(worker)
+        
+    def _worker_stopped(self, worker):
+        """
+        Fail the queued requests, if WORKER has been the last one.
+        """
+        self._lock.acquire()
+        try:
+            self._running -= 1
+            if self._running > 0: return
+
+            requests = list(self._queue)
+            self._queue.clear()
+            for w in self._workers:
+                requests.extend(w.requests)
+                w.requests.clear()
+            self._lock.notifyAll()
+        finally:
+            self._lock.release()
+
+        for request in requests:
+            try:
+                raise ORMException("async_datasource has no workers left.")
+            except ORMException:
+                request.future._set(None, sys.exc_info())
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+
+"""
+This package contains benchmarks for t4.orm. Each workload sets up an
+SQLite :memory: database (or none at all), runs a reproducible
+operation on it and reports how many operations per second it
+performed, how many queries it sent and how much memory it needed::
+
+   python -m t4.orm.benchmark -o current.json
+   python -m t4.orm.benchmark -b baseline.json -t 0.2
+
+The second call exits with status 1 if a result is worse than the
+baseline's, so it may be run in a continuous integration job. The
+workloads are defined in L{t4.orm.benchmark.workloads}.
+
+Each measurement is run in a forked child process, so that its peak
+memory is not inflated by those run before and a workload that leaks
+does not affect the others.
+"""
+
+import sys, os, time, json, platform, resource, traceback
+
+from t4.profiler import query_profiler
+
+class workload:
+    """
+    Base class for the benchmark workloads. For each measurement a
+    fresh instance is created, connect()ed, setup() and run().
+    """
+    name = None
+    sizes = ( 1000, )
+    description = ""
+
+    def connect(self):
+        """
+        Return the datasource the workload runs on.
+        """
+        from t4.orm.datasource import datasource
+        return datasource("adapter=sqlite")
+
+    def setup(self, ds, size):
+        """
+        Create the tables and data the workload needs. Not measured.
+        """
+        pass
+
+    def run(self, ds, size):
+        """
+        Perform the measured operation and return the number of
+        operations performed.
+        """
+        raise NotImplementedError()
+
+def _rss_kb():
+    """
+    Return the current resident set size in kilobytes, if the
+    platform tells us, or None.
+    """
+    return _proc_status("VmRSS")
+
+def _peak_kb():
+    """
+    Return the peak resident set size since the last _reset_peak() in
+    kilobytes.
+    """
+    ret = _proc_status("VmHWM")
+    if ret is None:
+        ret = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin": ret = ret / 1024
+    return ret
+
+def _reset_peak():
+    # Linux resets VmHWM if 5 is written to clear_refs.
+    try:
+        fp = open("/proc/self/clear_refs", "w")
+        try:
+            fp.write("5")
+        finally:
+            fp.close()
+    except (IOError, OSError):
+        pass
+
+def _proc_status(field):
+    try:
+        fp = open("/proc/self/status")
+    except IOError:
+        return None
+
+    try:
+        for line in fp:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    finally:
+        fp.close()
+
+    return None
+
+def _measure(workload_class, size):
+    workload = workload_class()
+    ds = workload.connect()
+    workload.setup(ds, size)
+
+    profiler = query_profiler(n_plus_one_threshold=sys.maxint)
+    
+    _reset_peak()
+    before = _rss_kb() or _peak_kb()
+    profiler.start()
+    try:
+        start = time.time()
+        ops = workload.run(ds, size)
+        seconds = time.time() - start
+    finally:
+        profiler.stop()
+    peak = _peak_kb()
+        
+    return { "workload": workload.name,
+             "size": size,
+             "ops": ops,
+             "seconds": seconds,
+             "ops_per_sec": ops / max(seconds, 1e-9),
+             "queries": sum(map(lambda d: d["count"], profiler.stats())),
+             "peak_memory_kb": max(peak - before, 0), }
+
+def measure(workload_class, size, fork=True):
+    """
+    Run one measurement of WORKLOAD_CLASS with SIZE and return a dict
+    with the keys workload, size, ops, seconds, ops_per_sec, queries
+    and peak_memory_kb. The latter is the growth of the resident set
+    while the workload ran.
+
+    @param fork: Run the measurement in a child process, if the
+       platform supports it.
+    """
+    if not fork or not hasattr(os, "fork"):
+        return _measure(workload_class, size)
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        try:
+            ret = _measure(workload_class, size)
+        except:
+            ret = { "error": traceback.format_exc() }
+
+        fp = os.fdopen(write_fd, "w")
+        fp.write(json.dumps(ret))
+        fp.close()
+        os._exit(0)
+
+    os.close(write_fd)
+    fp = os.fdopen(read_fd)
+    data = fp.read()
+    fp.close()
+    os.waitpid(pid, 0)
+
+    if not data:
+        raise RuntimeError("Benchmark process for %s died." % \
+                               workload_class.name)
+    
+    ret = json.loads(data)
+    if ret.has_key("error"):
+        raise RuntimeError("%s failed in the benchmark process:\n%s" % (
+            workload_class.name, ret["error"], ))
+    return ret
+    
+def run(workload_classes, scale=1.0, repeat=1, fork=True, log=None):
+    """
+    Measure each of the WORKLOAD_CLASSES for each of their sizes and
+    return a report dict containing information about the environment
+    and a list of results (see measure()). If a measurement is
+    repeated, the one with the most ops_per_sec is reported.
+
+    @param scale: Factor the workloads' sizes are multiplied with.
+    @param log: File object each result is printed to, as it comes in.
+    """
+    import sqlite3
+    
+    results = []
+    for workload_class in workload_classes:
+        for size in workload_class.sizes:
+            size = max(1, int(size * scale))
+
+            best = None
+            for a in range(repeat):
+                result = measure(workload_class, size, fork)
+                if best is None or result["ops_per_sec"] > best["ops_per_sec"]:
+                    best = result
+            
+            results.append(best)
+            if log is not None: print >> log, format_result(best)
+
+    return { "python": sys.version.split()[0],
+             "platform": platform.platform(),
+             "sqlite": sqlite3.sqlite_version,
+             "scale": scale,
+             "repeat": repeat,
+             "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+             "results": results, }
+
+def format_result(result):
+    return "%-20s %8i %12.0f ops/sec %8i queries %10i kB" % (
+        result["workload"], result["size"], result["ops_per_sec"],
+        result["queries"], result["peak_memory_kb"], )
+
+def compare(baseline, report, tolerance=0.2, memory_slack_kb=1024):
+    """
+    Compare the results of REPORT to those in BASELINE for the same
+    workload and size and return a list of messages for each
+    regression: ops_per_sec dropped by more than TOLERANCE (a fraction
+    of the baseline's), more queries were sent, or peak memory grew by
+    more than TOLERANCE and more than MEMORY_SLACK_KB. Results missing
+    from either report are ignored.
+    """
+    known = {}
+    for result in baseline["results"]:
+        known[(result["workload"], result["size"])] = result
+
+    ret = []
+    for result in report["results"]:
+        key = ( result["workload"], result["size"], )
+        if not known.has_key(key): continue
+        before = known[key]
+        name = "%s (%i)" % key
+
+        if result["ops_per_sec"] < before["ops_per_sec"] * (1.0 - tolerance):
+            ret.append("%s: %.0f ops/sec, baseline %.0f" % (
+                name, result["ops_per_sec"], before["ops_per_sec"], ))
+
+        if result["queries"] > before["queries"]:
+            ret.append("%s: %i queries, baseline %i" % (
+                name, result["queries"], before["queries"], ))
+
+        growth = result["peak_memory_kb"] - before["peak_memory_kb"]
+        if growth > memory_slack_kb and \
+               growth > before["peak_memory_kb"] * tolerance:
+            ret.append("%s: %i kB peak memory, baseline %i kB" % (
+                name, result["peak_memory_kb"], before["peak_memory_kb"], ))
+
+    return ret
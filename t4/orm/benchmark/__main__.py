@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+
+"""
+Usage: python -m t4.orm.benchmark [options] [workload ...]
+
+Run the benchmark workloads (all by default) and write the results as
+JSON. If a baseline is given, exit with status 1 if any result is
+worse than the baseline's.
+"""
+
+import sys, json, optparse
+
+from t4.orm.benchmark import run, compare
+from t4.orm.benchmark.workloads import workloads, by_name
+
+def main():
+    parser = optparse.OptionParser(__doc__.strip())
+    parser.add_option("-o", "--output", default=None,
+                      help="Write the JSON report to this file "
+                      "(default: stdout)")
+    parser.add_option("-b", "--baseline", default=None,
+                      help="Compare the results to this JSON report")
+    parser.add_option("-t", "--tolerance", type="float", default=0.2,
+                      help="Fraction by which ops/sec may drop and peak "
+                      "memory may grow before a result is reported as a "
+                      "regression (default: %default)")
+    parser.add_option("-s", "--scale", type="float", default=1.0,
+                      help="Factor the workloads' sizes are multiplied "
+                      "with (default: %default)")
+    parser.add_option("-r", "--repeat", type="int", default=1,
+                      help="Run each measurement this many times and "
+                      "report the fastest (default: %default)")
+    parser.add_option("-l", "--list", action="store_true", default=False,
+                      help="List the workloads and exit")
+    parser.add_option("-q", "--quiet", action="store_true", default=False,
+                      help="Do not print the results to stderr as they "
+                      "come in")
+    options, args = parser.parse_args()
+
+    if options.list:
+        for workload in workloads:
+            print "%-20s %s" % ( workload.name, workload.description, )
+        return 0
+    
+    if args:
+        try:
+            selected = by_name(args)
+        except ValueError, e:
+            parser.error(str(e))
+    else:
+        selected = workloads
+
+    if options.quiet:
+        log = None
+    else:
+        log = sys.stderr
+        
+    report = run(selected, options.scale, options.repeat, log=log)
+
+    if options.output is None:
+        print json.dumps(report, indent=2, sort_keys=True)
+    else:
+        fp = open(options.output, "w")
+        json.dump(report, fp, indent=2, sort_keys=True)
+        fp.close()
+
+    if options.baseline is not None:
+        baseline = json.load(open(options.baseline))
+        regressions = compare(baseline, report, options.tolerance)
+        for message in regressions:
+            print >> sys.stderr, "Regression:", message
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+
+"""
+The benchmark workloads. The data they create only depends on the
+size, so that runs are comparable. Setting up a workload is not
+measured.
+"""
+
+from t4 import sql
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import common_serial, integer, Unicode, char, \
+     Float, text, delayed
+from t4.orm.relationships import one2many
+from t4.orm.containers import sqltuple
+from t4.orm.datasource import datasource_base
+
+from t4.orm.benchmark import workload
+
+class person(dbobject):
+    id = common_serial()
+    firstname = Unicode()
+    lastname = Unicode()
+    height = integer()
+    gender = char(1)
+    weight = Float()
+
+class country(dbobject):
+    id = common_serial()
+    name = text()
+
+class city(dbobject):
+    id = common_serial()
+    name = text()
+    country_id = integer()
+
+country.cities = one2many(city)
+
+class document(dbobject):
+    id = common_serial()
+    title = text()
+    body = delayed(text(), group="content")
+    
+class member(dbobject):
+    id = common_serial()
+    name = text()
+    tags = sqltuple("tag", text(column="name"), child_key="member_id")
+
+class fake_datasource(datasource_base):
+    """
+    A datasource without a database for the in-memory workloads.
+    """
+    def backend_encoding(self):
+        return "utf-8"
+
+def rows(count):
+    return [ ( i, "Diedrich", "Vorberg", 186, "m", 80.5, )
+             for i in xrange(count) ]
+
+def people(count):
+    return [ person(firstname=u"Diedrich", lastname=u"Vorberg",
+                    height=150 + i % 50, gender="m", weight=80.5)
+             for i in xrange(count) ]
+
+def dict_per_row(ds, data):
+    """
+    Create a dbobject for each of the tuples in DATA the way
+    result.next() used to: through a dict per row.
+    """
+    columns = person.__select_expressions__(True)
+    for tpl in data:
+        person.__from_result__(ds, dict(zip(columns, tpl)))
+
+def materializer(ds, data):
+    """
+    Create a dbobject for each of the tuples in DATA through the
+    dbclass' materializer.
+    """
+    materialize = person.__materializer__(
+        person.__select_expressions__(True))
+    for tpl in data:
+        materialize(ds, tpl)
+
+def create_people(ds, count):
+    ds.execute("""CREATE TABLE person (
+                     id INTEGER PRIMARY KEY,
+                     firstname TEXT,
+                     lastname TEXT,
+                     height INTEGER,
+                     gender TEXT,
+                     weight REAL
+                  )""")
+    ds.cursor().executemany("INSERT INTO person VALUES (?, ?, ?, ?, ?, ?)",
+                            rows(count))
+    ds.commit()
+
+    
+class materialize_in_memory(workload):
+    name = "materializer"
+    sizes = ( 10000, 100000, 1000000, )
+    description = "Turn result tuples into dbobjs without a database."
+    
+    def connect(self):
+        return fake_datasource()
+
+    def setup(self, ds, size):
+        self.data = rows(size)
+
+    def run(self, ds, size):
+        materializer(ds, self.data)
+        return size
+
+class dict_per_row_in_memory(materialize_in_memory):
+    name = "dict_per_row"
+    description = "Turn result tuples into dbobjs through a dict per row."
+
+    def run(self, ds, size):
+        dict_per_row(ds, self.data)
+        return size
+
+class select(workload):
+    name = "select"
+    sizes = ( 10000, 100000, 1000000, )
+    description = "SELECT rows and materialize them."
+
+    def setup(self, ds, size):
+        create_people(ds, size)
+
+    def run(self, ds, size):
+        ret = 0
+        for dbobj in ds.select(person):
+            ret += 1
+        return ret
+
+class insert(workload):
+    name = "insert"
+    sizes = ( 10000, )
+    description = "insert() one dbobj at a time."
+
+    def setup(self, ds, size):
+        create_people(ds, 0)
+        self.people = people(size)
+
+    def run(self, ds, size):
+        for dbobj in self.people:
+            ds.insert(dbobj)
+        ds.commit()
+        return size
+
+class insert_many(insert):
+    name = "insert_many"
+    description = "insert_many() dbobjs using multi-row INSERTs."
+    
+    def run(self, ds, size):
+        ds.insert_many(self.people)
+        ds.commit()
+        return size
+
+class update(workload):
+    name = "update"
+    sizes = ( 10000, )
+    description = "Modify dbobjs and flush one UPDATE per dbobj."
+    batch = False
+    
+    def setup(self, ds, size):
+        create_people(ds, size)
+        self.people = list(ds.select(person))
+
+    def run(self, ds, size):
+        for dbobj in self.people:
+            dbobj.height = dbobj.height + 1
+        ds.flush_updates(batch=self.batch)
+        ds.commit()
+        return size
+
+class batch_update(update):
+    name = "batch_update"
+    description = "Modify dbobjs and flush them with batched UPDATEs."
+    batch = True
+
+class n_plus_one(workload):
+    name = "n_plus_one"
+    sizes = ( 1000, )
+    description = "Traverse one2many relationships, one query per parent."
+    cities_per_country = 10
+    
+    def setup(self, ds, size):
+        ds.execute("CREATE TABLE country (id INTEGER PRIMARY KEY, name TEXT)")
+        ds.execute("""CREATE TABLE city (
+                         id INTEGER PRIMARY KEY,
+                         name TEXT,
+                         country_id INTEGER
+                      )""")
+        cursor = ds.cursor()
+        cursor.executemany("INSERT INTO country VALUES (?, ?)",
+                           [ ( i, "Country %i" % i, )
+                             for i in xrange(1, size+1) ])
+        cursor.executemany("INSERT INTO city (name, country_id) VALUES (?, ?)",
+                           [ ( "City %i" % i, i % size + 1, )
+                             for i in xrange(size * self.cities_per_country) ])
+        ds.commit()
+
+    def countries(self, ds):
+        return ds.select(country)
+        
+    def run(self, ds, size):
+        for parent in self.countries(ds):
+            for child in parent.cities:
+                pass
+        return size
+    
+class prefetch(n_plus_one):
+    name = "prefetch"
+    description = "Traverse one2many relationships, prefetched."
+    
+    def countries(self, ds):
+        return ds.select(country, prefetch=( "cities", ))
+
+class delayed_columns(workload):
+    name = "delayed"
+    sizes = ( 10000, )
+    description = "Read a delayed column, one query per dbobj."
+
+    def setup(self, ds, size):
+        ds.execute("""CREATE TABLE document (
+                         id INTEGER PRIMARY KEY,
+                         title TEXT,
+                         body TEXT
+                      )""")
+        ds.cursor().executemany("INSERT INTO document VALUES (?, ?, ?)",
+                                [ ( i, "Doc %i" % i, "Body %i " % i * 20, )
+                                  for i in xrange(1, size+1) ])
+        ds.commit()
+
+    def documents(self, ds):
+        return ds.select(document)
+        
+    def run(self, ds, size):
+        for dbobj in self.documents(ds):
+            dbobj.body
+        return size
+
+class undefer(delayed_columns):
+    name = "undefer"
+    description = "Read a delayed column, undeferred for the result."
+
+    def documents(self, ds):
+        return ds.select(document, undefer=( "body", ))
+
+class container_writes(workload):
+    name = "container_writes"
+    sizes = ( 1000, )
+    description = "Replace the contents of a sqltuple and flush."
+
+    def setup(self, ds, size):
+        ds.execute("CREATE TABLE member (id INTEGER PRIMARY KEY, name TEXT)")
+        ds.execute("CREATE TABLE tag (member_id INTEGER, name TEXT)")
+        cursor = ds.cursor()
+        cursor.executemany("INSERT INTO member VALUES (?, ?)",
+                           [ ( i, "Member %i" % i, )
+                             for i in xrange(1, size+1) ])
+        cursor.executemany("INSERT INTO tag VALUES (?, ?)",
+                           [ ( i, tag, )
+                             for i in xrange(1, size+1)
+                             for tag in ( "a", "b", "c", ) ])
+        ds.commit()
+        self.members = list(ds.select(member))
+
+    def run(self, ds, size):
+        for dbobj in self.members:
+            dbobj.tags = ( "b", "c", "d", "e", )
+        ds.flush_updates()
+        ds.commit()
+        return size
+
+# In the order they are run.
+workloads = [ materialize_in_memory, dict_per_row_in_memory, select,
+              insert, insert_many, update, batch_update, n_plus_one,
+              prefetch, delayed_columns, undefer, container_writes, ]
+
+def by_name(names):
+    """
+    Return the workloads with the given NAMES.
+    """
+    known = dict(map(lambda w: ( w.name, w, ), workloads))
+    ret = []
+    for name in names:
+        if not known.has_key(name):
+            raise ValueError("Unknown workload: %s" % repr(name))
+        ret.append(known[name])
+    return ret
@@ -29,6 +29,17 @@
 These classes are very simmilar to relationships in that they manage two
 relations. The child relation however is not represented by a dbclass,
 but only by a Python type. 
+
+Changes to a container are not written immediately. The container
+remembers the contents it loaded from the database and registers the
+dbobj with its datasource, which calls the container's __flush__()
+from flush_updates(). __flush__() compares the old and the new
+contents and sends only the difference: one multi-row INSERT per
+insert_chunk_size new rows, one DELETE per prefetch_chunk_size
+obsolete values and, for sqldicts, one batch_update() per
+update_batch_size modified values. The containers also have a
+__prefetch__() method, so result.prefetch() can load them for a whole
+result at once.
 """
 
 # Python
@@ -38,7 +49,7 @@ from types import *
 # t4
 from t4 import sql
 from dbobject import dbobject
-from datatypes import datatype
+from datatypes import datatype, UNSET
 from exceptions import *
 import keys
 
@@ -111,6 +122,114 @@ class _container(datatype):
         """
         return sql.where( self.child_key, " = ",
                           dbobj.__primary_key__.sql_literal() )
+
+    def __register_write__(self, dbobj, original):
+        """
+        Register dbobj with its datasource to have this container's
+        changes written by flush_updates(). ORIGINAL is a callable that
+        returns the contents as they are in the database; it is only
+        called for the first change since the last flush.
+        """
+        if not dbobj.__is_stored__():
+            raise ObjectMustBeInserted("...before you modify %s" % \
+                                           self.attribute_name)
+
+        ds = dbobj.__ds__()
+        if not ds.__container_change_pending__(dbobj, self):
+            ds.__register_container_change__(dbobj, self, original())
+        
+    def __flush__(self, ds, cursor, dbobj, original):
+        """
+        Write the difference between the ORIGINAL contents and the
+        current ones to the database using CURSOR.
+        """
+        raise NotImplementedError()
+
+    def __discard_write__(self, dbobj):
+        """
+        Called by rollback() for a change that has not been flushed.
+        The contents are unset and loaded from the database again on
+        next access.
+        """
+        self.store_value(dbobj, UNSET)
+
+    def __loaded__(self, ds, dbobjs):
+        """
+        Yield ( dbobj, rows, ) pairs for those DBOBJS whoes contents
+        have not been loaded, yet. ROWS is a list of the child rows
+        without the child_key column.
+        """
+        wanted = {}
+        for dbobj in dbobjs:
+            if self.isset(dbobj):
+                continue
+            wanted[dbobj.__primary_key__.value()] = ( dbobj, [], )
+
+        if len(wanted) == 0:
+            return
+
+        key_attribute = wanted.values()[0][0].__primary_key__.attribute()
+        key_values = wanted.keys()
+        size = ds.prefetch_chunk_size
+        for a in range(0, len(key_values), size):
+            literals = map(key_attribute.sql_literal_class,
+                           key_values[a:a+size])
+            query = sql.select(( sql.column(self.child_key), ) + \
+                                   self.child_columns(),
+                               self.child_relation,
+                               sql.where.in_(sql.column(self.child_key),
+                                             literals),
+                               getattr(self, "orderby", None))
+            for row in ds.execute(query).fetchall():
+                key = key_attribute.__convert__(row[0])
+                if wanted.has_key(key):
+                    wanted[key][1].append(row[1:])
+
+        for dbobj, rows in wanted.values():
+            yield dbobj, rows
+
+    def _insert(self, ds, cursor, columns, rows):
+        """
+        INSERT ROWS, tuples of literals matching the child_key and
+        COLUMNS, into the child relation.
+        """
+        columns = ( self.child_key, ) + tuple(columns)
+        if ds.multi_row_insert:
+            size = ds.insert_chunk_size
+        else:
+            size = 1
+            
+        for a in range(0, len(rows), size):
+            cursor.execute(sql.insert(self.child_relation, columns,
+                                      *rows[a:a+size]))
+
+    def _delete(self, ds, cursor, dbobj, column, literals):
+        """
+        DELETE those child rows of DBOBJ whoes COLUMN has one of the
+        values in LITERALS.
+        """
+        size = ds.prefetch_chunk_size
+        for a in range(0, len(literals), size):
+            chunk = literals[a:a+size]
+            
+            in_ = filter(lambda literal: literal is not sql.NULL, chunk)
+            if len(in_) == 0:
+                where = sql.where(column, " IS NULL")
+            else:
+                where = sql.where.in_(column, in_)
+                if len(in_) < len(chunk):
+                    where = sql.where.or_(where,
+                                          sql.where(column, " IS NULL"))
+                    
+            cursor.execute(sql.delete(self.child_relation, 
+                                      sql.where.and_(self.child_where(dbobj),
+                                                     where)))
+        
+    def _literal(self, datatype, value):
+        if value is None:
+            return sql.NULL
+        else:
+            return datatype.sql_literal_class(value)
         
 
 class sqltuple(_container):
@@ -144,10 +263,11 @@ class sqltuple(_container):
 
     An sqltuple is not mutable (i.e. a tuple and not a list), so you
     can't set any member of the tupe as in t[3] = 'Hallo'. To append a
-    value you must say dbobj.tpl += ( "Hallo", ). The program will do
-    the right thing and only create as many INSERT statements as
-    strings added. For all other operations all rows referenced by the
-    parent's key will be DELETEd and INSERTed again.
+    value you must say dbobj.tpl += ( "Hallo", ). Since the order of
+    the child rows is determined by the orderby parameter, the tuple is
+    written as a multiset: values that occur more often than before
+    are INSERTed, values that occur less often are DELETEd and
+    INSERTed as often as they remain.
 
     The sqltuple dbattribute may be set to any iterable that yields
     values of the appropriate type. It will always return a Python
@@ -174,18 +294,23 @@ class sqltuple(_container):
         self.check_dbobj(dbobj)
 
         if self.isset(dbobj):
-            return getattr(dbobj, self.data_attribute_name())
+            return self.stored_value(dbobj)
         else:
             # Consturct the SQL query
-            query = sql.select( self.child_column.column,
-                                self.child_relation,
-                                self.child_where(dbobj),
-                                self.orderby )
+            def build(literal):
+                return sql.select( self.child_column.column,
+                                   self.child_relation,
+                                   sql.where( self.child_key, " = ", literal ),
+                                   self.orderby )
+            
+            query = sql.bound(( "sqltuple", dbobj.__class__,
+                                self.attribute_name, ),
+                              build, ( dbobj.__primary_key__.sql_literal(), ))
             cursor = dbobj.__ds__().execute(query)
             ret = map(lambda tpl: self.child_column.__convert__(tpl[0]),
                       cursor.fetchall())
             ret = tuple(ret)
-            setattr(dbobj, self.data_attribute_name(), ret)
+            self.store_value(dbobj, ret)
             return ret
 
     def __set__(self, dbobj, new_values):
@@ -205,46 +330,55 @@ class sqltuple(_container):
 
             new.append(value)
 
-        # Let's see if it's just an addition of values. In that case
-        # we'll not delete anything, just create a couple of INSERT
-        # statements.
-        
-        if self.isset(dbobj):
-           dont_delete = True
-           old = getattr(dbobj, self.data_attribute_name())
-           
-           if len(old) <= len(new):
-              for o, n in zip(old, new):
-                 if o != n:
-                    dont_delete = False
-                    break
-        else:
-           old = ()
-           dont_delete = False
-           
-        if dont_delete:
-            to_insert = new[len(old):]
-        else:
-            to_insert = new
+        self.__register_write__(dbobj, lambda: self.__get__(dbobj))
+        self.store_value(dbobj, tuple(new))
 
-            dbobj.__ds__().execute(sql.delete(self.child_relation,
-                                              self.child_where(dbobj)))
-        
-        for value in to_insert:
-            if value is None:
-                literal = sql.NULL
+    def child_columns(self):
+        return ( self.child_column.column, )
+
+    def __flush__(self, ds, cursor, dbobj, original):
+        old_counts = _counts(original)
+        new_counts = _counts(self.stored_value(dbobj))
+
+        obsolete = []
+        to_insert = []
+        for value, count in new_counts.items():
+            old_count = old_counts.get(value, 0)
+            if count < old_count:
+                obsolete.append(value)
+                to_insert += [ value, ] * count
             else:
-                literal = self.child_column.sql_literal_class(value)
-                
-            dbobj.__ds__().execute(
-                sql.insert(self.child_relation,
-                           ( self.child_key,
-                             self.child_column.column, ),
-                           ( dbobj.__primary_key__.sql_literal(),
-                             literal, ) ))
-            
-        setattr(dbobj, self.data_attribute_name(), tuple(new))
+                to_insert += [ value, ] * (count - old_count)
+
+        for value in old_counts.keys():
+            if not new_counts.has_key(value):
+                obsolete.append(value)
+
+        literal = lambda value: self._literal(self.child_column, value)
+        if len(obsolete) > 0:
+            self._delete(ds, cursor, dbobj, self.child_column.column,
+                         map(literal, obsolete))
+
+        if len(to_insert) > 0:
+            key_literal = dbobj.__primary_key__.sql_literal()
+            self._insert(ds, cursor, self.child_columns(),
+                         map(lambda value: ( key_literal, literal(value), ),
+                             to_insert))
+
+    def __prefetch__(self, ds, dbobjs):
+        """
+        Load the tuples of all of DBOBJS at once.
+        """
+        for dbobj, rows in self.__loaded__(ds, dbobjs):
+            self.store_value(dbobj, tuple(map(
+                        lambda row: self.child_column.__convert__(row[0]),
+                        rows)))
             
+def _counts(values):
+    ret = {}
+    for value in values:
+        ret[value] = ret.get(value, 0) + 1
+    return ret
 
 class sqldict(_container):
    """
@@ -310,7 +444,7 @@ class sqldict(_container):
         self.check_dbobj(dbobj)
 
         if self.isset(dbobj):
-            return getattr(dbobj, self.data_attribute_name())
+            return self.stored_value(dbobj)
         else:
             # Consturct the SQL query
             query = sql.select( ( self.child_key_column.column,
@@ -323,7 +457,7 @@ class sqldict(_container):
                            self.child_value_column.__convert__(tpl[1]), ),
                       cursor.fetchall())
             ret = self.sqldict_dict(self, dbobj, dict(ret))
-            setattr(dbobj, self.data_attribute_name(), ret)
+            self.store_value(dbobj, ret)
             return ret
 
 
@@ -333,122 +467,125 @@ class sqldict(_container):
 
        self.check_dbobj(dbobj)
 
-       if self.isset(dbobj):
-           # We have a new version of the dict in memory and can compare
-           # values against it.
-           old_dict = getattr(dbobj, self.data_attribute_name())
-           old_dict.update(new_dict)
-
-           new_keys = set(new_dict.keys())
-           old_keys = set(old_dict.keys())
-           obsolete_keys = old_keys.difference(new_keys)
-
-           for key in obsolete_keys:
-               old_dict[key]
-       else:
-           if dbobj.__ds__():
-               raise ValueError("Can’t initialize a sqldict on "
-                                "dbobject creation, only after insert().")
-           
-           # Convert each of the keys and values in the new dict to the
-           # appropriate types and run the validators on each of the values.
-           new = {}
-           for key, value in new_dict.items():
-              key = self.child_key_column.__convert__(key)
-              value = self.child_value_column.__convert__(value)
-
-              for validator in self.child_key_column.validators:
-                 validator.check(dbobj, self, key)
-
-              for validator in self.child_value_column.validators:
-                 validator.check(dbobj, self, value)
-
-              new[key] = value
-
-           # Delete the rows currently in the database
-           dbobj.__ds__().execute(sql.delete(self.child_relation,
-                                             self.child_where(dbobj)))
-
-           # And insert new ones
-           for key, value in new.items():
-              key_literal = self.child_key_column.sql_literal_class(
-                  self.child_key_column.__convert__(key))
-
-              if value is None:
-                 value_literal = sql.NULL
-              else:
-                 value_literal = self.child_value_column.sql_literal_class(
-                     self.child_value_column.__convert__(value))
-
-              query = sql.insert( self.child_relation,
-                                  ( self.child_key,
-                                    self.child_key_column.column,
-                                    self.child_value_column.column, ),
-                                  ( dbobj.__primary_key__.sql_literal(),
-                                    key_literal, value_literal, ) )
-              dbobj.__ds__().execute(query)
-
-              setattr(dbobj, self.data_attribute_name(),
-                      self.sqldict_dict(self, dbobj, new))
-            
+       new = self.sqldict_dict(self, dbobj)
+       for key, value in new_dict.items():
+           key, value = new.__check__(key, value)
+           dict.__setitem__(new, key, value)
+
+       self.__register_write__(dbobj, lambda: dict(self.__get__(dbobj)))
+       self.store_value(dbobj, new)
+
+   def child_columns(self):
+       return ( self.child_key_column.column,
+                self.child_value_column.column, )
+
+   def __flush__(self, ds, cursor, dbobj, original):
+       new = self.stored_value(dbobj)
+       key_literal = lambda key: self._literal(self.child_key_column, key)
+       value_literal = lambda value: self._literal(self.child_value_column,
+                                                   value)
+       parent_literal = dbobj.__primary_key__.sql_literal()
+
+       obsolete = filter(lambda key: not new.has_key(key), original.keys())
+       if len(obsolete) > 0:
+           self._delete(ds, cursor, dbobj, self.child_key_column.column,
+                        map(key_literal, obsolete))
+
+       to_insert = []
+       to_update = []
+       for key, value in new.items():
+           if not original.has_key(key):
+               to_insert.append( ( parent_literal, key_literal(key),
+                                   value_literal(value), ) )
+           elif original[key] != value:
+               to_update.append( ( ( parent_literal, key_literal(key), ),
+                                   ( value_literal(value), ), ) )
+
+       if len(to_insert) > 0:
+           self._insert(ds, cursor, self.child_columns(), to_insert)
+
+       key_columns = ( sql.column(self.child_key),
+                       self.child_key_column.column, )
+       size = ds.update_batch_size
+       for a in range(0, len(to_update), size):
+           ds.batch_update(cursor, self.child_relation, key_columns,
+                           ( self.child_value_column.column, ),
+                           to_update[a:a+size])
+
+   def __prefetch__(self, ds, dbobjs):
+       """
+       Load the dicts of all of DBOBJS at once.
+       """
+       for dbobj, rows in self.__loaded__(ds, dbobjs):
+           data = map(lambda (key, value):
+                          ( self.child_key_column.__convert__(key),
+                            self.child_value_column.__convert__(value), ),
+                      rows)
+           self.store_value(dbobj, self.sqldict_dict(self, dbobj, dict(data)))
 
    class sqldict_dict(dict):
+      """
+      The dict a sqldict attribute returns. Modifications are recorded
+      with the datasource and written on its next flush_updates().
+      """
       def __init__(self, sqldict, dbobj, data={}):
          dict.update(self, data)
          self._sqldict = sqldict
          self._dbobj = dbobj
-         
-      def __setitem__(self, key, value):
-         key_column = self._sqldict.child_key_column.column         
-         for validator in self._sqldict.child_key_column.validators:
-             validator.check(self._dbobj, self._sqldict.child_key_column, key)
-         key_literal = self._sqldict.child_key_column.sql_literal_class(
-             self._sqldict.child_key_column.__convert__(key))
-
-         value_column = self._sqldict.child_value_column.column
-         for validator in self._sqldict.child_value_column.validators:
-             validator.check(self._dbobj, self._sqldict.child_value_column,
-                             value)         
-         value_literal = self._sqldict.child_value_column.sql_literal_class(
-             self._sqldict.child_value_column.__convert__(value))         
 
-         if self.has_key(key):
-             if self[key] != value:
-                 where = sql.where.and_(self._sqldict.child_where(self._dbobj),
-                                        sql.where(key_column, "=", key_literal))
-             
-                 command = sql.update(self._sqldict.child_relation, where,
-                                      { str(value_column): value_literal })
-             else:
-                 command = None
-         else:
-             command = sql.insert( self._sqldict.child_relation,
-                                   ( self._sqldict.child_key,
-                                     key_column,
-                                     value_column, ),
-                                   ( self._dbobj.__primary_key__.sql_literal(),
-                                     key_literal, value_literal, ) )
-
-         if command is not None:
-             self._dbobj.__ds__().execute(command)
+      def __check__(self, key, value):
+         """
+         Convert KEY and VALUE and run the validators on them.
+         """
+         key_column = self._sqldict.child_key_column
+         value_column = self._sqldict.child_value_column
+
+         key = key_column.__convert__(key)
+         if value is not None:
+            value = value_column.__convert__(value)
             
-         dict.__setitem__(self, key, value)
+         for validator in key_column.validators:
+             validator.check(self._dbobj, key_column, key)
+         for validator in value_column.validators:
+             validator.check(self._dbobj, value_column, value)
 
-      def __delitem__(self, key):
-         key_column = self._sqldict.child_key_column.column
-         key_literal = self._sqldict.child_key_column.sql_literal_class(key)
+         return key, value
 
-         where = self.child_where(dbobj) + sql.where(
-             key_column, " = ", key_literal)
-         
-         dbobj.__ds__().execute(sql.delete(self.child_relation, where))
+      def __register_write__(self):
+         self._sqldict.__register_write__(self._dbobj, lambda: dict(self))
          
-         dict.__delitem__(self, key)
+      def __setitem__(self, key, value):
+         key, value = self.__check__(key, value)
+         if not self.has_key(key) or self[key] != value:
+            self.__register_write__()
+            dict.__setitem__(self, key, value)
 
+      def __delitem__(self, key):
+         self.__register_write__()
+         dict.__delitem__(self, key)
 
-      def update(self, other):
-          for key, value in other.items():
+      def update(self, other={}, **kw):
+          for key, value in dict(other, **kw).items():
               self[key] = value
 
-
-
+      def pop(self, key, *default):
+         if self.has_key(key):
+            self.__register_write__()
+         return dict.pop(self, key, *default)
+
+      def popitem(self):
+         if len(self) > 0:
+            self.__register_write__()
+         return dict.popitem(self)
+
+      def clear(self):
+         if len(self) > 0:
+            self.__register_write__()
+         dict.clear(self)
+
+      def setdefault(self, key, value=None):
+         key, value = self.__check__(key, value)
+         if not self.has_key(key):
+            self.__register_write__()
+            dict.__setitem__(self, key, value)
+         return self[key]
@@ -36,11 +36,12 @@ conveniance classes for managing query results.
 
 # Python
 from types import *
-import string
+import re, string, weakref, threading
+from collections import OrderedDict
 
 # t4
 from t4 import sql, stupid_dict
-import keys
+import keys, pagination, result_cache, projection
 from exceptions import *
 
 def datasource(connection_string="", **kwargs):
@@ -54,7 +55,11 @@ def datasource(connection_string="", **kwargs):
 
       adapter  - name of the ORM adapter used. Use the name from the
                  adapters/ directory.
-      pool     - User datasource pool (requires psycopg2)           
+      pool     - Return a t4.orm.pool.pool of datasources rather than a
+                 datasource. The value is min,max (like 2,10) or
+                 anything else for the default sizes.
+      pool_timeout - Number of seconds the pool waits for a free
+                 datasource.
       db       - name of the database to connect to
       user     - Database username
       password - Password used for authentication
@@ -66,6 +71,12 @@ def datasource(connection_string="", **kwargs):
       debug    - if set SQL queries will be printed to stdout (actually
                  the debug.debug function is called so you can overload
                  it)
+      file     - name of the database file (sqlite only, defaults to
+                 :memory:)
+      parameterized - if set to anything but 0, false, no or off, all
+                 literals will be passed to the DBAPI module as query
+                 parameters instead of being escaped into the SQL (see
+                 the sql.sql class)
 
     Each of the database backends may define its own keywords. For
     instance PostgreSQL will understand each of the original keywords
@@ -107,42 +118,61 @@ def datasource(connection_string="", **kwargs):
 
     del params["adapter"]
 
-    if params.has_key("pool"):
-        if adapter == "pgsql":
-            try:
-                from t4.orm.adapters.pgsql.datasource import pool
-            except ImportError:
-                raise IllegalConnectionString(
-                    "No pool module. Psycopg2 not installed?")
-        else:
-            raise IllegalConnectionString(
-                "No pool module for this adapter: %s"\
-                    % adapter)
-
-        return pool(params)
+    if params.has_key("parameterized"):
+        parameterized = string.lower(str(params["parameterized"])) not in (
+            "0", "false", "no", "off", )
+        del params["parameterized"]
     else:
-        if adapter == "gadfly":
-            from t4.orm.adapters.gadfly.datasource import datasource
-        elif adapter == "pgsql":
-            from t4.orm.adapters.pgsql.datasource import datasource
-        elif adapter == "mysql":
-            from t4.orm.adapters.mysql.datasource import datasource        
-        elif adapter == "firebird":
-            from t4.orm.adapters.firebird.datasource import datasource
-        else:
-            raise IllegalConnectionString("Unknown adapter: %s" % adapter)
+        parameterized = False
+    
+    if adapter == "gadfly":
+        from t4.orm.adapters.gadfly.datasource import datasource
+    elif adapter == "pgsql":
+        from t4.orm.adapters.pgsql.datasource import datasource
+    elif adapter == "mysql":
+        from t4.orm.adapters.mysql.datasource import datasource        
+    elif adapter == "firebird":
+        from t4.orm.adapters.firebird.datasource import datasource
+    elif adapter == "sqlite":
+        from t4.orm.adapters.sqlite.datasource import datasource
+    else:
+        raise IllegalConnectionString("Unknown adapter: %s" % adapter)
 
-        if params.has_key("debug"):
-            debug = True
-            del params["debug"]
-        else:
-            debug = False
+    if params.has_key("debug"):
+        debug = True
+        del params["debug"]
+    else:
+        debug = False
 
-        ds = datasource.from_params(params)
+    def create():
+        # from_params() may modify the dict.
+        ds = datasource.from_params(params.copy())
         ds._debug = debug
-        
+        ds.parameterized = parameterized
         return ds
+        
+    if params.has_key("pool"):
+        from pool import pool
+        
+        match = re.match(r"(\d+),(\d+)$", str(params["pool"]))
+        if match is None:
+            min, max = 1, 10
+        else:
+            min, max = map(int, match.groups())
+        del params["pool"]
+
+        timeout = params.pop("pool_timeout", None)
+        if timeout is not None: timeout = float(timeout)
+
+        return pool(create, min, max, timeout)
+    else:
+        return create()
     
+# See datasource_base.is_read()
+_read_re = re.compile(r"\s*(?:EXPLAIN\s+)?(?:SELECT|WITH)\b", re.IGNORECASE)
+_not_read_re = re.compile(r"\b(?:INSERT|UPDATE|DELETE|MERGE|INTO|SHARE|"
+                          r"NEXTVAL|SETVAL)\b", re.IGNORECASE)
+
 class datasource_base:
     """
     The DataSource encapsulates the functionality we need to talk to the
@@ -155,21 +185,229 @@ class datasource_base:
     the methods the sql module depends upon.
     """
     _format_funcs = {}
+
+    # Batched flushing of UPDATEs, see flush_updates()
+    batch_updates = False
+    update_batch_size = 500
+
+    # See insert_many()
+    multi_row_insert = True
+    insert_chunk_size = 500
+
+    # See enable_identity_map()
+    _identity_map = None
+
+    # See enable_result_cache()
+    _result_cache = None
+
+    # Read replicas, see add_replica()
+    _replicas = ()
+    replica_policy = "round_robin"
+    
+    # Set by the first write of a transaction, which makes reads stick
+    # to the primary until commit() or rollback().
+    _wrote = False
+
+    # Number of statements executing on this datasource as a replica,
+    # see least_busy_replica().
+    _executing = 0
+
+    # Maximum number of keys in one IN (...) when prefetching relationships
+    prefetch_chunk_size = 500
+
+    # Number of rows results retrieve with each cursor.fetchmany()
+    fetch_batch_size = 500
+
+    # See bind_thread()
+    _thread = None
     
     def __init__(self):
         self._conn = None
         self._debug = 0
         self._modify_cursor = None
         self._changed_dbobjs = set()
+        self._changed_containers = OrderedDict()
+        self._replicas = []
+        self._failed_replicas = []
+        self._replica_counter = 0
+        self._executing_lock = threading.Lock()
+        self._modifications = {}
 
     def __register_change_of__(self, dbobj):
         self._changed_dbobjs.add(dbobj)
+
+    def __register_container_change__(self, dbobj, container, original):
+        """
+        Have CONTAINER's changes on DBOBJ written by the next
+        flush_updates(). ORIGINAL are the contents as stored in the
+        database. See L{t4.orm.containers}.
+        """
+        key = ( id(dbobj), container.attribute_name, )
+        self._changed_containers[key] = ( dbobj, container, original, )
+
+    def __container_change_pending__(self, dbobj, container):
+        return self._changed_containers.has_key(
+            ( id(dbobj), container.attribute_name, ))
+
+    def enable_identity_map(self, enable=True):
+        """
+        Turn the identity map on or off. With the identity map on, each
+        row is represented by one Python object as long as that object
+        is referenced anywhere: Results return the dbobj already known
+        for a primary key instead of creating a new one and
+        select_by_primary_key() (and hence many2one) will not query the
+        database for dbobjs it knows. The map holds weak references
+        only. It is cleared on rollback().
+        """
+        if enable:
+            if self._identity_map is None:
+                self._identity_map = weakref.WeakValueDictionary()
+        else:
+            self._identity_map = None
+
+    def clear_identity_map(self):
+        """
+        Forget all the dbobjs in the identity map, if it is turned on.
+        """
+        if self._identity_map is not None:
+            self._identity_map.clear()
+
+    def enable_result_cache(self, enable=True, max_size=1000, ttl=None,
+                            ttls={}, clear_on_commit=False,
+                            clear_on_rollback=True):
+        """
+        Turn the result cache on or off. With the cache on, the rows
+        returned by the queries of select(), run_select() and count()
+        are kept in memory (see L{t4.orm.result_cache}), so running the
+        same query again will only rebuild the dbobjs. The entries are
+        invalidated whenever execute() or flush_updates() modify a
+        relation they read from. Turning the cache on again discards
+        its contents.
+
+        @param max_size: Maximum number of queries cached. The least
+           recently used entries are evicted first.
+        @param ttl: Default time to live of the entries in seconds,
+           None meaning forever, 0 meaning not at all.
+        @param ttls: Dict mapping dbclasses to their time to live.
+        @param clear_on_commit: Empty the cache on commit().
+        @param clear_on_rollback: Empty the cache on rollback().
+        """
+        if enable:
+            self._result_cache = result_cache.result_cache(
+                max_size, ttl, ttls, clear_on_commit, clear_on_rollback)
+        else:
+            self._result_cache = None
+
+    def result_cache_stats(self):
+        """
+        Return the result cache's stats() or None, if the cache is
+        turned off.
+        """
+        if self._result_cache is None:
+            return None
+        else:
+            return self._result_cache.stats()
+
+    def _cached_rows(self, dbclass, query):
+        """
+        Return the rows QUERY returns, a SELECT for DBCLASS, from the
+        result cache. On a miss the query is run and its rows
+        stored. If the query may not be cached, return None.
+        """
+        cache = self._result_cache
+        ttl = cache.ttl(dbclass)
+        if ttl == 0:
+            return None
+
+        runner = sql.sql(self)
+        command = runner(query)
+        
+        relations = result_cache.read_relations(command)
+        if relations is None:
+            return None
+        relations.add(result_cache.relation_name(dbclass.__relation__))
+
+        key = ( command, tuple(runner.params), )
+        
+        rows = cache.get(key)
+        if rows is None:
+            rows = self.execute(command, runner.params).fetchall()
+            rows = tuple(map(tuple, rows))
+            cache.put(key, relations, rows, ttl)
+
+        return rows
+    
+    def __identify__(self, dbobj):
+        """
+        Return the dbobj known by the identity map for DBOBJ's class and
+        primary key. If there is none, DBOBJ is registered and returned.
+        """
+        if self._identity_map is None or dbobj.__primary_key__ is None \
+               or not dbobj.__primary_key__.isset():
+            return dbobj
+
+        key = ( dbobj.__class__, dbobj.__primary_key__.values(), )
+        known = self._identity_map.get(key, None)
+        if known is None:
+            self._identity_map[key] = dbobj
+            return dbobj
+        else:
+            return known
+
+    def __identity_key__(self, dbclass, key):
+        """
+        Return the identity map's key for the dbobj of DBCLASS identified
+        by KEY, a Python value or tuple as for select_by_primary_key().
+        """
+        if type(key) != TupleType: key = ( key, )
+        primary_key = keys.primary_key(dbclass)
+
+        if len(key) != len(primary_key.key_attributes):
+            msg = "The primary key for %s must have %i elements." % \
+                     ( repr(dbclass), len(primary_key.key_attributes), )
+            raise IllegalPrimaryKey(msg)
+
+        values = []
+        for property, value in zip(primary_key.attributes(), key):
+            values.append(property.__convert__(value))
+
+        return ( dbclass, tuple(values), )
+
+    def __known_dbobj__(self, dbclass, key):
+        """
+        Return the dbobj of DBCLASS identified by KEY from the identity
+        map or None, if it is not known or the map is turned off.
+        """
+        if self._identity_map is None:
+            return None
+        else:
+            return self._identity_map.get(self.__identity_key__(dbclass, key),
+                                          None)
         
     def _dbconn(self):
         """
         Return the dbconn for this ds
         """
+        self._check_thread()
         return self._conn
+
+    def bind_thread(self, thread):
+        """
+        Restrict the use of this datasource's connection (and that of
+        its replicas) to THREAD, a threading.Thread. Using it on any
+        other thread raises WrongThread, which includes the lazy loading
+        of relationships, delayed columns and containers of the dbobjs
+        it has retrieved. None lifts the restriction.
+        """
+        self._thread = thread
+        for replica in self._replicas + self._failed_replicas:
+            replica.bind_thread(thread)
+
+    def _check_thread(self):
+        if self._thread is not None and \
+               threading.current_thread() is not self._thread:
+            raise WrongThread("This datasource is bound to %s." % \
+                                  self._thread.getName())
     
     def query_one(self, query):
         """        
@@ -198,45 +436,377 @@ class datasource_base:
         except TypeError: # result has no size
             return result
 
-    def execute(self, command, params=(), modify=False):
+    def execute(self, command, params=(), modify=False, on_primary=False):
         """
-        Execute COMMAND on the database. If modify is True, or the command
-        is one of INSERT, UPDATE or DELETE, the command is assumed to
-        modify the database. All modifying commands will be executed
-        on the same cursor.
+        Execute COMMAND on the database. Unless COMMAND is known to only
+        read from the database (see is_read()), it is assumed to modify
+        it, as it is if MODIFY is True. All modifying commands will be
+        executed on the same cursor.
+
+        If read replicas have been added (see add_replica()), reading
+        commands are executed on one of them, unless ON_PRIMARY is set
+        or the current transaction has modified the database.
         
         @param command: A string containing an SQL command of any kind or an
                sql.statement instance.
+        @param on_primary: Execute a non-modifying command on this
+               datasource rather than a replica.
         """
         if not modify:
-            if type(command) == StringType:
-                c = string.upper(string.lstrip(command[:6]))
-                if c in ("DELETE", "INSERT", "UPDATE",):
-                    modify = True
-            elif isinstance(command, (sql.update, sql.insert, sql.delete)):
-                modify = True
+            modify = not self.is_read(command)
 
         if modify:
             cursor = self.__modify_cursor__()
             self.flush_updates()
+            self._wrote = True
+            self.__relation_modified__(result_cache.modified_relation(command))
+        elif self._replicas and not on_primary and not self._wrote:
+            return self._execute_on_replica(command, params)
         else:
             cursor = self.cursor()
 
         cursor.execute(command, params)
         return cursor
 
+    def __relation_modified__(self, relation):
+        """
+        Record that RELATION, a name as returned by
+        result_cache.relation_name(), has been modified, or an unknown
+        relation if it is None: The results cached for it are
+        invalidated and its modification_stamp() changes.
+        """
+        self._count_modification(relation)
+        if self._result_cache is not None:
+            self._result_cache.invalidate(relation)
+
+    def _count_modification(self, relation):
+        self._modifications[relation] = \
+            self._modifications.get(relation, 0) + 1
+        
+    def modification_stamp(self, relation):
+        """
+        Return a value that changes whenever RELATION is modified
+        through this datasource, a statement that modifies an unknown
+        relation is executed or the transaction is rolled back. Values
+        derived from RELATION's rows may be kept as long as it stays
+        the same. See _2many.result.__len__().
+        """
+        name = result_cache.relation_name(relation)
+        return ( self._modifications.get(None, 0),
+                 self._modifications.get(name, 0), )
+
+    def is_read(self, command):
+        """
+        Tell whether COMMAND, as passed to execute(), is known not to
+        modify the database: sql.select instances and strings starting
+        with SELECT or WITH (optionally preceded by EXPLAIN) that
+        contain neither a modifying statement nor a locking clause (FOR
+        UPDATE, FOR SHARE), SELECT INTO or a sequence function.
+        """
+        if isinstance(command, sql.select):
+            return True
+        elif isinstance(command, sql.bound):
+            return command.is_select()
+        elif type(command) in ( StringType, UnicodeType, ):
+            return _read_re.match(command) is not None and \
+                   _not_read_re.search(command) is None
+        else:
+            return False
+
+    def add_replica(self, replica):
+        """
+        Add a read replica of this datasource's database. REPLICA is a
+        datasource connected to it, using the same adapter. Statements
+        that do not modify the database are routed to the replicas
+        according to replica_policy, which is either 'round_robin' or
+        'least_busy' (see least_busy_replica()). After the first
+        modifying statement of a transaction, all statements are
+        executed on this datasource (the primary) until commit() or
+        rollback(). Streaming results always use the primary.
+
+        A replica that raises an exception and fails ping() afterwards
+        is removed from the rotation and the statement is retried on
+        the next one or, finally, the primary. check_replicas() puts
+        it back once it responds again.
+        """
+        if self._thread is not None:
+            replica.bind_thread(self._thread)
+        self._replicas.append(replica)
+
+    def remove_replica(self, replica):
+        """
+        Remove REPLICA from the rotation (or the failed replicas).
+        """
+        if replica in self._replicas:
+            self._replicas.remove(replica)
+        if replica in self._failed_replicas:
+            self._failed_replicas.remove(replica)
+
+    def replicas(self):
+        """
+        Return the list of replicas currently in rotation.
+        """
+        return list(self._replicas)
+
+    def check_replicas(self):
+        """
+        ping() all the replicas. Those in rotation that fail are removed
+        from it, failed ones that respond are put back.
+        """
+        for replica in self._replicas[:]:
+            if not replica.ping():
+                self._replica_failed(replica)
+
+        for replica in self._failed_replicas[:]:
+            if replica.ping():
+                self._failed_replicas.remove(replica)
+                self._replicas.append(replica)
+
+    def next_replica(self):
+        """
+        Return the replica the next statement is executed on, according
+        to replica_policy.
+        """
+        if self.replica_policy == "least_busy":
+            return self.least_busy_replica()
+        else:
+            self._replica_counter += 1
+            return self._replicas[self._replica_counter % len(self._replicas)]
+
+    def least_busy_replica(self):
+        """
+        Return the replica with the fewest statements executing at the
+        moment. This is meaningful if the replica datasources are shared
+        by several threads' primaries. Ties are broken in round robin
+        order.
+        """
+        self._replica_counter += 1
+        count = len(self._replicas)
+        ordered = map(lambda idx: self._replicas[
+                          (self._replica_counter + idx) % count],
+                      range(count))
+        return min(ordered, key=lambda replica: replica._executing)
+    
+    def _execute_on_replica(self, command, params):
+        replica = self.next_replica()
+        
+        replica._executing_lock.acquire()
+        replica._executing += 1
+        replica._executing_lock.release()
+        try:
+            try:
+                return replica.execute(command, params)
+            except:
+                if replica.ping():
+                    raise
+        finally:
+            replica._executing_lock.acquire()
+            replica._executing -= 1
+            replica._executing_lock.release()
+
+        self._replica_failed(replica)
+        return self.execute(command, params)
+
+    def _replica_failed(self, replica):
+        if replica in self._replicas:
+            self._replicas.remove(replica)
+            self._failed_replicas.append(replica)
+            
     def __modify_cursor__(self):
         if self._modify_cursor is None:
             self._modify_cursor = self.cursor()
             
         return self._modify_cursor
 
-    def flush_updates(self, select_after_update=True):
+    def flush_updates(self, select_after_update=True, batch=None):
+        """
+        Write the changes made to dbobjects and their containers (see
+        L{t4.orm.containers}) since the last flush to the database.
+
+        @param select_after_update: Re-read columns that have been set to
+           an SQL expression from the backend.
+        @param batch: If True, group the changed dbobjects by relation
+           and set of changed columns and UPDATE each group with a
+           single statement (see L{batch_update}) rather than running
+           one UPDATE per dbobject. Defaults to self.batch_updates.
+        """
+        if batch is None:
+            batch = self.batch_updates
+
         cursor = self.__modify_cursor__()
-        for dbobj in self._changed_dbobjs:
-            dbobj.__perform_updates__(cursor, select_after_update)
+
+        relations = map(lambda dbobj: dbobj.__relation__,
+                        self._changed_dbobjs)
+        for dbobj, container, original in self._changed_containers.values():
+            relations.append(container.child_relation)
+        for relation in set(map(result_cache.relation_name, relations)):
+            self.__relation_modified__(relation)
+
+        if self._changed_dbobjs:
+            self._wrote = True
+            
+        if batch:
+            self._flush_batched_updates(cursor, self._changed_dbobjs,
+                                        select_after_update)
+        else:
+            for dbobj in self._changed_dbobjs:
+                dbobj.__perform_updates__(cursor, select_after_update)
         self._changed_dbobjs = set()
+
+        changed_containers = self._changed_containers
+        self._changed_containers = OrderedDict()
+        if changed_containers:
+            self._wrote = True
+        for dbobj, container, original in changed_containers.values():
+            container.__flush__(self, cursor, dbobj, original)
     __flush_updates__ = flush_updates
+
+    def _flush_batched_updates(self, cursor, dbobjs, select_after_update):
+        groups = {}
+        for dbobj in dbobjs:
+            if not dbobj.__changed__:
+                continue
+
+            info = dbobj.__update_info__()
+            key_columns = tuple(dbobj.__primary_key__.columns())
+            columns = info.keys()
+            columns.sort(key=str)
+            columns = tuple(columns)
+
+            group_key = ( str(dbobj.__relation__),
+                          tuple(map(str, key_columns)),
+                          tuple(map(str, columns)), )
+            if not groups.has_key(group_key):
+                groups[group_key] = ( dbobj.__relation__, key_columns,
+                                      columns, [], )
+            groups[group_key][3].append( (dbobj, info,) )
+
+        for relation, key_columns, columns, members in groups.values():
+            for a in range(0, len(members), self.update_batch_size):
+                chunk = members[a:a+self.update_batch_size]
+
+                rows = []
+                for dbobj, info in chunk:
+                    rows.append( ( tuple(dbobj.__primary_key__.sql_literals()),
+                                   tuple(map(info.get, columns)), ) )
+                    
+                self.batch_update(cursor, relation, key_columns,
+                                  columns, rows)
+
+                dbobjs = map(lambda (dbobj, info): dbobj, chunk)
+                if select_after_update:
+                    self._select_after_batch_update(cursor, relation,
+                                                    key_columns, dbobjs)
+
+                for dbobj in dbobjs:
+                    dbobj.__changed__ = 0
+
+    def batch_update(self, cursor, relation, key_columns, columns, rows):
+        """
+        UPDATE several rows of RELATION with one statement. The default
+        implementation uses one CASE expression per column, which
+        should work with any SQL92 backend. Adapters may overload this
+        to use their backend's multi-row UPDATE syntax.
+
+        @param cursor: The (modify) cursor to use.
+        @param relation: The relation to UPDATE.
+        @param key_columns: Tuple of the columns that identify a row.
+        @param columns: Tuple of the columns to be set.
+        @param rows: List of pairs as ( key_literals, values ), both of
+           which are tuples of sql literals or expressions, corresponding
+           to key_columns and columns, respectively.
+        """
+        if len(rows) == 1:
+            key_literals, values = rows[0]
+            where = sql.where.in_(key_columns, [ key_literals, ])
+            cursor.execute(sql.update(relation, where,
+                                      dict(zip(columns, values))))
+            return
+        
+        info = {}
+        for idx, column in enumerate(columns):
+            if len(key_columns) == 1:
+                case = [ "CASE", key_columns[0], ]
+            else:
+                case = [ "CASE", ]
+                
+            for key_literals, values in rows:
+                case.append("WHEN")
+                
+                if len(key_columns) == 1:
+                    case.append(key_literals[0])
+                else:
+                    for key_column, key_literal in zip(key_columns,
+                                                       key_literals):
+                        case += [ key_column, "=", key_literal, "AND", ]
+                    del case[-1] # remove the last AND
+
+                case.append("THEN")
+                
+                value = values[idx]
+                if isinstance(value, sql.expression):
+                    case += [ "(", value, ")", ]
+                else:
+                    case.append(value)
+                    
+            case.append("END")
+            info[column] = sql.expression(*case)
+
+        where = sql.where.in_(key_columns, map(lambda (k, v): k, rows))
+        cursor.execute(sql.update(relation, where, info))
+
+    def _select_after_batch_update(self, cursor, relation, key_columns,
+                                   dbobjs):
+        """
+        Re-read the columns that have been set to SQL expressions for
+        all of DBOBJS.
+        """
+        members = []
+        for dbobj in dbobjs:
+            need_select = dbobj.__select_after_update_columns__()
+            if len(need_select) > 0:
+                members.append( (dbobj, need_select,) )
+
+        self._select_by_keys(cursor, relation, key_columns, members)
+
+    def _select_by_keys(self, cursor, relation, key_columns, members):
+        """
+        Set dbproperties of several dbobjects of the same relation from
+        the database, using one SELECT ... WHERE key IN (...) per set of
+        columns.
+
+        @param members: List of pairs as ( dbobj, need_select ), the latter
+           being a list of pairs as ( column, [ dbproperties ] ).
+        """
+        groups = {}
+        for dbobj, need_select in members:
+            group_key = tuple(map(lambda (c, d): str(c), need_select))
+            groups.setdefault(group_key, []).append( (dbobj, need_select,) )
+
+        for members in groups.values():
+            by_key = {}
+            for dbobj, need_select in members:
+                by_key[tuple(dbobj.__primary_key__.values())] = \
+                                                    ( dbobj, need_select, )
+
+            dbobj, need_select = members[0]
+            key_attributes = tuple(dbobj.__primary_key__.attributes())
+            columns = list(key_columns) + map(lambda (c, d): c, need_select)
+            where = sql.where.in_(key_columns, map(
+                lambda (dbobj, n): tuple(dbobj.__primary_key__.sql_literals()),
+                members))
+            
+            cursor.execute(sql.select(columns, relation, where))
+            for tpl in cursor.fetchall():
+                key = []
+                for attribute, value in zip(key_attributes, tpl):
+                    key.append(attribute.__convert__(value))
+                
+                dbobj, need_select = by_key[tuple(key)]
+                values = tpl[len(key_columns):]
+                for (column, dbprops), value in zip(need_select, values):
+                    for dbprop in dbprops:
+                        dbprop.__set_from_result__(self, dbobj, value)
         
     def commit(self, *dbobjs, **kw):
         """
@@ -254,6 +824,11 @@ class datasource_base:
         #return cursor
         self.flush_updates()
         self._dbconn().commit()
+        self._wrote = False
+        
+        if self._result_cache is not None and \
+               self._result_cache.clear_on_commit:
+            self._result_cache.clear()
     
     def perform_updates(self, *dbobjs, **kw):
         pass
@@ -263,6 +838,19 @@ class datasource_base:
         Undo the changes you made to the database since the last commit()
         """
         self._dbconn().rollback()        
+        self.clear_identity_map()
+
+        # Container changes that have not been flushed are void, too.
+        for dbobj, container, original in self._changed_containers.values():
+            container.__discard_write__(dbobj)
+        self._changed_containers = OrderedDict()
+        
+        self._wrote = False
+        self._count_modification(None)
+        
+        if self._result_cache is not None and \
+               self._result_cache.clear_on_rollback:
+            self._result_cache.clear()
         
     def cursor(self):
         """
@@ -270,6 +858,15 @@ class datasource_base:
         """
         return sql.cursor_wrapper(self, self._dbconn().cursor())
 
+    def stream_cursor(self, batch_size):
+        """
+        Return a cursor for a streaming result (see dbobject.result)
+        that retrieves rows from the backend BATCH_SIZE at a
+        time. Adapters overload this to use server side cursors. The
+        default implementation returns a regular cursor.
+        """
+        return self.cursor()
+
     def close(self):
         """
         Close the connection to the database.
@@ -287,7 +884,7 @@ class datasource_base:
         except:
             return False
 
-    def select(self, dbclass, *clauses):
+    def select(self, dbclass, *clauses, **kw):
         """
         SELECT dbobjs from the database, according to clauses.
 
@@ -296,8 +893,31 @@ class datasource_base:
         @param clauses: A list of t4.orm.sql clauses instances (or
                         equivalent Python object i.e. strings) that
                         are added to the sql.select query.  See
-                        t4.orm.sql.select for details        
+                        t4.orm.sql.select for details
+        @param prefetch: A tuple of relationship attribute names whoes
+                        related dbobjs will be loaded for the whole
+                        result at once. See dbobject.result.prefetch().
+        @param undefer: A tuple of delayed attribute names whoes
+                        groups will be loaded for the whole result at
+                        once. See dbobject.result.undefer().
+        @param stream: If True, the query is run on a server side
+                        cursor if the backend provides them, so that
+                        only batch_size rows are kept in memory.
+        @param batch_size: Number of rows fetched from the cursor at a
+                        time, defaults to fetch_batch_size.
+        @param with_total: If True, the query also selects the total
+                        number of rows the WHERE clause matches
+                        regardless of LIMIT and OFFSET (using the window
+                        function COUNT(*) OVER ()), so that the result's
+                        count() doesn't have to run a query. The backend
+                        must support window functions.
+        @param on_primary: If True, the query is not routed to a read
+                        replica (see add_replica()).
         """
+        prefetch = kw.get("prefetch", ())
+        if type(prefetch) == StringType: prefetch = ( prefetch, )
+        undefer = kw.get("undefer", ())
+        if type(undefer) == StringType: undefer = ( undefer, )
         from dbobject import dbobject
 
         clauses = filter(lambda clause: clause is not None, clauses)
@@ -318,21 +938,91 @@ class datasource_base:
                 clause._columns = clause._columns[0].__select_expressions__(
                     True)
                 
-        query = sql.select(dbclass.__select_expressions__(full_column_names),
-                           dbclass.__view__, *clauses)
-        
-        return self.run_select(dbclass, query)
+        columns = dbclass.__select_expressions__(full_column_names)
+        if kw.get("with_total", False):
+            columns = tuple(columns) + ( sql.expression("COUNT(*) OVER ()"), )
+            
+        query = sql.select(columns, dbclass.__view__, *clauses)
 
+        result = self.run_select(dbclass, query, **self.result_options(kw))
+        if prefetch:
+            result.prefetch(*prefetch)
+        if undefer:
+            result.undefer(*undefer)
+            
+        return result
+
+    def paginate(self, dbclass, *clauses, **kw):
+        """
+        Return a page of dbobjs of DBCLASS using keyset pagination,
+        see L{t4.orm.pagination}. The latency doesn't grow with the
+        number of the page, as it does using OFFSET.
+
+        @param clauses: Additional clauses, see select(). LIMIT,
+           OFFSET and ORDER BY clauses must not be used.
+        @param order_by: Attribute name or tuple of attribute names
+           to order by. The primary key is appended.
+        @param after: The previous page's token or None.
+        @param page_size: Maximum number of dbobjs per page (20).
+        @param desc: Order descending.
+        @return: A pagination.page instance.
+        """
+        return pagination.paginate(
+            dbclass, lambda *clauses: self.select(dbclass, *clauses),
+            clauses, **kw)
+    
+    def select_values(self, dbclass, attribute_names, *clauses, **kw):
+        """
+        Yield tuples of the values of DBCLASS' ATTRIBUTE_NAMES for each
+        row selected by CLAUSES, without creating dbobjs. Only the
+        corresponding columns are SELECTed. If ATTRIBUTE_NAMES is a
+        string, the values are yielded by themselves. See
+        L{t4.orm.projection}.
+
+        @param clauses: See select().
+        @param stream: See select().
+        @param batch_size: See select().
+        """
+        return projection.select_values(self, dbclass, attribute_names,
+                                        clauses, False, **kw)
+
+    def select_rows(self, dbclass, attribute_names, *clauses, **kw):
+        """
+        Like select_values(), but yield named tuples whoes fields are
+        named after ATTRIBUTE_NAMES.
+        """
+        return projection.select_values(self, dbclass, attribute_names,
+                                        clauses, True, **kw)
+    
+    def result_options(self, kw):
+        """
+        Return a dict containing those of the keyword arguments in KW
+        that are passed to a result's constructor (stream, batch_size,
+        with_total and on_primary).
+        """
+        ret = {}
+        for name in ( "stream", "batch_size", "with_total", "on_primary", ):
+            if kw.has_key(name):
+                ret[name] = kw[name]
+                
+        return ret
     
-    def run_select(self, dbclass, select):
+    def run_select(self, dbclass, select, **kw):
         """
         Run a select statement on this datasource that is ment to return
         rows suitable to construct objects of dbclass from them.
 
         @param dbclass: The dbclass of the objects to be selected
         @param select: sql.select instance representing the query
+        @param kw: Keyword arguments to the result's constructor (see
+           dbobject.result)
         """
-        return dbclass.__result__(self, dbclass, select)
+        if self._result_cache is not None and not kw.get("stream", False):
+            rows = self._cached_rows(dbclass, select)
+            if rows is not None:
+                kw["rows"] = rows
+                
+        return dbclass.__result__(self, dbclass, select, **kw)
 
     def select_one(self, dbclass, *clauses):
         """
@@ -350,13 +1040,16 @@ class datasource_base:
         except StopIteration:
             return None
         
-    def count(self, dbclass, *clauses):
+    def count(self, dbclass, *clauses, **kw):
         """
         All clauses except the WHERE clause will be ignored
         (including OFFSET and LIMIT!)
         
         @param dbclass: See select() above.
         @param clauses: See select() above.
+        @param approximate: If True, return the backend's estimate of
+                 the number of rows, if it provides one (see
+                 estimate_count()).
         
         @return: An integer value indicating the number of objects
                  of dbclass select() would return if run with these clauses.
@@ -364,10 +1057,31 @@ class datasource_base:
         clauses = filter(lambda clause: (isinstance(clause, sql.where) or
                                          isinstance(clause, sql.left_join)),
                          clauses)
+
+        if kw.get("approximate", False):
+            estimate = self.estimate_count(
+                sql.select(sql.expression("1"), dbclass.__view__, *clauses))
+            if estimate is not None:
+                return estimate
             
         query = sql.select("COUNT(*)", dbclass.__view__, *clauses)
+        
+        if self._result_cache is not None:
+            rows = self._cached_rows(dbclass, query)
+            if rows is not None:
+                return rows[0][0]
+            
         return self.query_one(query)[0]
 
+    def estimate_count(self, select):
+        """
+        Return an estimate of the number of rows SELECT will return,
+        taken from the query planner's statistics, or None, if the
+        backend can't provide one. This default implementation always
+        returns None, so that count()s are exact.
+        """
+        return None
+
     def join_select(self, dbclass, *clauses):
         # this may take some figuring
         pass
@@ -382,9 +1096,14 @@ class datasource_base:
         @param key: Python value representing the primary key or a tuple of
           such Python values, if the primary key has multiple columns
         """
+        return keys.key_where(keys.primary_key(dbclass).columns(),
+                              self.primary_key_literals(dbclass, key))
 
-        # this function is very simmilar to keys.key.where() - maybe unify?
-        
+    def primary_key_literals(self, dbclass, key):
+        """
+        Return a tuple of the sql literals representing KEY, a primary
+        key value of DBCLASS as passed to primary_key_where().
+        """
         if type(key) != TupleType: key = ( key, )
         primary_key = keys.primary_key(dbclass)
 
@@ -393,18 +1112,11 @@ class datasource_base:
                      ( repr(dbclass), len(primary_key.key_attributes), )
             raise IllegalPrimaryKey(msg)
 
-        where = []
+        ret = []
         for property, value in zip(primary_key.attributes(), key):
-            literal = property.sql_literal_class(property.__convert__(value))
-            
-            where.append(property.column)
-            where.append("=")
-            where.append(literal)
-            where.append("AND")
+            ret.append(property.sql_literal_class(property.__convert__(value)))
 
-        del where[-1] # remove last "AND"
-
-        return sql.where(*where)
+        return tuple(ret)
     
     def select_by_primary_key(self, dbclass, key):
         """
@@ -417,8 +1129,20 @@ class datasource_base:
         @raise IllegalPrimaryKey: hallo
         @return: A single dbobj.
         """
-        where = self.primary_key_where(dbclass, key)        
-        result = self.select(dbclass, where)
+        known = self.__known_dbobj__(dbclass, key)
+        if known is not None:
+            return known
+
+        columns = tuple(keys.primary_key(dbclass).columns())
+        def build(*literals):
+            return sql.select(dbclass.__select_expressions__(False),
+                              dbclass.__view__,
+                              keys.key_where(columns, literals))
+
+        # The query's SQL is kept in the statement cache.
+        query = sql.bound(( "select_by_primary_key", dbclass, ), build,
+                          self.primary_key_literals(dbclass, key))
+        result = self.run_select(dbclass, query)
 
         try:
             return result.next()
@@ -435,8 +1159,13 @@ class datasource_base:
         won't affect any rows.
 
         This method is primarily ment for transaction based (i.e. www)
-        applications.
+        applications. If the identity map knows the dbobj, it is
+        returned instead of a dummy.
         """
+        known = self.__known_dbobj__(dbclass, key)
+        if known is not None:
+            return known
+        
         if type(key) != TupleType: key = ( key, )
         primary_key = keys.primary_key(dbclass)
 
@@ -462,6 +1191,23 @@ class datasource_base:
         if dbobj.__is_stored__():
             raise ObjectAlreadyInserted(repr(dbobj))
         
+        sql_columns, sql_values = self._insert_values(dbobj)
+        statement = sql.insert(dbobj.__relation__, sql_columns, sql_values)
+
+        self.execute(statement)
+        dbobj.__insert__(self)
+
+        if dbobj.__primary_key__ is not None and not dont_select:
+            self.select_after_insert(dbobj)
+
+        self.__identify__(dbobj)
+        
+        return cursor
+
+    def _insert_values(self, dbobj):
+        """
+        Return a pair of lists as ( columns, values ) to INSERT DBOBJ.
+        """
         sql_columns = []
         sql_values = []
         for property in dbobj.__dbproperties__():
@@ -476,15 +1222,123 @@ class datasource_base:
             raise DBObjContainsNoData(
                 "Please set at least one of the attributes of this dbobj")
 
-        statement = sql.insert(dbobj.__relation__, sql_columns, sql_values)
+        return sql_columns, sql_values
 
-        self.execute(statement)
-        dbobj.__insert__(self)
+    def insert_many(self, dbobjs, chunk_size=None, dont_select=False):
+        """
+        Insert a number of dbobjects using multi-row INSERT statements.
+        The dbobjs are grouped by relation and set of columns, each group
+        is inserted in chunks of CHUNK_SIZE rows (default:
+        self.insert_chunk_size) and the values provided by the backend
+        are picked up for each chunk at once (see _insert_many()). The
+        dbobjs are marked as stored just like insert() would. 
+
+        Backends that do not support multi-row INSERTs
+        (multi_row_insert = False) will insert() one dbobj at a time.
+        
+        @param dbobjs: Sequence of dbobjs, none of which may be stored.
+        @param chunk_size: Maximum number of rows per INSERT statement.
+        @param dont_select: See insert().
+        """
+        if chunk_size is None:
+            chunk_size = self.insert_chunk_size
+
+        dbobjs = list(dbobjs)
+        for dbobj in dbobjs:
+            if dbobj.__is_stored__():
+                raise ObjectAlreadyInserted(repr(dbobj))
+
+        if not self.multi_row_insert:
+            for dbobj in dbobjs:
+                self.insert(dbobj, dont_select)
+            return
+            
+        groups = {}
+        order = []
+        for dbobj in dbobjs:
+            columns, values = self._insert_values(dbobj)
+            group_key = ( str(dbobj.__relation__),
+                          tuple(map(str, columns)), )
+            if not groups.has_key(group_key):
+                groups[group_key] = ( dbobj.__relation__, columns, [], [], )
+                order.append(group_key)
+                
+            groups[group_key][2].append(dbobj)
+            groups[group_key][3].append(tuple(values))
+
+        for group_key in order:
+            relation, columns, members, values = groups[group_key]
+            for a in range(0, len(members), chunk_size):
+                self._insert_many(relation, columns,
+                                  members[a:a+chunk_size],
+                                  values[a:a+chunk_size],
+                                  dont_select)
+
+        if self._identity_map is not None:
+            for dbobj in dbobjs:
+                self.__identify__(dbobj)
+
+    def _insert_many(self, relation, columns, dbobjs, values, dont_select):
+        """
+        INSERT the rows for DBOBJS with a single statement and pick up
+        the values provided by the backend. If the primary key is known
+        for all of the dbobjs, they are used to SELECT the new rows,
+        otherwise the adapter's select_after_insert_many_clauses() must
+        be able to identify them. If it is not, the dbobjs are insert()ed
+        one by one.
+        """
+        need_select = []
+        if not dont_select:
+            for dbobj in dbobjs:
+                if dbobj.__primary_key__ is None:
+                    continue
+                
+                properties = filter(lambda p: p.__select_after_insert__(dbobj),
+                                    dbobj.__dbproperties__())
+                if len(properties) > 0:
+                    need_select.append( (dbobj, properties,) )
+
+        keys_known = not filter(lambda (dbobj, p): \
+                                    not dbobj.__primary_key__.isset(),
+                                need_select)
+        if not keys_known:
+            clauses = self.select_after_insert_many_clauses(relation,
+                                                            dbobjs)
+            if clauses is None:
+                for dbobj in dbobjs:
+                    self.insert(dbobj, dont_select)
+                return
+            
+        self.execute(sql.insert(relation, columns, *values))
+        for dbobj in dbobjs:
+            dbobj.__insert__(self)
 
-        if dbobj.__primary_key__ is not None and not dont_select:
-            self.select_after_insert(dbobj)
+        if len(need_select) == 0:
+            return
 
-        return cursor
+        cursor = self.__modify_cursor__()
+        if keys_known:
+            members = []
+            for dbobj, properties in need_select:
+                members.append( (dbobj, map(lambda p: (p.column, [ p, ],),
+                                            properties),) )
+
+            key_columns = tuple(need_select[0][0].__primary_key__.columns())
+            self._select_by_keys(cursor, relation, key_columns, members)
+        else:
+            # All of the dbobjs have the same columns set, so they will
+            # need the same properties selected.
+            properties = need_select[0][1]
+            columns = map(lambda p: p.column, properties)
+            cursor.execute(sql.select(columns, relation, *clauses))
+            result = cursor.fetchall()
+
+            if len(result) != len(dbobjs):
+                raise ObjectWasNotInserted()
+
+            for dbobj, tpl in zip(dbobjs, result):
+                for property, value in zip(properties, tpl):
+                    property.__set_from_result__(self, dbobj, value)
 
     def select_after_insert(self, dbobj):
         """
@@ -501,7 +1355,13 @@ class datasource_base:
 
         if len(properties) > 0:
             where = self.select_after_insert_where(dbobj)
-            query = sql.select(columns, dbobj.__relation__, where)
+            query = sql.bound(( "select_after_insert", dbobj.__class__,
+                                tuple(map(lambda p: p.attribute_name,
+                                          properties)), ),
+                              lambda where: sql.select(columns,
+                                                       dbobj.__relation__,
+                                                       where),
+                              ( where, ))
 
             self._modify_cursor.execute(query)
             tpl = self._modify_cursor.fetchone()
@@ -514,15 +1374,40 @@ class datasource_base:
 
     def select_after_insert_where(self, dbobj):
         raise NotImplemented()
+
+    def select_after_insert_many_clauses(self, relation, dbobjs):
+        """
+        Return a tuple of sql clauses that SELECT the rows for DBOBJS
+        just inserted into RELATION by a single multi-row INSERT, in the
+        order they were inserted, or None if the backend cannot
+        identify them. See _insert_many().
+        """
+        return None
     
     def close(self):
         self._dbconn().close()        
 
     def delete_by_primary_key(self, dbclass, primary_key_value, cursor=None):
         where = self.primary_key_where(dbclass, primary_key_value)
-        self.delete(dbclass, where, cursor)
+        command = sql.delete(dbclass.__relation__, where)
+        self.execute(command, cursor)
+
+        if self._identity_map is not None:
+            key = self.__identity_key__(dbclass, primary_key_value)
+            if self._identity_map.has_key(key):
+                del self._identity_map[key]
         
     def delete(self, dbclass, where, cursor=None):
+        """
+        DELETE the rows of dbclass' relation that match WHERE. Since
+        there is no telling which rows those were, the dbclass' dbobjs
+        are removed from the identity map.
+        """
         command = sql.delete(dbclass.__relation__, where)
         self.execute(command, cursor)
+
+        if self._identity_map is not None:
+            for key in self._identity_map.keys():
+                if key[0] is dbclass:
+                    self._identity_map.pop(key, None)
         
@@ -38,24 +38,64 @@ Datatype classes for the default SQL datatypes.
   
 """
 # Python
-import sys, copy, cPickle, decimal as pydecimal
+import sys, re, copy, cPickle, decimal as pydecimal
 from types import *
 from string import *
-from datetime import time as py_time
+from datetime import datetime as py_datetime, time as py_time
 
 # t4
 from t4.validators import *
 from t4 import normalize_date, normalize_datetime
 from t4 import sql
+import keys
 
 _property_counter = 0
 
+class _unset(object):
+    """
+    Marks an unset value in a dbobject's __values__ list. A dbproperty
+    set to an SQL expression has an _unset instance carrying the
+    expression in its slot, because its value is not known until it
+    has been re-read from the database.
+    """
+    __slots__ = ( "expression", )
+    
+    def __init__(self, expression=None):
+        self.expression = expression
+
+    def __repr__(self):
+        if self.expression is None:
+            return "<unset>"
+        else:
+            return "<unset %s>" % repr(self.expression)
+
+UNSET = _unset()
+_no_default = _unset()
+
+class _encoded(object):
+    """
+    Holds the raw column value of a L{serialized} dbproperty in a
+    dbobject's __values__ list. The decoded value is kept along with
+    it once the attribute has been read.
+    """
+    __slots__ = ( "raw", "value", )
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.value = UNSET
+
 class datatype(property):
     """
     This class encapsulates a dbclass' property (=attribute). It takes
     care of the SQL column name and the information actually stored in the
     database/the dbobject.
 
+    The values are kept in a list called __values__ on each dbobject.
+    Each of a dbclass' columns is assigned an index into that list, its
+    slot, when the dbclass is created. Unset columns hold L{UNSET}.
+    Subclasses access the values through stored_value(), store_value()
+    and remove_value().
+
     You may set most dbproperties to sql.expression-instances which are
     included in the generated INSERT or UPDATE statements as-is. On INSERT
     the corresponding columns will be SELECTed from the database (like
@@ -125,6 +165,10 @@ class datatype(property):
             
         self._data_attribute_name = " %s" % str(self.column)
 
+        # Properties that manage the same column share a slot.
+        self.slot = dbclass.__slot__(self._data_attribute_name)
+        self._slot_names = dbclass.__slot_names__
+
         if self.title is None:
             self.title = unicode(self.attribute_name, "ascii")
             # It's save to use ascii, because Python does not allow non-ascii
@@ -137,21 +181,66 @@ class datatype(property):
             from exceptions import DatatypeMustBeUsedInClassDefinition
             raise DatatypeMustBeUsedInClassDefinition(self.__class__.__name__)
 
-    def expression_attribute_name(self):
-        return " expression" + self.data_attribute_name()
+    def _slot_value(self, dbobj):
+        try:
+            return dbobj.__values__[self.slot]
+        except IndexError:
+            # The column was added to the dbclass after dbobj had
+            # been created.
+            return UNSET
+
+    def stored_value(self, dbobj, default=_no_default):
+        """
+        Return the value stored in DBOBJ's slot for this property. If it
+        is not set, return DEFAULT or raise AttributeError if no default
+        has been provided.
+        """
+        value = self._slot_value(dbobj)
+        if value.__class__ is _unset:
+            if default is _no_default:
+                raise AttributeError(self.attribute_name)
+            else:
+                return default
+        else:
+            return value
+
+    def store_value(self, dbobj, value):
+        """
+        Store VALUE in DBOBJ's slot for this property as-is.
+        """
+        values = dbobj.__values__
+        try:
+            values[self.slot] = value
+        except IndexError:
+            values.extend([ UNSET, ] * (self.slot + 1 - len(values)))
+            values[self.slot] = value
+
+    def remove_value(self, dbobj):
+        """
+        Put this property in an unset state on DBOBJ.
+        """
+        if self._slot_value(dbobj) is not UNSET:
+            self.store_value(dbobj, UNSET)
         
     def is_set_to_an_expression(self, dbobj):
-        return hasattr(dbobj, self.expression_attribute_name())
+        value = self._slot_value(dbobj)
+        return value.__class__ is _unset and value.expression is not None
 
     def set_to_an_expression(self, dbobj, expression):
-        setattr(dbobj, self.expression_attribute_name(), expression)
+        # This removes the current value from the dbobj, so we don't
+        # return a value that's not in sync with the database.
+        self.store_value(dbobj, _unset(expression))
 
     def expression(self, dbobj):
-        return getattr(dbobj, self.expression_attribute_name(), None)
+        value = self._slot_value(dbobj)
+        if value.__class__ is _unset:
+            return value.expression
+        else:
+            return None
 
     def remove_expression(self, dbobj):
         if self.is_set_to_an_expression(dbobj):
-            delattr(dbobj, self.expression_attribute_name())
+            self.store_value(dbobj, UNSET)
     
     def __get__(self, dbobj, owner="owner? Like owner of what??"):
         """
@@ -163,10 +252,19 @@ class datatype(property):
         # no such thing as too much information on errors.
         
         if dbobj is None: return self
-        self.check_dbobj(dbobj)
+
+        # The full check is only needed for dbobjs of other dbclasses
+        # than the one we were created for.
+        if dbobj.__slot_names__ is not self._slot_names:
+            self.check_dbobj(dbobj)
+
+        try:
+            value = dbobj.__values__[self.slot]
+        except IndexError:
+            value = UNSET
             
-        if self.isset(dbobj):
-            return getattr(dbobj, self.data_attribute_name())
+        if value.__class__ is not _unset:
+            return value
         else:
             if dbobj.__primary_key__ is not None:
                 primary_key_property = repr(tuple(
@@ -200,33 +298,25 @@ class datatype(property):
 
         if isinstance(value, sql.expression):
             self.set_to_an_expression(dbobj, value)
-            if self.isset(dbobj):
-                # Remove the current value from the dbobj so we don't
-                # return a value that's not in sync with the database.
-                delattr(dbobj, self.data_attribute_name())                
             dbobj.__register_change__(self)
         else:
-            self.remove_expression(dbobj)
-                
             if value is not None: value = self.__convert__(value)
 
             for validator in self.validators:
                 validator.check(dbobj, self, value)
 
-            old = getattr(dbobj, self.data_attribute_name(), StringType)
-            setattr(dbobj, self.data_attribute_name(), value)
+            old = self._slot_value(dbobj)
+            self.store_value(dbobj, value)
 
-            if old != value:
+            if old.__class__ is _unset or old != value:
                 dbobj.__register_change__(self)
 
     def __set_from_result__(self, ds, dbobj, value):
-        self.remove_expression(dbobj)            
-        setattr(dbobj, self.data_attribute_name(),
-                self.__convert__(value))
+        self.store_value(dbobj, self.__convert__(value))
 
     def check_dbobj(self, dbobj):
         if self.attribute_name is not None and \
-               not self in dbobj.__dbproperties__():
+               not self.index in dbobj.__class__.__properties__().indices:
             msg = "dbclass '%s' does not have attribute '%s' (wrong " + \
                   "dbclass for this dbproperty!)"
             msg = msg % ( dbobj.__class__.__name__, self.attribute_name, )
@@ -236,7 +326,7 @@ class datatype(property):
         """
         @returns: True, if this property is set, otherwise... well.. False.
         """
-        return hasattr(dbobj, self.data_attribute_name())
+        return self._slot_value(dbobj).__class__ is not _unset
     
     def update_expression(self, dbobj):
         """
@@ -283,7 +373,7 @@ class datatype(property):
             msg = "This attribute has not been retrieved from the database."
             raise AttributeError(msg)
         else:        
-            value = getattr(dbobj, self.data_attribute_name())
+            value = self.stored_value(dbobj)
 
             if value is None:
                 return sql.NULL
@@ -399,7 +489,7 @@ class Unicode(string):
             except TypeError:
                 raise TypeError(repr(self) + " " + repr(value))
             
-        setattr(dbobj, self.data_attribute_name(), value)
+        self.store_value(dbobj, value)
 
     def __convert__(self, value):
         if type(value) != UnicodeType:
@@ -433,6 +523,59 @@ class converting_unicode(Unicode):
             return value
         
 
+# ISO 8601 dates and times as backends return them, that store them
+# as text.
+_datetime_re = re.compile(r"(\d{4})-(\d\d)-(\d\d)"
+                          r"(?:[ T](\d\d):(\d\d)(?::(\d\d)(?:\.(\d+))?)?)?")
+_time_re = re.compile(r"(\d\d):(\d\d)(?::(\d\d)(?:\.(\d+))?)?")
+_time_zone_re = re.compile(r"\s*(?:Z|[-+]\d\d(?::?\d\d)?)$")
+
+def _microseconds(fraction):
+    if fraction is None:
+        return 0
+    else:
+        return int((fraction + "000000")[:6])
+
+def _match_iso(regex, value, what):
+    """
+    Match all of VALUE against REGEX and return the groups. A time
+    zone suffix raises ValueError, because the datatypes are naive.
+    """
+    value = strip(value)
+    match = regex.match(value)
+    if match is None:
+        raise ValueError("Not a %s: %s" % ( what, repr(value), ))
+    
+    rest = value[match.end():]
+    if rest != "":
+        if _time_zone_re.match(rest):
+            raise ValueError("Time zones are not supported: %s" % \
+                                 repr(value))
+        else:
+            raise ValueError("Not a %s: %s" % ( what, repr(value), ))
+
+    return match.groups()
+
+def parse_datetime(value):
+    """
+    Return a Python datetime for an ISO 8601 date or date and time
+    string without a time zone.
+    """
+    year, month, day, hour, minute, second, fraction = _match_iso(
+        _datetime_re, value, "date/time")
+    return py_datetime(int(year), int(month), int(day),
+                       int(hour or 0), int(minute or 0),
+                       int(second or 0), _microseconds(fraction))
+
+def parse_time(value):
+    """
+    Return a Python time for an ISO 8601 time string without a time
+    zone.
+    """
+    hour, minute, second, fraction = _match_iso(_time_re, value, "time")
+    return py_time(int(hour), int(minute), int(second or 0),
+                   _microseconds(fraction))
+
 class datetime_base(datatype):
     """
     This is the baseclass for datetime, date, and time. Writing a
@@ -470,7 +613,7 @@ class datetime_base(datatype):
             msg = "This attribute has not been retrieved from the database."
             raise AttributeError(msg)
         else:        
-            value = getattr(dbobj, self.data_attribute_name())
+            value = self.stored_value(dbobj)
 
             if value is None:
                 return sql.NULL
@@ -478,12 +621,25 @@ class datetime_base(datatype):
                 return sql.string_literal(self.datetime_as_string(value))
 
     def __set_from_result__(self, ds, dbobj, value):
-        if value is not None: value = self.__convert__(value)
+        if value is not None: value = self.__convert_result__(value)
         datatype.__set_from_result__(self, ds, dbobj, value)
 
+    def __convert_result__(self, value):
+        """
+        Convert a value retrieved from the database. Backends that
+        store dates and times as text (SQLite) return strings, which
+        are parsed.
+        """
+        if type(value) in ( StringType, UnicodeType, ):
+            value = self.__parse__(value)
+        return self.__convert__(value)
+        
     def __convert__(self, value):
         raise NotImplementedError()
 
+    def __parse__(self, value):
+        raise NotImplementedError()
+
     def datetime_as_string(self, value):
         raise NotImplementedError()
         
@@ -496,6 +652,9 @@ class datetime(datetime_base):
     """
     def datetime_as_string(self, value):
         return str(value)
+
+    def __parse__(self, value):
+        return parse_datetime(value)
     
     def __convert__(self, value):
         try:
@@ -515,6 +674,9 @@ class date(datetime):
     def datetime_as_string(self, value):
         return value.strftime("%Y-%m-%d")
 
+    def __parse__(self, value):
+        return parse_datetime(value).date()
+
     def __convert__(self, value):
         try:
             return normalize_date(value)
@@ -533,6 +695,9 @@ class time(datetime_base):
     def datetime_as_string(self, value):
         return value
 
+    def __parse__(self, value):
+        return parse_time(value)
+    
     def __convert__(self, value):
         if isinstance(value, py_time):
             return value
@@ -638,7 +803,7 @@ class wrapper(datatype):
 
     def __eq__(self, other):
         """
-        This will let the in in L{datatype.check_dbobj} yield True.
+        A wrapper compares equal to the datatype it contains.
         """
         return other == self.inside_datatype
 
@@ -654,16 +819,29 @@ class delayed(wrapper):
     regularly, but only on attribute access. This way you can treat a dbclass
     that contains large amount of data just like all the others and only
     load the data at the point in time when it's needed.
+
+    Delayed properties may be put in a group by passing the same group
+    name to their constructors. Accessing one of them will load all the
+    group's columns in one query. result.undefer() loads the groups of
+    a number of properties for a whole result at once, using one query
+    per ds.prefetch_chunk_size dbobjs (see L{__undefer__}).
+
+    Values loaded along with another property of their group are kept
+    in the dbobj until they are accessed for the first time, if the
+    property does not cache them.
     """
-    def __init__(self, inside_datatype, cache=False):
+    def __init__(self, inside_datatype, cache=False, group=None):
         """
         @param inside_datatype: The datatype <b>instance</b> this wrapper is
              responsible for
         @param cache: Parameter that determines whether the data is kept in
              memory once it is loaded from the database
+        @param group: Name of the group of delayed properties this
+             one is loaded with. 
         """
         wrapper.__init__(self, inside_datatype)
         self.cache = cache        
+        self.group = group
 
     def __get__(self, dbobj, owner="I don't know what this is for"):
         if dbobj is None: return self
@@ -671,37 +849,122 @@ class delayed(wrapper):
         self.check_dbobj(dbobj)
             
         if self.isset(dbobj):
-            return getattr(dbobj, self.data_attribute_name())
+            return self.stored_value(dbobj)
+
+        loaded = dbobj.__dict__.get(" delayed", None)
+        if loaded is not None and loaded.has_key(self.slot):
+            value = loaded.pop(self.slot)
+            if value.__class__ is _encoded:
+                value = self.inside_datatype._decode(value)
+            return value
+        
+        members = self.group_members()
+        columns = tuple(dbobj.__primary_key__.columns())
+        def build(*literals):
+            return sql.select(map(lambda member: member.column, members),
+                              dbobj.__view__,
+                              keys.key_where(columns, literals))
+
+        if self.group is None:
+            key = self.attribute_name
         else:
-            query = sql.select(( self.column, ),
-                               dbobj.__view__,
-                               dbobj.__primary_key__.where())
-            cursor = dbobj.__ds__().execute(query)
-            row = cursor.fetchone()
+            key = ( "group", self.group, )
+            
+        query = sql.bound(( "delayed", dbobj.__class__, key, ),
+                          build, dbobj.__primary_key__.sql_literals())
+        cursor = dbobj.__ds__().execute(query)
+        row = cursor.fetchone()
 
-            if row is None: raise IllegelPrimaryKey() # This shouldn't happen
+        if row is None: raise IllegelPrimaryKey() # This shouldn't happen
 
-            value = row[0]
+        return self.__set_from_row__(dbobj.__ds__(), dbobj, members, row,
+                                     self)
 
+    def group_members(self):
+        """
+        Return a list of the delayed properties of our dbclass that are
+        loaded along with this one, including this one.
+        """
+        if self.group is None:
+            return [ self, ]
+        else:
+            return filter(lambda property: isinstance(property, delayed) and \
+                              property.group == self.group,
+                          self.dbclass.__dbproperties__())
+
+    def __set_from_row__(self, ds, dbobj, members, row, requested=None):
+        """
+        Set the values in ROW, which correspond to the columns of
+        MEMBERS, on DBOBJ. Returns the value of the REQUESTED member.
+        """
+        ret = None
+        for member, value in zip(members, row):
+            if member is not requested and member.isset(dbobj):
+                # Don't overwrite a value that has been modified.
+                continue
+            
             # The way this is handled is a little strange. Let me explain!
             # The point is, __set_from_result__() may convert the 
             # data retreived from the RDBMS into some other Python
-            # representation (t4.orm.util.pickle works that way for instance).
-            # So we use the function to do its job and, if we're not supposed
-            # to cache the value, *undo* the changes it made on the dbobj.
-            # This presumes that the data_attribute_name() mechanism is used
-            # by __set_from_result__(), which is relatively save, I guess.
-            
-            self.inside_datatype.__set_from_result__(dbobj.__ds__(),
-                                                     dbobj, value)
+            # representation (t4.orm.util.pickle works that way for
+            # instance). So we use the function to do its job and, if
+            # we're not supposed to cache the value, *undo* the changes
+            # it made on the dbobj. This presumes that the store_value()
+            # mechanism is used by __set_from_result__(), which is
+            # relatively save, I guess.
+            member.inside_datatype.__set_from_result__(ds, dbobj, value)
+
+            if member is requested:
+                ret = member.stored_value(dbobj)
+
+            if not member.cache and member.isset(dbobj):
+                if member is not requested:
+                    # Keep the value until it is accessed.
+                    # Serialized values stay encoded.
+                    loaded = dbobj.__dict__.setdefault(" delayed", {})
+                    loaded[member.slot] = member._slot_value(dbobj)
+                member.remove_value(dbobj)
 
-            ret = getattr(dbobj, self.data_attribute_name())
+        return ret
 
-            if not self.cache and hasattr(dbobj, self.data_attribute_name()):
-                delattr(dbobj, self.data_attribute_name())
+    def __undefer__(self, ds, dbobjs):
+        """
+        Load the columns of this property's group for all of DBOBJS
+        that have not loaded them, yet.
+        """
+        members = self.group_members()
+        
+        wanted = {}
+        for dbobj in dbobjs:
+            if self.isset(dbobj) or \
+                    dbobj.__dict__.get(" delayed", {}).has_key(self.slot):
+                continue
+
+            key = dbobj.__primary_key__.values()
+            wanted[key] = ( tuple(dbobj.__primary_key__.sql_literals()),
+                            dbobj, )
+
+        if len(wanted) == 0:
+            return
+
+        key_properties = tuple(keys.primary_key(self.dbclass).attributes())
+        key_columns = map(lambda property: property.column, key_properties)
+        columns = key_columns + map(lambda member: member.column, members)
+        
+        literals = map(lambda (literals, dbobj): literals, wanted.values())
+        size = ds.prefetch_chunk_size
+        for a in range(0, len(literals), size):
+            query = sql.select(columns, self.dbclass.__view__,
+                               sql.where.in_(key_columns,
+                                             literals[a:a+size]))
+            for row in ds.execute(query).fetchall():
+                key = tuple(map(lambda (property, value):
+                                    property.__convert__(value),
+                                zip(key_properties, row)))
+                if wanted.has_key(key):
+                    self.__set_from_row__(ds, wanted[key][1], members,
+                                          row[len(key_columns):])
 
-            return ret
-            
     def select_expression(self, dbclass, full_column_names):
         return None
 
@@ -709,7 +972,8 @@ class delayed(wrapper):
         return False
 
     def __copy__(self):
-        return delayed(copy.copy(self.inside_datatype), self.cache)
+        return delayed(copy.copy(self.inside_datatype), self.cache,
+                       self.group)
 
 class readonly(wrapper):
     """
@@ -725,6 +989,25 @@ class readonly(wrapper):
     def __copy__(self):
         return readonly(copy.copy(self.inside_datatype))
 
+def _decoded(property, dbobj, owner, decode):
+    """
+    Return the inside datatype's value of the wrapper PROPERTY on DBOBJ
+    run through DECODE. The result is remembered in the dbobj's
+    __dict__ along with the value it was decoded from, so that DECODE
+    is only called again after the value has been changed.
+    """
+    value = property.inside_datatype.__get__(dbobj, owner)
+    if dbobj is None: return value
+    
+    name = " %s_decoded" % property.attribute_name
+    cached = dbobj.__dict__.get(name, None)
+    if cached is not None and cached[0] is value:
+        return cached[1]
+    else:
+        ret = decode(value)
+        dbobj.__dict__[name] = ( value, ret, )
+        return ret
+    
 class csv(wrapper):
     """
     csv stands for 'comma separated values'. This wrapper takes a
@@ -735,13 +1018,18 @@ class csv(wrapper):
     further type checking is performed! Setting a csv attribute to a
     simple string is going to result in m,a,n,y, ,c,o,m,m,a,s in the
     database. Watchout!
+
+    The value is split on first access only; the tuple is remembered
+    until the attribute is set.
     """
     def __init__(self, inside_datatype, separator=","):
         wrapper.__init__(self, inside_datatype)
         self.separator = separator
 
     def __get__(self, dbobj, owner="I still don't know what this does"):
-        value = self.inside_datatype.__get__(dbobj, owner)
+        return _decoded(self, dbobj, owner, self.decode)
+
+    def decode(self, value):
         if value is None:
             return None
         else:
@@ -1015,6 +1303,8 @@ class dict_to_object(wrapper):
     For datatypes that return Python dictionaries, this will turn
     the dictionary into an object, mapping keys to property names.
     This has been written specifically for PostgreSQL’s JSON columns.
+    The object is created on first access and returned again until the
+    attribute is set.
     """
     class former_dict:
         # To make these useable in Zope
@@ -1024,8 +1314,9 @@ class dict_to_object(wrapper):
             self.__dict__.update(dict)
 
     def __get__(self, dbobj, owner="I still don't know what this does"):
-        value = self.inside_datatype.__get__(dbobj, owner)
+        return _decoded(self, dbobj, owner, self.decode)
 
+    def decode(self, value):
         if value is None:
             return None
         else:
@@ -1044,9 +1335,7 @@ class dictlist_to_objectlist(dict_to_object):
     Much like dict_to_object above, this is for results returned from the
     database as JSON lists of objects.
     """
-    def __get__(self, dbobj, owner="I still don't know what this does"):
-        value = self.inside_datatype.__get__(dbobj, owner)
-
+    def decode(self, value):
         if value is None:
             return []
         else:
@@ -1082,7 +1371,7 @@ class PDomain(Unicode):
         if value is not None and type(value) != UnicodeType:
             value = unicode(value, "idna")
             
-        setattr(dbobj, self.data_attribute_name(), value)
+        self.store_value(dbobj, value)
         
     def __convert__(self, value):
         if type(value) is not UnicodeType:
@@ -1120,32 +1409,67 @@ class PEMail(Unicode):
             return value
         
 
-class pickle(datatype):
+class serialized(datatype):
     """
-    This datatype uses Python's pickle module to serialize (nearly)
-    arbitrary Python objects into a string representation that is then
-    stored in a regular database column. See U{http://localhost/Documentation/Python/Main/lib/module-pickle.html} for details on pickling.
+    Base class for datatypes that store Python objects in a serialized
+    string representation. The raw column value is kept in the dbobj
+    when it is retrieved from the database and decode()d on first
+    access only. Until the attribute is set, sql_literal() returns the
+    raw value rather than encode()ing the object again.
+
+    Note that changes made to a mutable value in place go unnoticed, as
+    with any other dbproperty. Set the attribute to have it written.
     """
+    sql_literal_class = sql.string_literal
     
-    def __init__(self, pickle_protocol=cPickle.HIGHEST_PROTOCOL,
-                 column=None, title=None,
-                 validators=(), has_default=False):
+    def __set_from_result__(self, ds, dbobj, value):
+        if value is None:
+            self.store_value(dbobj, None)
+        else:
+            self.store_value(dbobj, _encoded(value))
+
+    def __set__(self, dbobj, value):
         """
-        @param pickle_protocol: Version number of the protocol being used by
-           the pickle functions. See U{http://localhost/Documentation/Python/Main/lib/module-pickle.html} for details. 
+        Setting the attribute to a value equal to the one retrieved
+        from the database is not a change, the raw value is kept.
         """
-        self.pickle_protocol = pickle_protocol
-        datatype.__init__(self, column, title, validators, 
-                         has_default)
+        self.check_dbobj(dbobj)
         
+        old = self._slot_value(dbobj)
+        if old.__class__ is _encoded and \
+               not isinstance(value, sql.expression):
+            if value is not None: value = self.__convert__(value)
+            if self._decode(old) == value:
+                for validator in self.validators:
+                    validator.check(dbobj, self, value)
+                return
+            
+        datatype.__set__(self, dbobj, value)
 
-    def __set_from_result__(self, ds, dbobj, value):
-        """
-        This method takes care of un-pickling the value stored in the datbase.
-        """
-        value = cPickle.loads(value)
-        setattr(dbobj, self.data_attribute_name(), value)
+    def __get__(self, dbobj, owner=None):
+        if dbobj is None: return self
+
+        if dbobj.__slot_names__ is not self._slot_names:
+            self.check_dbobj(dbobj)
+            
+        value = self._slot_value(dbobj)
+        if value.__class__ is _encoded:
+            return self._decode(value)
+        else:
+            return datatype.__get__(self, dbobj, owner)
+
+    def stored_value(self, dbobj, default=_no_default):
+        value = datatype.stored_value(self, dbobj, default)
+        if value.__class__ is _encoded:
+            return self._decode(value)
+        else:
+            return value
 
+    def _decode(self, encoded):
+        if encoded.value is UNSET:
+            encoded.value = self.decode(encoded.raw)
+        return encoded.value
+        
     def __convert__(self, value):
         """
         Since we store the Python object 'as is', convert does nothing.
@@ -1154,22 +1478,65 @@ class pickle(datatype):
 
     def sql_literal(self, dbobj):
         """
-        This function takes care of converting the Python object into a
-        serialized string representation.
+        Return the raw value retrieved from the database or, if the
+        attribute has been set, the encode()d Python object.
         """
         if not self.isset(dbobj):
             msg = "This attribute has not been retrieved from the database."
             raise AttributeError(msg)
         else:        
-            value = getattr(dbobj, self.data_attribute_name())
+            value = self._slot_value(dbobj)
 
             if value is None:
                 return sql.NULL
+            elif value.__class__ is _encoded:
+                if type(value.raw) == UnicodeType:
+                    return sql.unicode_literal(value.raw)
+                else:
+                    return self.sql_literal_class(value.raw)
             else:
-                pickled = cPickle.dumps(value, self.pickle_protocol)
-                return sql.string_literal(pickled)
+                return self.sql_literal_class(self.encode(value))
+
+    def decode(self, raw):
+        """
+        Return the Python object represented by RAW, a column value.
+        """
+        raise NotImplementedError()
+
+    def encode(self, value):
+        """
+        Return the string representation of VALUE, a Python object.
+        """
+        raise NotImplementedError()
+        
+class pickle(serialized):
+    """
+    This datatype uses Python's pickle module to serialize (nearly)
+    arbitrary Python objects into a string representation that is then
+    stored in a regular database column. See U{http://localhost/Documentation/Python/Main/lib/module-pickle.html} for details on pickling.
+    """
     
-class python_literal(datatype):
+    def __init__(self, pickle_protocol=cPickle.HIGHEST_PROTOCOL,
+                 column=None, title=None,
+                 validators=(), has_default=False):
+        """
+        @param pickle_protocol: Version number of the protocol being used by
+           the pickle functions. See U{http://localhost/Documentation/Python/Main/lib/module-pickle.html} for details. 
+        """
+        self.pickle_protocol = pickle_protocol
+        datatype.__init__(self, column, title, validators, 
+                         has_default)
+        
+    def decode(self, raw):
+        """
+        This method takes care of un-pickling the value stored in the datbase.
+        """
+        return cPickle.loads(str(raw))
+
+    def encode(self, value):
+        return cPickle.dumps(value, self.pickle_protocol)
+    
+class python_literal(serialized):
     """
     This datatype is for built-in python datastructures. They will be
     represented as a string when stored using repr() and parsed using
@@ -1183,35 +1550,14 @@ class python_literal(datatype):
                  validators=(), has_default=False):
         datatype.__init__(self, column, title, validators, has_default)
 
-    def __set_from_result__(self, ds, dbobj, value):
+    def decode(self, raw):
         """
         This method evaulates the value into a Python datastructure.
         """
-        value = eval(value)
-        setattr(dbobj, self.data_attribute_name(), value)
+        return eval(raw)
 
-    def __convert__(self, value):
-        """
-        Since we store the Python object 'as is', convert does nothing.
-        """
-        return value
-
-    def sql_literal(self, dbobj):
-        """
-        This function takes care of converting the Python object into a
-        serialized string representation.
-        """
-        if not self.isset(dbobj):
-            msg = "This attribute has not been retrieved from the database."
-            raise AttributeError(msg)
-        else:        
-            value = getattr(dbobj, self.data_attribute_name())
-
-            if value is None:
-                return sql.NULL
-            else:
-                r = repr(value)
-                return sql.string_literal(r)
+    def encode(self, value):
+        return repr(value)
     
 class path(datatype):
     """
@@ -1233,7 +1579,7 @@ class path(datatype):
         This method takes care of un-pickling the value stored in the datbase.
         """
         value = tuple(split(value, "/"))
-        setattr(dbobj, self.data_attribute_name(), value)
+        self.store_value(dbobj, value)
 
     def __convert__(self, value):
         """
@@ -1255,7 +1601,7 @@ class path(datatype):
             msg = "This attribute has not been retrieved from the database."
             raise AttributeError(msg)
         else:        
-            value = getattr(dbobj, self.data_attribute_name())
+            value = self.stored_value(dbobj)
 
             if value is None:
                 return sql.NULL
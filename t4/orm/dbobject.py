@@ -40,7 +40,8 @@ from t4 import sql
 import keys
 from datasource import datasource_base
 from exceptions import *
-from datatypes import datatype
+from datatypes import datatype, wrapper, delayed, Unicode, UNSET, \
+     serialized, _encoded
 from relationships import relationship
 
 class result:
@@ -54,58 +55,204 @@ class result:
     result more than once, you must cast it into a list (and by that copying
     all dbobjects to the client's memory).
 
-    The result class needs to deal with datasources that have an attribute
-    called no_fetchone set, that makes this class use the cursor.fetchall()
-    method (most notable for the gadfly adapter).
+    Rows are retrieved from the cursor in batches using
+    cursor.fetchmany(). The result class needs to deal with datasources
+    that have an attribute called no_fetchone set, that makes this class
+    use the cursor.fetchall() method (most notable for the gadfly
+    adapter).
+
+    A streaming result runs its query on the datasource's
+    stream_cursor(), which keeps the rows on the server (a named cursor
+    with PostgreSQL), so only one batch of rows is held in memory at a
+    time. Its cursor is closed as soon as the last row has been
+    retrieved or when close() is called. Results may be used in a with
+    statement for that purpose.
+
+    A result created with with_total=True expects its select to
+    contain an additional last column holding the total number of rows
+    (COUNT(*) OVER (), see datasource_base.select()), which is returned
+    by count() without another query.
     """
 
-    def __init__(self, ds, dbclass, select):
+    def __init__(self, ds, dbclass, select, stream=False, batch_size=None,
+                 rows=None, with_total=False, on_primary=False):
         """
         @param ds: Datasource object
         @param dbclass: dbclass object of whoes instances this result will be
         @param select: orm2.sql.select instance of the query
+        @param stream: Run the query on a server side cursor, if the
+           backend provides them.
+        @param batch_size: Number of rows fetched at a time. Defaults to
+           the datasource's fetch_batch_size.
+        @param rows: The rows the select returns, if they are known
+           already (from the datasource's result cache). The query is
+           not run.
+        @param with_total: The select's last column contains the total
+           number of rows.
+        @param on_primary: Don't run the query on a read replica (see
+           datasource_base.add_replica()).
         """
         self.ds = ds
         self.dbclass = dbclass
+        self.with_total = with_total
+        self._count = None
 
         self.select = select
+        self.stream = stream
+        
+        if batch_size is None: batch_size = ds.fetch_batch_size
+        self.batch_size = batch_size
         
         self.columns = dbclass.__select_expressions__(True)
-        self.cursor = ds.execute(select)
+        self.materializer = dbclass.__materializer__(self.columns)
+
+        if rows is not None:
+            self.cursor = None
+            self.rows = list(rows)
+            self.rows.reverse()
+            return
+        
+        if stream:
+            self.cursor = ds.stream_cursor(batch_size)
+            self.cursor.execute(select)
+        elif on_primary:
+            self.cursor = ds.execute(select, on_primary=True)
+        else:
+            self.cursor = ds.execute(select)
 
         if getattr(self.ds, "no_fetchone", False):
             self.rows = self.cursor.fetchall()
-            self.rows.reverse()            
+            self.rows.reverse()
+        else:
+            self.batch = []
+            self.position = 0
 
     def __iter__(self):
         return self
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
     def next(self):
+        if hasattr(self, "dbobjs"):
+            if len(self.dbobjs) == 0:
+                raise StopIteration
+            else:
+                return self.dbobjs.pop()
+            
         if hasattr(self, "rows"):
             if len(self.rows) == 0:
                 tpl = None
             else:
                 tpl = self.rows.pop()
         else:
-            tpl = self.cursor.fetchone()
+            tpl = self.fetch()
 
         if tpl is None:
             raise StopIteration
         else:
-            return self.dbclass.__from_result__(
-                self.ds, dict(zip(self.columns, tpl)))
+            if self.with_total:
+                self._count = tpl[-1]
+            return self.materializer(self.ds, tpl)
 
     fetchone = next
 
+    def fetch(self):
+        """
+        Return the next row from the cursor or None, if there are no
+        more rows. The rows are fetched batch_size at a time.
+        """
+        if self.position == len(self.batch):
+            if self.cursor is None:
+                return None
+            
+            self.batch = self.cursor.fetchmany(self.batch_size)
+            self.position = 0
+            
+            if len(self.batch) == 0:
+                if self.stream: self.close()
+                return None
+
+        self.position += 1
+        return self.batch[self.position-1]
+
+    def close(self):
+        """
+        Close this result's cursor. Rows already fetched may still be
+        retrieved.
+        """
+        if self.cursor is not None:
+            self.cursor.close()
+            self.cursor = None
+
+    def prefetch(self, *attribute_names):
+        """
+        Retrieve the remaining dbobjs of this result and load the
+        related dbobjs of the relationships named by ATTRIBUTE_NAMES for
+        all of them at once, using one query per relationship, rather
+        than one query per dbobj and relationship (see the
+        relationships' __prefetch__() methods). Returns self.
+        """
+        dbobjs = []
+        for dbobj in self:
+            dbobjs.append(dbobj)
+
+        for name in attribute_names:
+            property = self.dbclass.__dbproperty__(name)
+            if not hasattr(property, "__prefetch__"):
+                raise TypeError("%s.%s can't be prefetched" % (
+                    self.dbclass.__name__, name, ))
+            property.__prefetch__(self.ds, dbobjs)
+
+        dbobjs.reverse()
+        self.dbobjs = dbobjs
+        
+        return self
+
+    def undefer(self, *attribute_names):
+        """
+        Retrieve the remaining dbobjs of this result and load the
+        delayed properties named by ATTRIBUTE_NAMES, along with the
+        others in their groups, for all of them at once (see
+        L{t4.orm.datatypes.delayed}). Returns self.
+        """
+        dbobjs = []
+        for dbobj in self:
+            dbobjs.append(dbobj)
+
+        _undefer(self.dbclass, self.ds, dbobjs, attribute_names)
+
+        dbobjs.reverse()
+        self.dbobjs = dbobjs
+        
+        return self
+    
     def __len__(self):
+        if hasattr(self, "dbobjs"):
+            return len(self.dbobjs)
+        
+        if hasattr(self, "rows"):
+            return len(self.rows)
+
+        if self.cursor is None:
+            # All rows have been fetched.
+            return len(self.batch) - self.position
+        
         ret = self.cursor.rowcount
-        if ret == -1: raise Exception("No query has been run, yet.")        
+        if ret == -1:
+            # Some DBAPI modules (sqlite3 for one) don't know the number of
+            # rows before they have all been fetched. A TypeError makes
+            # list() ignore __len__().
+            raise TypeError("The length of this result is not known.")
         return ret
 
     def empty(self):
         return len(self) == 0
     
-    def count(self):
+    def count(self, approximate=False):
         """
         This is a helper function that will perform a query as
 
@@ -113,28 +260,359 @@ class result:
 
         appropriate to determine the number of rows in this result.
         This will remove all clauses of the original select except the
-        WHERE clause.
+        WHERE clause. The count is remembered, so the query is run only
+        once per result. If the result has been created with_total and
+        has any rows, no query is run at all.
 
         This can't be called __len__(), because then it is used by
         list() and yields a superflous SELECT query.
+
+        @param approximate: Return the backend's estimate of the number
+           of rows, if it provides one (see
+           datasource_base.estimate_count()), which is much faster for
+           large relations.
         """
-        if not isinstance(self.select, sql.select):
+        if self.with_total and self._count is None:
+            self._peek_total()
+            
+        if self._count is not None:
+            return self._count
+        
+        select = self.select
+        if isinstance(select, sql.bound):
+            select = select.statement()
+            
+        if not isinstance(select, sql.select):
             raise TypeError("result.count() can only work if the select was a"
                             "sql.select instance!")
 
         where = filter(lambda clause: isinstance(clause, (sql.where,
                                                           sql.left_join)),
-                       self.select.clauses)
+                       select.clauses)
+        if approximate:
+            estimate = self.ds.estimate_count(
+                sql.select(sql.expression("1"), select.relations, *where))
+            if estimate is not None:
+                return estimate
+            
         count_select = sql.select(sql.expression("COUNT(*)"),
-                                  self.select.relations,
+                                  select.relations,
                                   *where)
         count, = self.ds.query_one(count_select)
+        self._count = count
         return count
 
     count_all = count
 
+    def _peek_total(self):
+        """
+        Set _count from the total column of the rows not yet returned,
+        if there are any.
+        """
+        if hasattr(self, "dbobjs"):
+            return
+        elif hasattr(self, "rows"):
+            rows = self.rows
+        else:
+            if self.position == len(self.batch) and self.cursor is not None:
+                self.batch = self.cursor.fetchmany(self.batch_size)
+                self.position = 0
+            rows = self.batch[self.position:]
+
+        if len(rows) > 0:
+            self._count = rows[-1][-1]
+
+
+def _undefer(dbclass, ds, dbobjs, attribute_names):
+    """
+    Call the __undefer__() method of the delayed properties named by
+    ATTRIBUTE_NAMES, once for each group.
+    """
+    done = []
+    for name in attribute_names:
+        property = dbclass.__dbproperty__(name)
+        if not isinstance(property, delayed):
+            raise TypeError("%s.%s is not a delayed property" % (
+                dbclass.__name__, name, ))
+
+        if property.group is None or not property.group in done:
+            property.__undefer__(ds, dbobjs)
+            done.append(property.group)
+            
+class cached_result:
+    """
+    A result whoes dbobjs have been retrieved before, like the children
+    of a to-many relationship that have been prefetched. It provides the
+    same interface as L{result}.
+    """
+    def __init__(self, dbobjs):
+        self.dbobjs = list(dbobjs)
+        self.position = 0
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self.position >= len(self.dbobjs):
+            raise StopIteration
+        else:
+            self.position += 1
+            return self.dbobjs[self.position-1]
+
+    fetchone = next
+
+    def prefetch(self, *attribute_names):
+        dbobjs = self.dbobjs[self.position:]
+        if len(dbobjs) > 0:
+            for name in attribute_names:
+                property = dbobjs[0].__dbproperty__(name)
+                property.__prefetch__(dbobjs[0].__ds__(), dbobjs)
+                
+        return self
+
+    def undefer(self, *attribute_names):
+        dbobjs = self.dbobjs[self.position:]
+        if len(dbobjs) > 0:
+            _undefer(dbobjs[0].__class__, dbobjs[0].__ds__(), dbobjs,
+                     attribute_names)
 
+        return self
     
+    def __len__(self):
+        return len(self.dbobjs)
+
+    def empty(self):
+        return len(self) == 0
+
+    def count(self):
+        return len(self.dbobjs)
+
+    count_all = count
+
+
+class property_table:
+    """
+    A property table holds everything about a dbclass' dbproperties that
+    does not depend on a particular dbobject: the properties in
+    definition order (with and without relationships), an index by
+    attribute name and the select expressions for both settings of
+    full_column_names. It is built by the dbclass' metaclass on first
+    use and thrown away whenever a datatype is added to or removed
+    from the class, so it must be treated as read-only.
+    """
+    def __init__(self, dbclass):
+        for name, property in dbclass.__dict__.items():
+            if isinstance(property, datatype) and \
+                    not hasattr(property, "dbclass"):
+                # Datatypes that are assigned to the class after its
+                # creation (relationships to classes defined later, for
+                # instance) are initialized here.
+                property.__init_dbclass__(dbclass, name)
+
+        properties = []
+        by_name = {}
+        for name, property in dbclass.__dict__.items():
+            if isinstance(property, datatype):
+                properties.append(property)
+                by_name[name] = property
+
+        properties.sort()
+
+        self.properties = tuple(properties)
+        self.properties_without_relationships = tuple(filter(
+            lambda prop: not isinstance(prop, relationship), properties))
+        self.by_name = by_name
+
+        # datatype.__cmp__() compares by index, which copies made for
+        # inheritance and the datatypes inside wrappers share. That is
+        # what ‘property in dbclass.__dbproperties__()’ used to check.
+        self.indices = frozenset(map(lambda prop: prop.index, properties))
+
+        # The properties managing each slot in the dbobjs' __values__.
+        slot_properties = {}
+        for property in properties:
+            if hasattr(property, "slot"):
+                slot_properties.setdefault(property.slot, []).append(property)
+        self.slot_properties = dict(map(lambda (slot, props):
+                                            ( slot, tuple(props), ),
+                                        slot_properties.items()))
+
+        self.select_expressions = {}
+        self.result_properties = {}
+        for full_column_names in ( False, True, ):
+            columns = []
+            result_properties = []
+            for property in properties:
+                expr = property.select_expression(dbclass, full_column_names)
+                if expr is not None:
+                    result_properties.append( (property, expr,) )
+                    if not expr in columns:
+                        columns.append(expr)
+
+            self.select_expressions[full_column_names] = tuple(columns)
+            self.result_properties[full_column_names] = tuple(
+                result_properties)
+
+        self.materializers = {}
+
+    def materializer(self, dbclass, columns):
+        """
+        Return the L{materializer} for rows SELECTed as `columns`.
+        """
+        try:
+            return self.materializers[columns]
+        except KeyError:
+            ret = materializer(dbclass, columns)
+            self.materializers[columns] = ret
+            return ret
+
+
+class materializer:
+    """
+    A materializer turns a row tuple into a dbobject. It is created
+    once for each dbclass and list of selected columns and knows which
+    position in the tuple belongs to which dbproperty, so there is no
+    need to build a dict for each row or to look up select expressions.
+
+    Properties that use L{datatype.__set_from_result__} unchanged get
+    their slot in __values__ set directly, the others have their
+    __set_from_result__() called as usual. Dbobjects are created
+    without calling __init__(), unless the dbclass provides its own
+    __init__() or __from_result__(); those always take the slow path.
+    If the datasource's identity map is turned on, the dbobj it already
+    knows for a row's primary key is returned instead of the new one.
+    """
+    # Kinds of steps.
+    PLAIN = 0     # datatype.__convert__() with a python_class
+    CONVERT = 1   # only __convert__() is overloaded
+    UNICODE = 2   # Unicode.__set_from_result__()
+    GENERIC = 3   # call __set_from_result__()
+    ENCODED = 4   # serialized.__set_from_result__(), keep the raw value
+
+    def __init__(self, dbclass, columns):
+        self.dbclass = dbclass
+        self.columns = columns
+
+        plain_set_from_result = datatype.__dict__["__set_from_result__"]
+        plain_convert = datatype.__dict__["__convert__"]
+        unicode_set_from_result = Unicode.__dict__["__set_from_result__"]
+        encoded_set_from_result = serialized.__dict__["__set_from_result__"]
+
+        steps = []
+        for property, expr in dbclass.__properties__().result_properties[
+                True]:
+            try:
+                position = list(columns).index(expr)
+            except ValueError:
+                continue
+
+            lookup = _class_attribute_lookup(property)
+            if isinstance(property, wrapper):
+                set_from_result = None
+            else:
+                set_from_result = lookup("__set_from_result__")
+
+            if set_from_result is unicode_set_from_result:
+                steps.append( ( self.UNICODE, position,
+                                property.slot, None, ) )
+            elif set_from_result is encoded_set_from_result:
+                steps.append( ( self.ENCODED, position,
+                                property.slot, None, ) )
+            elif set_from_result is not plain_set_from_result:
+                steps.append( ( self.GENERIC, position,
+                                property.__set_from_result__, None, ) )
+            elif lookup("__convert__") is plain_convert and \
+                    property.python_class is not None:
+                steps.append( ( self.PLAIN, position,
+                                property.slot,
+                                property.python_class, ) )
+            else:
+                steps.append( ( self.CONVERT, position,
+                                property.slot,
+                                property.__convert__, ) )
+
+        self.steps = tuple(steps)
+        self.slot_names = dbclass.__slot_names__
+
+        self.fast = (
+            dbclass.__init__.im_func is dbobject.__init__.im_func and
+            dbclass.__from_result__.im_func is
+            dbobject.__dict__["__from_result__"].__func__)
+
+        self.primary_key = dbclass.__primary_key__
+        if self.primary_key == ():
+            self.primary_key = None
+
+    def __call__(self, ds, tpl):
+        """
+        Return a dbobject of our dbclass created from `tpl`, a row
+        retrieved through `ds`.
+        """
+        dbclass = self.dbclass
+
+        if not self.fast:
+            dbobj = dbclass.__from_result__(ds, dict(zip(self.columns, tpl)))
+            if ds._identity_map is not None:
+                return ds.__identify__(dbobj)
+            else:
+                return dbobj
+
+        dbobj = dbclass.__new__(dbclass)
+        d = dbobj.__dict__
+        values = [ UNSET, ] * len(self.slot_names)
+        d["__values__"] = values
+        d["__changed__"] = 0
+        d["_ds"] = ds
+        d["_is_stored"] = True
+
+        encoding = None
+        for kind, position, target, arg in self.steps:
+            value = tpl[position]
+            if kind == 0: # PLAIN
+                if value is None or isinstance(value, arg):
+                    values[target] = value
+                else:
+                    values[target] = arg(value)
+            elif kind == 1: # CONVERT
+                values[target] = arg(value)
+            elif kind == 2: # UNICODE
+                if value is not None and type(value) != UnicodeType:
+                    if encoding is None:
+                        encoding = ds.backend_encoding()
+                    value = unicode(value, encoding)
+                values[target] = value
+            elif kind == 4: # ENCODED
+                if value is not None:
+                    value = _encoded(value)
+                values[target] = value
+            else:
+                target(ds, dbobj, value)
+
+        if self.primary_key is None:
+            d["__primary_key__"] = None
+        else:
+            d["__primary_key__"] = keys.primary_key(dbobj)
+
+        if ds._identity_map is not None:
+            return ds.__identify__(dbobj)
+        else:
+            return dbobj
+
+def _class_attribute_lookup(property):
+    """
+    Return a function that looks up names in the class dicts along
+    property's method resolution order, without going through the
+    descriptor protocol.
+    """
+    mro = property.__class__.__mro__
+    def lookup(name):
+        for cls in mro:
+            if cls.__dict__.has_key(name):
+                return cls.__dict__[name]
+        return None
+    return lookup
+
+
 class dbobject(object):
     """
     Base class for all database aware classes.
@@ -170,6 +648,14 @@ class dbobject(object):
     
     @cvar __schema__: String containing the name of the schema this dbclass'
       relatin resides in.    
+
+    The dbproperties' values are kept in a list called __values__ in
+    each dbobj, indexed by the properties' slot (see L{datatype}). The
+    names of the slots are listed in the dbclass' __slot_names__, which
+    starts with the ones of its first dbclass base, so inherited
+    properties keep their index. The slots of the columns that have
+    been modified since the last UPDATE are kept in a bitset called
+    __changed__.
     """
 
     __primary_key__ = "id"
@@ -178,6 +664,13 @@ class dbobject(object):
     class __metaclass__(type):
         def __new__(cls, name, bases, dict):
             ret = type.__new__(cls, name, bases, dict)
+
+            slot_names = []
+            for base in bases:
+                if isinstance(base, cls) and base is not dbobject:
+                    slot_names = list(base.__slot_names__)
+                    break
+            type.__setattr__(ret, "__slot_names__", slot_names)
             
             if name != "dbobject":
                 if not hasattr(ret, "__relation__") or \
@@ -219,10 +712,13 @@ class dbobject(object):
                     raise TypeError(msg % ( repr(type(ret.__view__)),
                                             repr(ret.__view__),) )
 
-                # Initialize the dbproperties                
-                for attr_name, property in dict.items():
-                    if isinstance(property, datatype):
-                        property.__init_dbclass__(ret, attr_name)
+                # Initialize the dbproperties in the order of their
+                # definition, which is the order of their slots.
+                properties = filter(lambda (n, p): isinstance(p, datatype),
+                                    dict.items())
+                properties.sort(key=lambda (n, p): p.index)
+                for attr_name, property in properties:
+                    property.__init_dbclass__(ret, attr_name)
 
                 # Add (=inherit) db-properties from our parent classes
                 for base in bases:
@@ -235,7 +731,47 @@ class dbobject(object):
 
             return ret
 
-    
+        def __setattr__(cls, name, value):
+            type.__setattr__(cls, name, value)
+            if isinstance(value, datatype):
+                cls.__invalidate_property_table__()
+
+        def __delattr__(cls, name):
+            value = cls.__dict__.get(name, None)
+            type.__delattr__(cls, name)
+            if isinstance(value, datatype):
+                cls.__invalidate_property_table__()
+
+        def __slot__(cls, data_attribute_name):
+            """
+            Return the index of data_attribute_name in this dbclass'
+            dbobjs' __values__, assigning a new one if necessary.
+            """
+            names = cls.__slot_names__
+            try:
+                return names.index(data_attribute_name)
+            except ValueError:
+                names.append(data_attribute_name)
+                return len(names) - 1
+
+        def __invalidate_property_table__(cls):
+            type.__setattr__(cls, "__property_table__", None)
+            
+            # The cached statements select the old set of columns.
+            sql.statement_cache.discard(cls)
+
+        def __properties__(cls):
+            """
+            Return this dbclass' L{property_table}, building it if
+            necessary.
+            """
+            table = cls.__dict__.get("__property_table__", None)
+            if table is None:
+                table = property_table(cls)
+                type.__setattr__(cls, "__property_table__", table)
+            return table
+
+
     def __init__(self, **kw):
         """
         Construct a dbobj from key word arguments. Example::
@@ -246,7 +782,8 @@ class dbobject(object):
         __ds allows you to pass a datasource to objects that are not
         inserted yet and might need a ds to construct stuff.
         """
-        self.__changed_columns__ = {}
+        self.__values__ = [ UNSET, ] * len(self.__slot_names__)
+        self.__changed__ = 0
         
         if kw.has_key("__ds"):
             __ds = kw["__ds"]
@@ -262,10 +799,6 @@ class dbobject(object):
         self._ds = __ds
         self._is_stored = False
 
-        for name, prop in self.__class__.__dict__.iteritems():
-            if isinstance(prop, datatype) and not hasattr(prop, "dbclass"):
-                prop.__init_dbclass__(self.__class__, name)
-
         self.__update_from_dict__(kw)
 
         if self.__primary_key__ == ():
@@ -278,36 +811,95 @@ class dbobject(object):
     def __register_change__(self, dbproperty):
         if self.__is_stored__():
             self._ds.__register_change_of__(self)
-            if self.__changed_columns__.has_key(dbproperty.column):
-                self.__changed_columns__[dbproperty.column].add(dbproperty)
-            else:
-                self.__changed_columns__[dbproperty.column] = set((dbproperty,))
+            self.__changed__ |= 1 << dbproperty.slot
+
+    def __changed_columns__(self):
+        """
+        Return a list of pairs as ( column, [ dbproperties ] ) for the
+        columns that have been changed since the last UPDATE.
+        """
+        ret = []
+        changed = self.__changed__
+        if changed:
+            slot_properties = self.__class__.__properties__().slot_properties
+            slot = 0
+            while changed:
+                if changed & 1:
+                    dbprops = slot_properties[slot]
+                    ret.append( ( dbprops[0].column, dbprops, ) )
+                changed >>= 1
+                slot += 1
+
+        return ret
             
+    def __update_info__(self):
+        """
+        Return a dict as { column: update_expression } for the columns
+        that have been changed since the last UPDATE.
+        """
+        info = {}
+        for column, datatypes in self.__changed_columns__():
+            for dt in datatypes:
+                if not info.has_key(column):
+                    update_expression = dt.update_expression(self)
+                    if update_expression is not None:
+                        info[column] = update_expression
+
+        return info
+
+    def __select_after_update_columns__(self):
+        """
+        Return a list of pairs as ( column, [ dbproperties ] ) for the
+        changed columns whoes value must be re-read from the backend
+        after an UPDATE, because it was set to an SQL expression.
+        """
+        need_select = []
+        for column, dbprops in self.__changed_columns__():
+            dbprops = filter(lambda d: d.__select_after_insert__(self),
+                             dbprops)
+            if len(dbprops) > 0:
+                need_select.append( (column, dbprops,) )
+
+        return need_select
+
+    def __update_statement__(self):
+        """
+        Return the UPDATE statement for the columns that have been
+        changed since the last UPDATE. If all of them are set to
+        literals, a sql.bound statement is returned, whoes SQL is kept
+        in the statement cache per dbclass and set of columns.
+        """
+        info = self.__update_info__()
+        key_columns = tuple(self.__primary_key__.columns())
+        
+        if filter(lambda v: isinstance(v, sql.expression), info.values()):
+            return sql.update(self.__relation__,
+                              self.__primary_key__.where(), info)
+
+        columns = info.keys()
+        columns.sort(key=str)
+        
+        def build(*literals):
+            key_literals = literals[:len(key_columns)]
+            values = literals[len(key_columns):]
+            return sql.update(self.__relation__,
+                              keys.key_where(key_columns, key_literals),
+                              dict(zip(columns, values)))
+
+        return sql.bound(( "update", self.__class__,
+                           tuple(map(str, columns)), ),
+                         build,
+                         tuple(self.__primary_key__.sql_literals()) + \
+                             tuple(map(info.get, columns)))
+    
     def __perform_updates__(self, update_cursor, select_after_update=False):
-        if len(self.__changed_columns__) == 0:
+        if not self.__changed__:
             return
         else:
-            info = {}
-            for column, datatypes in self.__changed_columns__.items():
-                for dt in datatypes:
-                    if not info.has_key(column):
-                        update_expression = dt.update_expression(self)
-                        if update_expression is not None:
-                            info[column] = update_expression
-
-            statement = sql.update(self.__relation__,
-                                   self.__primary_key__.where(),
-                                   info)
-
-            update_cursor.execute(statement)
+            update_cursor.execute(self.__update_statement__())
 
             if select_after_update:
-                need_select = []
-                for column, dbprops in self.__changed_columns__.items():
-                    dbprops = filter(lambda d: d.__select_after_insert__(self),
-                                     dbprops)
-                    if len(dbprops) > 0:
-                        need_select.append( (column, dbprops,) )
+                need_select = self.__select_after_update_columns__()
                 
                 if len(need_select) > 0:
                     columns = map(lambda (c, d): c, need_select)
@@ -322,7 +914,7 @@ class dbobject(object):
                                                        self, value)
                                 
             # Clear the list of changed columns
-            self.__changed_columns__.clear()
+            self.__changed__ = 0
 
 
     @classmethod
@@ -336,8 +928,7 @@ class dbobject(object):
         """
         self = cls(__ds=ds)
 
-        for property in cls.__dbproperties__():
-            expr = property.select_expression(cls, True)
+        for property, expr in cls.__properties__().result_properties[True]:
             if info.has_key(expr):
                 property.__set_from_result__(ds, self, info[expr])
 
@@ -346,6 +937,15 @@ class dbobject(object):
 
         return self
 
+    @classmethod
+    def __materializer__(cls, columns):
+        """
+        Return a callable as f(ds, tpl) that constructs dbobjects of
+        this class from row tuples whose values correspond to
+        `columns`. See L{materializer}.
+        """
+        return cls.__properties__().materializer(cls, tuple(columns))
+
     def __insert__(self, ds):
         """
         This method is called by datasource.insert() after the insert
@@ -355,7 +955,7 @@ class dbobject(object):
         """
         self._ds = ds
         self._is_stored = True
-        self.__changed_columns__.clear()
+        self.__changed__ = 0
     
     def __ds__(self):
         """
@@ -382,16 +982,13 @@ class dbobject(object):
     @classmethod
     def __dbproperties__(cls, include_relationships=True):
         """
-        This is a generator over all the dbproperties in this dbobject.
+        Return a tuple of all the dbproperties in this dbobject in the
+        order of their definition.
         """
-        ret = filter(lambda prop: isinstance(prop, datatype),
-                     cls.__dict__.values())
-
-        if not include_relationships:
-            ret = filter(lambda prop: not isinstance(prop, relationship), ret)
-
-        ret.sort()
-        return ret
+        if include_relationships:
+            return cls.__properties__().properties
+        else:
+            return cls.__properties__().properties_without_relationships
                 
     @classmethod
     def __dbproperty__(cls, name=None):
@@ -410,28 +1007,21 @@ class dbobject(object):
                 name = cls.__primary_key__
 
         try:
-            property = cls.__dict__[name]
+            return cls.__properties__().by_name[name]
         except KeyError:
-            tpl =  ( repr(name), cls.__name__, )
-            raise AttributeError("No such attribute: %s (in class %s)" % tpl)
-
-        if not isinstance(property, datatype):
-            raise NoDbPropertyByThatName(name + " is not a orm2 datatype!")
-
-        return property
+            if cls.__dict__.has_key(name):
+                raise NoDbPropertyByThatName(name + " is not a orm2 datatype!")
+            else:
+                tpl =  ( repr(name), cls.__name__, )
+                raise AttributeError("No such attribute: %s (in class %s)" % \
+                                         tpl)
 
     @classmethod
     def __has_dbproperty__(cls, name):
         """
         Return whether this dbclass has a property named `name`.
         """
-        try:
-            cls.__dbproperty__(name)
-            return True
-        except NoDbPropertyByThatName:
-            return False
-        except AttributeError:
-            return False
+        return cls.__properties__().by_name.has_key(name)
 
     @classmethod
     def __select_expressions__(cls, full_column_names=False):
@@ -439,13 +1029,8 @@ class dbobject(object):
         A list of columns to select from the relation to construct one
         of these. 
         """
-        columns = []
-        for property in cls.__dbproperties__():
-            new = property.select_expression(cls, full_column_names)
-            if new is not None and not new in columns:
-                columns.append(new)
-                
-        return columns
+        return cls.__properties__().select_expressions[
+            bool(full_column_names)]
 
 
     @classmethod
@@ -453,14 +1038,8 @@ class dbobject(object):
         """
         Return the list of our dbproperties’ attribute names.
         """
-        if include_relationships:
-            props = cls.__dbproperties__()
-        else:
-            from relationships import relationship
-            props = filter(lambda prop: not isinstance(prop, relationship),
-                           cls.__dbproperties__())
-            
-        return map(lambda dbprop: dbprop.attribute_name, props)
+        return map(lambda dbprop: dbprop.attribute_name,
+                   cls.__dbproperties__(include_relationships))
         
     def __repr__(self):
         """
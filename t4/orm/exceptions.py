@@ -39,6 +39,12 @@ class ORMException(Exception):
     Base class for all of orm's exceptions
     """
 
+class WrongThread(ORMException):
+    """
+    Raised if a datasource is used on a thread other than the one it
+    has been bound to (see datasource_base.bind_thread()).
+    """
+
 class InternalError(Exception):
     """
     Something inside orm has gone wrong.
@@ -36,6 +36,22 @@ from string import *
 from t4 import sql
 from exceptions import *
 
+def key_where(columns, literals):
+    """
+    @returns: sql.where() instance comparing each of COLUMNS to the
+       corresponding one of LITERALS.
+    """
+    where = []
+    for column, literal in zip(columns, literals):
+        where.append(column)
+        where.append("=")
+        where.append(literal)
+        where.append("AND")
+
+    del where[-1] # remove the straneous AND
+
+    return sql.where(*where)
+
 class key:
     """
     This class manages keys of dbobjects (not dbclasses! The object must be
@@ -157,7 +173,7 @@ class key:
             msg = "%s not a single column key" % repr(self.key_columns)
             raise SimplePrimaryKeyNeeded(msg)
         else:
-            return self.values().next()
+            return self.values()[0]
 
     def values(self):
         """
@@ -200,18 +216,7 @@ class key:
         if not self.isset():
             raise KeyNotSet()
 
-        literals = self.sql_literals()
-
-        where = []
-        for column, literal in zip(columns, literals):
-            where.append(column)
-            where.append("=")
-            where.append(literal)
-            where.append("AND")
-
-        del where[-1] # remove the straneous AND
-
-        return sql.where(*where)
+        return key_where(columns, self.sql_literals())
 
     def where(self):
         """
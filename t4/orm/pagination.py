@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+This module implements keyset (or 'seek') pagination. Rather than
+skipping the rows of previous pages using OFFSET, which makes the
+backend read and discard them, the next page is selected by a WHERE
+clause that compares the ordering columns to the values of the last
+row of the previous page. The dbclass' primary key is added to the
+ordering columns, so the order is unique. The values are handed to
+the application as an opaque continuation token::
+
+   page = ds.paginate(person, order_by='lastname', page_size=20)
+   for p in page: ...
+   
+   next_page = ds.paginate(person, order_by='lastname', page_size=20,
+                           after=page.token)
+
+Note that NULL values in the ordering columns are not supported.
+"""
+
+import json, base64, decimal, datetime
+from types import *
+from string import *
+
+from t4 import sql
+from exceptions import *
+import keys
+
+class page:
+    """
+    A page of dbobjs as returned by paginate(). It may be used like a
+    list of dbobjs.
+
+    @ivar dbobjs: The list of dbobjs on this page.
+    @ivar token: The continuation token to be passed as 'after' to
+       retrieve the next page, or None, if this is the last page.
+    """
+    def __init__(self, dbobjs, token):
+        self.dbobjs = dbobjs
+        self.token = token
+
+    def __iter__(self):
+        return iter(self.dbobjs)
+
+    def __len__(self):
+        return len(self.dbobjs)
+
+    def __getitem__(self, idx):
+        return self.dbobjs[idx]
+
+    def has_more(self):
+        return self.token is not None
+
+
+class _values:
+    def __init__(self):
+        self.__values__ = []
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return [ "datetime", [ value.year, value.month, value.day,
+                               value.hour, value.minute, value.second,
+                               value.microsecond, ], ]
+    elif isinstance(value, datetime.date):
+        return [ "date", [ value.year, value.month, value.day, ], ]
+    elif isinstance(value, datetime.time):
+        return [ "time", [ value.hour, value.minute, value.second,
+                           value.microsecond, ], ]
+    elif isinstance(value, decimal.Decimal):
+        return [ "decimal", str(value), ]
+    elif type(value) == StringType:
+        return [ "str", value.encode("base64"), ]
+    elif type(value) in ( UnicodeType, IntType, LongType, FloatType,
+                          BooleanType, NoneType, ):
+        return value
+    else:
+        raise TypeError("Can't paginate by values of %s" % repr(type(value)))
+
+def _decode_value(value):
+    if type(value) != ListType:
+        return value
+
+    tag, data = value
+    if tag == "datetime":
+        return datetime.datetime(*data)
+    elif tag == "date":
+        return datetime.date(*data)
+    elif tag == "time":
+        return datetime.time(*data)
+    elif tag == "decimal":
+        return decimal.Decimal(data)
+    elif tag == "str":
+        return str(data).decode("base64")
+    else:
+        raise ValueError(tag)
+
+def encode_token(values):
+    """
+    Return the continuation token for the tuple VALUES.
+    """
+    return base64.urlsafe_b64encode(json.dumps(map(_encode_value, values)))
+
+def decode_token(token):
+    """
+    Return the tuple of values encoded in TOKEN.
+    """
+    try:
+        return tuple(map(_decode_value, json.loads(
+                    base64.urlsafe_b64decode(str(token)))))
+    except (ValueError, TypeError, UnicodeError):
+        raise ValueError("Illegal continuation token: %s" % repr(token))
+
+
+def keyset_where(columns, literals, desc=False):
+    """
+    Return a where clause that matches the rows that come after the
+    row identified by LITERALS in the order of COLUMNS. The first
+    column is also compared on its own, so that the backend may use an
+    index on it.
+    """
+    if desc:
+        op, op_or_equal = "<", "<="
+    else:
+        op, op_or_equal = ">", ">="
+        
+    ors = []
+    for idx, column in enumerate(columns):
+        parts = []
+        for c, l in zip(columns[:idx], literals[:idx]):
+            parts += [ c, "=", l, "AND", ]
+        parts += [ column, op, literals[idx], ]
+        ors.append(sql.where(*parts))
+
+    if len(ors) == 1:
+        return ors[0]
+    else:
+        return sql.where.and_(sql.where(columns[0], op_or_equal, literals[0]),
+                              sql.where.or_(*ors))
+
+def paginate(dbclass, select, clauses=(), order_by=(), after=None,
+             page_size=20, desc=False):
+    """
+    Return a L{page} of dbobjs of DBCLASS.
+
+    @param select: Function that is called with the clauses and returns
+       a result, like a datasource's or a relationship's select().
+    @param clauses: Additional clauses for the select. A WHERE clause
+       is connected to the keyset condition using AND. LIMIT, OFFSET and
+       ORDER BY clauses must not be used.
+    @param order_by: Attribute name or tuple of attribute names of the
+       dbclass the dbobjs are ordered by. The primary key attributes
+       are appended. 
+    @param after: Continuation token of the previous page or None for
+       the first page.
+    @param page_size: Maximum number of dbobjs on the page.
+    @param desc: Order descending rather than ascending.
+    """
+    if type(order_by) == StringType: order_by = ( order_by, )
+    attribute_names = list(order_by)
+
+    if dbclass.__primary_key__ is not None:
+        for name in keys.primary_key(dbclass).key_attributes:
+            if name not in attribute_names:
+                attribute_names.append(name)
+    elif len(attribute_names) == 0:
+        raise NoPrimaryKey("%s has no primary key to paginate by." % \
+                               dbclass.__name__)
+                
+    properties = map(dbclass.__dbproperty__, attribute_names)
+    columns = map(lambda p: sql.column(p.column._name, dbclass.__view__),
+                  properties)
+
+    clauses = list(clauses)
+    if after is not None:
+        values = decode_token(after)
+        if len(values) != len(properties):
+            raise ValueError("Illegal continuation token: %s" % repr(after))
+
+        # The dbproperties' sql_literal() methods take the values
+        # from a dbobj's __values__.
+        holder = _values()
+        literals = []
+        for property, value in zip(properties, values):
+            if value is None:
+                raise ValueError("Can't paginate by NULL values (%s)" % \
+                                     property.attribute_name)
+            property.store_value(holder, property.__convert__(value))
+            literals.append(property.sql_literal(holder))
+
+        where = keyset_where(columns, literals, desc)
+        for idx, clause in enumerate(clauses):
+            if isinstance(clause, sql.where):
+                clauses[idx] = sql.where.and_(clause, where)
+                break
+        else:
+            clauses.append(where)
+
+    if desc:
+        dir = "DESC"
+    else:
+        dir = "ASC"
+
+    # Every column needs its own direction, sql.order_by only
+    # puts one after the last.
+    clauses.append(sql.order_by(*map(lambda c: sql.expression(c, dir),
+                                     columns)))
+    # One more dbobj than needed tells us if there is a next page.
+    clauses.append(sql.limit(page_size + 1))
+
+    dbobjs = list(select(*clauses))
+    if len(dbobjs) > page_size:
+        dbobjs = dbobjs[:page_size]
+        last = dbobjs[-1]
+        token = encode_token(map(lambda name: getattr(last, name),
+                                 attribute_names))
+    else:
+        token = None
+
+    return page(dbobjs, token)
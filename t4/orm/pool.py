@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+This module implements a thread safe pool of datasources that works
+with any adapter. The pool creates datasources by calling a factory
+function, which may be anything that returns a connected datasource::
+
+   from t4.orm.pool import pool
+   
+   p = pool(lambda: datasource('adapter=pgsql dbname=test'),
+            min=2, max=10, timeout=5.0)
+
+   with p.checkout() as ds:
+       ds.select(...)
+       ds.commit()
+
+The datasource() function in t4.orm.datasource returns a pool if the
+connection string contains a pool=min,max parameter. The ds() method
+keeps the interface of the psycopg2 based pool the pgsql adapter
+used to provide. A datasource is
+rolled back when it is returned to the pool. Note that the
+datasources of a pool of SQLite :memory: datasources each have their
+own database.
+"""
+
+import sys, time, threading
+from types import *
+
+from t4.debug import debug
+from exceptions import *
+
+class PoolTimeout(ORMException):
+    """
+    Raised if no datasource became available within the timeout.
+    """
+
+class _member:
+    """
+    Book keeping for a datasource that belongs to the pool.
+    """
+    def __init__(self, ds):
+        self.ds = ds
+        self.created = time.time()
+        self.returned = self.created
+        self.thread = None
+        self.count = 0
+
+class checkout:
+    """
+    Context manager that borrows a datasource from a pool on enter and
+    returns it on exit. Returned by pool.checkout().
+    """
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.ds = None
+
+    def __enter__(self):
+        if self.ds is None:
+            self.ds = self.pool.borrow(self.timeout)
+        return self.ds
+
+    def __exit__(self, type, value, tb):
+        self.pool.giveback(self.ds)
+        self.ds = None
+
+    def __getattr__(self, name):
+        # Checkouts returned by pool.ds() stand in for the datasource.
+        ds = self.__dict__.get("ds", None)
+        if ds is None:
+            raise AttributeError(name)
+        return getattr(ds, name)
+
+class pool:
+    """
+    A pool of datasources.
+
+    A thread that borrows a datasource while it holds one gets the same
+    datasource again (it must give it back as many times). Otherwise the
+    datasource the thread has used last is preferred, if it is idle.
+    """
+    def __init__(self, factory, min=1, max=10, timeout=None,
+                 max_age=None, max_idle=None, validate=True,
+                 validate_after=0.0):
+        """
+        @param factory: Function that returns a new datasource.
+        @param min: Number of datasources created up front and kept
+           around by evict().
+        @param max: Maximum number of datasources.
+        @param timeout: Default number of seconds borrow() waits for a
+           datasource. None means to wait forever.
+        @param max_age: Datasources older than this number of seconds
+           are closed when they are borrowed or returned.
+        @param max_idle: Datasources unused for more than this number
+           of seconds are closed by evict(), unless that would leave
+           less than min datasources.
+        @param validate: ping() datasources when they are borrowed and
+           replace them if they fail.
+        @param validate_after: Only validate datasources that have been
+           idle for more than this number of seconds.
+        """
+        if max < 1 or min > max:
+            raise ValueError("Illegal pool size: min=%i max=%i" % (min, max))
+        
+        self.factory = factory
+        self.min = min
+        self.max = max
+        self.timeout = timeout
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.validate = validate
+        self.validate_after = validate_after
+
+        self._lock = threading.Condition(threading.Lock())
+        self._idle = [] # Most recently returned last
+        self._busy = {} # Maps id(ds) to members
+        self._creating = 0
+        self._local = threading.local()
+        
+        self._stats = { "checkouts": 0,
+                        "waits": 0,
+                        "wait_time": 0.0,
+                        "timeouts": 0,
+                        "created": 0,
+                        "closed": 0,
+                        "failed_validations": 0, }
+        
+        for a in range(min):
+            self._idle.append(_member(factory()))
+            self._stats["created"] += 1
+
+    def checkout(self, timeout=None):
+        """
+        Return a context manager that borrows a datasource on enter
+        and returns it on exit.
+        """
+        if timeout is None: timeout = self.timeout
+        return checkout(self, timeout)
+
+    __call__ = checkout
+
+    def ds(self, timeout=None):
+        """
+        Borrow a datasource and return a checkout holding it, which
+        passes attribute access on to the datasource and returns it to
+        the pool at the end of a with statement::
+
+           with p.ds() as ds:
+               ...
+        """
+        ret = self.checkout(timeout)
+        ret.ds = self.borrow(ret.timeout)
+        return ret
+
+    def borrow(self, timeout=None):
+        """
+        Return a ready datasource. If all of the pool's datasources are
+        in use and the pool has reached its maximum size, wait for one
+        to be returned.
+
+        @raises PoolTimeout: if no datasource became available in time.
+        """
+        # The datasource may have been returned by another thread.
+        held = getattr(self._local, "member", None)
+        if held is not None and held.count > 0 and \
+               held.thread is threading.current_thread():
+            held.count += 1
+            return held.ds
+
+        if timeout is None: timeout = self.timeout
+        
+        while True:
+            member = self._acquire(timeout)
+            
+            if member is None:
+                member = self._create()
+            elif not self._usable(member):
+                self._lock.acquire()
+                del self._busy[id(member.ds)]
+                self._lock.release()
+                
+                self._discard(member)
+                continue
+
+            break
+
+        self._lock.acquire()
+        try:
+            member.thread = threading.current_thread()
+            member.count = 1
+            self._stats["checkouts"] += 1
+        finally:
+            self._lock.release()
+            
+        self._local.member = member
+        return member.ds
+
+    def giveback(self, ds):
+        """
+        Return DS to the pool. The datasource is rolled back.
+        """
+        self._lock.acquire()
+        try:
+            member = self._busy.get(id(ds), None)
+        finally:
+            self._lock.release()
+
+        if member is None or member.ds is not ds:
+            raise ValueError("%s has not been borrowed from this pool." % \
+                                 repr(ds))
+
+        member.count -= 1
+        if member.count > 0:
+            return
+
+        if getattr(self._local, "member", None) is member:
+            self._local.member = None
+        
+        try:
+            ds.rollback()
+            broken = False
+        except Exception:
+            broken = True
+
+        self._lock.acquire()
+        try:
+            del self._busy[id(ds)]
+            if not broken and not self._too_old(member):
+                member.returned = time.time()
+                self._idle.append(member)
+                self._lock.notify()
+                return
+        finally:
+            self._lock.release()
+
+        self._discard(member)
+
+    def evict(self):
+        """
+        Close idle datasources that exceed max_age or max_idle, keeping
+        at least min datasources in the pool.
+        """
+        now = time.time()
+        evicted = []
+        
+        self._lock.acquire()
+        try:
+            for member in self._idle[:]:
+                if self._size() <= self.min:
+                    break
+                
+                if self._too_old(member) or (
+                    self.max_idle is not None and
+                    now - member.returned > self.max_idle):
+                    self._idle.remove(member)
+                    evicted.append(member)
+        finally:
+            self._lock.release()
+
+        for member in evicted:
+            self._discard(member, release=False)
+
+    def close(self):
+        """
+        Close all idle datasources. Datasources in use are closed when
+        they are returned.
+        """
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = []
+            self.min = 0
+            self.max_age = 0
+        finally:
+            self._lock.release()
+
+        for member in idle:
+            self._discard(member, release=False)
+
+    def stats(self):
+        """
+        Return a dict containing the pool's statistics: the number of
+        checkouts, waits for a datasource, the total wait_time in
+        seconds, timeouts, datasources created, datasources closed,
+        failed_validations, and the current size, idle and busy
+        numbers of datasources.
+        """
+        self._lock.acquire()
+        try:
+            ret = self._stats.copy()
+            ret["size"] = self._size()
+            ret["idle"] = len(self._idle)
+            ret["busy"] = len(self._busy)
+        finally:
+            self._lock.release()
+
+        return ret
+
+    # The methods below must be called with the lock held, where noted.
+    
+    def _size(self):
+        # Lock held.
+        return len(self._idle) + len(self._busy) + self._creating
+
+    def _acquire(self, timeout):
+        """
+        Return an idle member, which is now busy, or None, if the
+        caller may create a new datasource (which has been accounted
+        for in _creating).
+        """
+        self._lock.acquire()
+        try:
+            start = None
+            while True:
+                if len(self._idle) > 0:
+                    member = self._pick()
+                    self._busy[id(member.ds)] = member
+                    return member
+                
+                if self._size() < self.max:
+                    self._creating += 1
+                    return None
+
+                now = time.time()
+                if start is None:
+                    start = now
+                    self._stats["waits"] += 1
+
+                if timeout is None:
+                    self._lock.wait()
+                else:
+                    remaining = start + timeout - now
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout("No datasource available after "
+                                          "%.1f seconds" % timeout)
+                    self._lock.wait(remaining)
+
+                self._stats["wait_time"] += time.time() - now
+        finally:
+            self._lock.release()
+
+    def _pick(self):
+        # Lock held. Prefer the datasource this thread used last.
+        me = threading.current_thread()
+        for idx in range(len(self._idle)-1, -1, -1):
+            if self._idle[idx].thread is me:
+                return self._idle.pop(idx)
+
+        return self._idle.pop()
+
+    def _create(self):
+        """
+        Create a new busy member, for which _acquire() has made room.
+        """
+        try:
+            member = _member(self.factory())
+        except:
+            self._lock.acquire()
+            self._creating -= 1
+            self._lock.notify()
+            self._lock.release()
+            raise
+        
+        self._lock.acquire()
+        try:
+            self._creating -= 1
+            self._busy[id(member.ds)] = member
+            self._stats["created"] += 1
+        finally:
+            self._lock.release()
+            
+        return member
+
+    def _too_old(self, member):
+        return self.max_age is not None and \
+               time.time() - member.created > self.max_age
+
+    def _usable(self, member):
+        if self._too_old(member):
+            return False
+
+        if self.validate and \
+               time.time() - member.returned >= self.validate_after:
+            if not member.ds.ping():
+                self._lock.acquire()
+                self._stats["failed_validations"] += 1
+                self._lock.release()
+                return False
+
+        return True
+    
+    def _discard(self, member, release=True):
+        """
+        Close the member's datasource. If RELEASE is set, a thread
+        waiting for a datasource is notified, because it may create a
+        new one now.
+        """
+        try:
+            member.ds.close()
+        except Exception, e:
+            print >> debug, "Closing pooled datasource failed:", repr(e)
+            
+        self._lock.acquire()
+        try:
+            self._stats["closed"] += 1
+            if release: self._lock.notify()
+        finally:
+            self._lock.release()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+This module implements the datasource's select_values() and
+select_rows() methods. Rather than dbobjs they return the values of a
+few of a dbclass' attributes, SELECTing only the corresponding
+columns::
+
+   for id, name in ds.select_values(person, ( 'id', 'name', ),
+                                    sql.where('age > 30')):
+       ...
+
+   for row in ds.select_rows(person, ( 'id', 'name', )):
+       print row.id, row.name
+
+The values are converted as the dbproperties would (their
+__convert__() methods, Unicode decoding and the decoding of
+serialized datatypes), but no dbobjects or dicts are created. Rows
+are retrieved from the cursor in batches using fetchmany().
+"""
+
+from types import *
+from collections import namedtuple
+
+from t4 import sql
+from datatypes import datatype, wrapper, delayed, Unicode, serialized, \
+     datetime_base, UNSET
+from relationships import relationship
+
+# Named tuple classes by dbclass and attribute names.
+_row_classes = {}
+
+def row_class(dbclass, attribute_names):
+    """
+    Return the named tuple class with ATTRIBUTE_NAMES as fields used
+    for the rows of DBCLASS.
+    """
+    key = ( dbclass, attribute_names, )
+    ret = _row_classes.get(key, None)
+    if ret is None:
+        ret = namedtuple(dbclass.__name__ + "_row", attribute_names)
+        _row_classes[key] = ret
+    return ret
+
+def scratch_dbobj(ds, dbclass):
+    """
+    Return an empty dbobj of DBCLASS, retrieved from DS as far as its
+    dbproperties can tell, to run their __set_from_result__() methods
+    on.
+    """
+    dbobj = dbclass.__new__(dbclass)
+    d = dbobj.__dict__
+    d["__values__"] = [ UNSET, ] * len(dbclass.__slot_names__)
+    d["__changed__"] = 0
+    d["__primary_key__"] = None
+    d["_ds"] = ds
+    d["_is_stored"] = True
+    return dbobj
+
+def converter(ds, property):
+    """
+    Return a function that converts a column value retrieved from DS
+    to the Python value PROPERTY would store, or None, if the values
+    may be used as they are. Overloaded __set_from_result__() methods
+    are run on a scratch dbobj (see scratch_dbobj()), like the
+    materializer does.
+    """
+    plain_set_from_result = datatype.__dict__["__set_from_result__"]
+    plain_convert = datatype.__dict__["__convert__"]
+    unicode_set_from_result = Unicode.__dict__["__set_from_result__"]
+    datetime_set_from_result = datetime_base.__dict__["__set_from_result__"]
+
+    cls = property.__class__
+    
+    if isinstance(property, serialized):
+        decode = property.decode
+        def convert(value):
+            if value is None:
+                return None
+            else:
+                return decode(value)
+            
+    elif cls.__set_from_result__.im_func is unicode_set_from_result:
+        encoding = ds.backend_encoding()
+        def convert(value):
+            if value is None or type(value) == UnicodeType:
+                return value
+            else:
+                return unicode(value, encoding)
+
+    elif cls.__set_from_result__.im_func is plain_set_from_result and \
+             cls.__convert__.im_func is plain_convert:
+        python_class = property.python_class
+        if python_class is None:
+            return None
+        
+        def convert(value):
+            if value is None or isinstance(value, python_class):
+                return value
+            else:
+                return python_class(value)
+            
+    elif cls.__set_from_result__.im_func is plain_set_from_result or \
+             cls.__set_from_result__.im_func is datetime_set_from_result:
+        if isinstance(property, datetime_base):
+            __convert__ = property.__convert_result__
+        else:
+            __convert__ = property.__convert__
+            
+        def convert(value):
+            if value is None:
+                return None
+            else:
+                return __convert__(value)
+
+    else:
+        dbobj = scratch_dbobj(ds, property.dbclass)
+        set_from_result = property.__set_from_result__
+        def convert(value):
+            property.store_value(dbobj, UNSET)
+            set_from_result(ds, dbobj, value)
+            return property.stored_value(dbobj, None)
+
+    return convert
+
+def columns_and_converters(ds, dbclass, attribute_names, full_column_names):
+    """
+    Return a pair of lists as ( columns, converters ) for the
+    ATTRIBUTE_NAMES of DBCLASS. Delayed dbproperties are selected like
+    any other. Values are converted by the innermost datatype of
+    wrappers, then passed through the decode() methods of wrappers
+    like csv.
+    """
+    columns = []
+    converters = []
+    for name in attribute_names:
+        property = dbclass.__dbproperty__(name)
+        if isinstance(property, relationship):
+            raise TypeError("%s.%s is a relationship, not a column." % (
+                dbclass.__name__, name, ))
+
+        column = property.select_expression(dbclass, full_column_names)
+        if column is None and isinstance(property, delayed):
+            column = property.inside_datatype.select_expression(
+                dbclass, full_column_names)
+        if column is None:
+            raise TypeError("%s.%s can't be selected." % (
+                dbclass.__name__, name, ))
+        columns.append(column)
+
+        decoders = []
+        while isinstance(property, wrapper):
+            if type(property).__dict__.has_key("decode"):
+                decoders.insert(0, property.decode)
+            property = property.inside_datatype
+
+        convert = converter(ds, property)
+        for decode in decoders:
+            if convert is None:
+                convert = decode
+            else:
+                convert = lambda value, convert=convert, decode=decode: \
+                              decode(convert(value))
+        converters.append(convert)
+
+    return columns, converters
+
+def select_values(ds, dbclass, attribute_names, clauses, named=False,
+                  stream=False, batch_size=None):
+    """
+    Yield the values of DBCLASS' ATTRIBUTE_NAMES for each row selected
+    by CLAUSES as tuples, or named tuples (see row_class()) if NAMED
+    is set. If ATTRIBUTE_NAMES is a string, the values are yielded
+    as they are.
+
+    @param stream: Run the query on a server side cursor, if the
+       backend provides them.
+    @param batch_size: Number of rows fetched at a time. Defaults to
+       the datasource's fetch_batch_size.
+    """
+    single = type(attribute_names) == StringType
+    if single:
+        attribute_names = ( attribute_names, )
+    attribute_names = tuple(attribute_names)
+    
+    clauses = filter(lambda clause: clause is not None, clauses)
+    full_column_names = False
+    for clause in clauses:
+        if isinstance(clause, (sql.left_join, sql.right_join,)):
+            full_column_names = True
+
+    columns, converters = columns_and_converters(ds, dbclass,
+                                                 attribute_names,
+                                                 full_column_names)
+    query = sql.select(tuple(columns), dbclass.__view__, *clauses)
+    
+    if batch_size is None: batch_size = ds.fetch_batch_size
+    if stream:
+        cursor = ds.stream_cursor(batch_size)
+        cursor.execute(query)
+    else:
+        cursor = ds.execute(query)
+
+    conversions = filter(lambda (idx, convert): convert is not None,
+                         enumerate(converters))
+    if named:
+        make = row_class(dbclass, attribute_names)._make
+    else:
+        make = tuple
+        
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                break
+
+            for row in rows:
+                if single:
+                    if len(conversions) == 0:
+                        yield row[0]
+                    else:
+                        yield converters[0](row[0])
+                    continue
+                
+                if len(conversions) > 0:
+                    row = list(row)
+                    for idx, convert in conversions:
+                        row[idx] = convert(row[idx])
+                        
+                yield make(row)
+    finally:
+        cursor.close()
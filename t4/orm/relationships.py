@@ -36,11 +36,24 @@ from types import *
 
 # t4
 from t4 import sql
-import keys
+import keys, pagination
 from datatypes import datatype
 from exceptions import *
 
 
+def _select_in(ds, dbclass, columns, literals):
+    """
+    Yield the dbobjs of DBCLASS whoes COLUMNS match one of the tuples
+    in LITERALS (see sql.where.in_()), using one query for each
+    ds.prefetch_chunk_size tuples.
+    """
+    literals = list(literals)
+    size = ds.prefetch_chunk_size
+    for a in range(0, len(literals), size):
+        where = sql.where.in_(columns, literals[a:a+size])
+        for dbobj in ds.select(dbclass, where):
+            yield dbobj
+
 class relationship(datatype):
     """
     Base class for all relationships.
@@ -127,7 +140,7 @@ class _2many(relationship):
         def select(self, *clauses):
             raise NotImplementedError()
 
-        def len(self, *claises):
+        def len(self, *clauses, **kw):
             raise NotImplementedError()
                         
         def append(self, *new_child_objects):
@@ -136,17 +149,82 @@ class _2many(relationship):
         def __len__(self):
             """
             Return the number of child dbobjects returned (='contained') in
-            this result. Note that a call to this function will yield a SQL
-            query seperate from the one used to retrieve the the actual
-            objects on every call.
+            this result. Note that the first call to this function will
+            yield a SQL query seperate from the one used to retrieve the
+            the actual objects. The number is remembered by the dbobj
+            until one of the relations it is counted from (see
+            relations()) is modified through the datasource, the
+            transaction is rolled back or forget() is called.
+            """
+            ds = self.ds()
+            stamp = map(ds.modification_stamp, self.relations())
+            
+            name = self.relationship.len_attribute_name()
+            memo = self.dbobj.__dict__.get(name, None)
+            if memo is not None and memo[0] == stamp:
+                return memo[1]
+            
+            # some backends return long instead of int
+            ret = int(self.len())
+            self.dbobj.__dict__[name] = ( stamp, ret, )
+            return ret
+
+        def relations(self):
+            """
+            Return the relations the child objects are selected from.
             """
-            return int(self.len()) # some backends return long instead of int
+            return ( self.child_class().__relation__, )
         
         def ds(self):
             return self.dbobj.__ds__()
 
         def child_class(self):
             return self.relationship.child_class
+
+        def cached(self):
+            """
+            Return the list of child objects stored in the dbobj by
+            the relationship's __prefetch__() or None.
+            """
+            return getattr(self.dbobj,
+                           self.relationship.cache_attribute_name(), None)
+
+        def cached_result(self, clauses, kw):
+            """
+            Return a L{dbobject.cached_result} for the prefetched child
+            objects if select() has been called without clauses,
+            otherwise None.
+            """
+            cached = self.cached()
+            if cached is None or len(clauses) > 0:
+                return None
+            else:
+                from dbobject import cached_result
+                ret = cached_result(cached)
+                if kw.get("prefetch", ()):
+                    ret.prefetch(*kw["prefetch"])
+                if kw.get("undefer", ()):
+                    ret.undefer(*kw["undefer"])
+                return ret
+
+        def paginate(self, *clauses, **kw):
+            """
+            Return a page of child objects using keyset pagination. The
+            clauses are treated as by select(), the keyword arguments
+            as by datasource_base.paginate().
+            """
+            return pagination.paginate(self.child_class(), self.select,
+                                       clauses, **kw)
+        
+        def forget(self):
+            """
+            Throw away the prefetched child objects, if any, and the
+            remembered length.
+            """
+            for name in ( self.relationship.cache_attribute_name(),
+                          self.relationship.len_attribute_name(), ):
+                if self.dbobj.__dict__.has_key(name):
+                    del self.dbobj.__dict__[name]
         
         def where(self):
             return self.foreign_key.other_where()
@@ -176,6 +254,21 @@ class _2many(relationship):
         self.dbclass = dbclass
         self.attribute_name = attribute_name
 
+    def cache_attribute_name(self):
+        """
+        Name of the dbobj attribute __prefetch__() stores the list of
+        child objects in.
+        """
+        return " %s_cache" % self.attribute_name
+
+    def len_attribute_name(self):
+        """
+        Name of the dbobj attribute the result's __len__() stores the
+        number of child objects in, along with the modification stamps
+        of the relations it has been counted from.
+        """
+        return " %s_len" % self.attribute_name
+
     def __get__(self, dbobj, owner=None):
         return self.result(dbobj, self)
 
@@ -229,7 +322,7 @@ class one2many(_2many):
                                                 relationship.child_class,
                                                 foreign_key,
                                                 child_key)
-        def select(self, *clauses):
+        def select(self, *clauses, **kw):
             """
             This method allows you to add your own clauses to the SELECT
             SQL statement that is used to retrieve the childobjects from the
@@ -245,21 +338,31 @@ class one2many(_2many):
             Example::
 
               country.cities.select(order_by='name')
-              
+
+            If the child objects have been prefetched and no clauses
+            are given, no query is run.
             """
+            cached = self.cached_result(clauses, kw)
+            if cached is not None:
+                return cached
+            
             clauses = self.add_where(clauses)
-            return self.ds().select(self.child_class(), *clauses)
+            return self.ds().select(self.child_class(), *clauses, **kw)
 
-        def len(self, *clauses):
+        def len(self, *clauses, **kw):
             """
             Return the number of child objects that would be returned by
             the select() method using clauses. Note that a call to this
             function will yield a SQL query seperate from the one used to
             actually retrieve the dbobjects. (See datasource_base.count() for
-            details)
+            details, including the approximate keyword argument)
             """
+            cached = self.cached()
+            if cached is not None and len(clauses) == 0:
+                return len(cached)
+            
             clauses = self.add_where(clauses)
-            return self.ds().count(self.child_class(), *clauses)
+            return self.ds().count(self.child_class(), *clauses, **kw)
 
         def append(self, *new_child_objects):
             """
@@ -278,6 +381,8 @@ class one2many(_2many):
                                      " relationship that are already stored"+\
                                      " in the database.")
 
+            self.forget()
+            
             for a in new_child_objects:
                 items = zip(self.foreign_key.other_attribute_names(),
                             self.foreign_key.values())
@@ -289,6 +394,36 @@ class one2many(_2many):
     def __init_dbclass__(self, dbclass, attribute_name):
         _2many.__init_dbclass__(self, dbclass, attribute_name)
 
+    def __prefetch__(self, ds, dbobjs):
+        """
+        Select the child objects of all of DBOBJS at once and store
+        them in the dbobjs, so that select() and len() without clauses
+        will not query the database.
+        """
+        parents = {}
+        for dbobj in dbobjs:
+            foreign_key = self.result(dbobj, self).foreign_key
+            key = foreign_key.values()
+            if not parents.has_key(key):
+                parents[key] = ( tuple(foreign_key.sql_literals()), [], )
+            parents[key][1].append(dbobj)
+
+        if len(parents) == 0:
+            return
+
+        children = {}
+        other_names = foreign_key.other_attribute_names()
+        for child in _select_in(ds, self.child_class,
+                                tuple(foreign_key.other_columns()),
+                                map(lambda (l, d): l, parents.values())):
+            key = tuple(map(lambda name: getattr(child, name), other_names))
+            children.setdefault(key, []).append(child)
+
+        for key, (literals, dbobjs) in parents.items():
+            for dbobj in dbobjs:
+                setattr(dbobj, self.cache_attribute_name(),
+                        children.get(key, [])[:])
+
     def __set__(self, dbobj, value):
         """
         Setting a one2many relationship needs three steps:
@@ -321,7 +456,7 @@ class many2many(_2many):
         Instances of this class are returned if you __get__ a many2many
         dbproperty.
         """
-        def select(self, *clauses):
+        def select(self, *clauses, **kw):
             """
             Use like this:
 
@@ -334,7 +469,14 @@ class many2many(_2many):
             and the child relation.  You must do that by hand. Also,
             doing so might mess up your db, so you might want to use
             FOREIGN KEY constraints on the link relation.
+
+            If the child objects have been prefetched and no clauses
+            are given, no query is run.
             """
+            cached = self.cached_result(clauses, kw)
+            if cached is not None:
+                return cached
+            
             relations = ( self.relationship.link_relation,
                           self.child_class().__view__, )
 
@@ -345,25 +487,46 @@ class many2many(_2many):
                     full_column_names=True),
                 relations, *clauses)
             
-            return self.ds().run_select(
-                self.child_class(), query)
+            result = self.ds().run_select(
+                self.child_class(), query, **self.ds().result_options(kw))
+
+            if kw.get("prefetch", ()):
+                result.prefetch(*kw["prefetch"])
+            if kw.get("undefer", ()):
+                result.undefer(*kw["undefer"])
+
+            return result
                                                   
+        def relations(self):
+            return ( self.relationship.link_relation,
+                     self.child_class().__relation__, )
 
-        def len(self, *clauses):
+        def len(self, *clauses, **kw):
             """
             Return the number of child objects associated with a parent.
             You may supply a where clause. The same things apply as for the
-            where clause for select(), see above.
+            where clause for select(), see above. With approximate=True
+            the backend's estimate is returned, if it provides one (see
+            datasource_base.estimate_count()).
             """
-            clauses = self.add_where(clauses)
+            cached = self.cached()
+            if cached is not None and len(clauses) == 0:
+                return len(cached)
             
-            query = sql.select("COUNT(*)",
-                               ( self.relationship.link_relation,
-                                 self.child_class().__view__, ),
-                               *clauses)
+            clauses = self.add_where(clauses)
+            relations = ( self.relationship.link_relation,
+                          self.child_class().__view__, )
+
+            if kw.get("approximate", False):
+                estimate = self.ds().estimate_count(
+                    sql.select(sql.expression("1"), relations, *clauses))
+                if estimate is not None:
+                    return estimate
+                
+            query = sql.select("COUNT(*)", relations, *clauses)
             
-            len, = self.ds().query_one(query)
-            return len
+            count, = self.ds().query_one(query)
+            return count
 
         def where(self):
             """
@@ -377,22 +540,16 @@ class many2many(_2many):
                 " = ",
                 self.dbobj.__primary_key__.sql_literal())
 
-            join_where = sql.where(
-                sql.column(self.child_class().__primary_key__,
-                           self.child_class().__view__),
-                " = ",
-                sql.column(self.relationship.child_link_column(),
-                           self.relationship.link_relation))
-
-            return sql.where.and_(join_where, parent_where)
+            return sql.where.and_(self.relationship.join_where(),
+                                  parent_where)
 
             
         def all(self, *clauses):
             """
             This method will return all entries in the child relation (or a
-            subset specified by clauses) and a list of those primary keys
-            which are present in the link table. You can check if a dbobj is
-            linked by doing:
+            subset specified by clauses) and a set of those primary keys
+            (as tuples) which are present in the link table. You can check
+            if a dbobj is linked by doing:
 
                 >>> result, active_keys = dbobj.relation.all()
                 >>> for a in result:
@@ -413,9 +570,9 @@ class many2many(_2many):
                                     relations, *join_clauses)
                 
                 cursor = self.ds().execute(query)
-                active_keys = list(cursor.fetchall())
+                active_keys = set(map(tuple, cursor.fetchall()))
             else:
-                active_keys = []
+                active_keys = set()
 
             result = self.ds().select(self.child_class(), *clauses)
 
@@ -423,28 +580,23 @@ class many2many(_2many):
 
         def append(self, *new_child_objects):
             """
-            Appends new child objects to the parent's many2many dbproperty. 
+            Appends new child objects to the parent's many2many
+            dbproperty. See append_many().
             """
-            for dbobj in new_child_objects:
-                if not isinstance(dbobj, self.child_class()):
-                    msg = "This relationship can only handle %s" % \
-                                           repr(self.child_class())
-                    raise TypeError(msg)
+            self.append_many(new_child_objects)
 
-                if not dbobj.__is_stored__():
-                    # The many2many relationship will insert fresh objects
-                    # into the database.
-                    self.ds().insert(dbobj)
-
-                # insert a row into the link_relation
-                command = sql.insert(self.relationship.link_relation,
-                  ( self.relationship.parent_link_column(self.dbobj),
-                    self.relationship.child_link_column(), ),
-                  ( self.relationship.parent_own_key(
-                                         self.dbobj).sql_literal(self.dbobj),
-                    self.relationship.child_own_key().sql_literal(dbobj), ))
-                
-                self.ds().execute(command)
+        def append_many(self, new_child_objects):
+            """
+            Link the parent to each of NEW_CHILD_OBJECTS. Child objects
+            that have not been stored are inserted using
+            ds.insert_many(), those that are linked to the parent already
+            are skipped. The remaining links are INSERTed with one
+            statement per ds.insert_chunk_size rows.
+            """
+            children = self._check_children(new_child_objects)
+            linked = self.linked_keys()
+            self._link(filter(lambda (key, child): not key in linked,
+                              children))
 
         def unlink(self, child_object):
             """
@@ -463,18 +615,137 @@ class many2many(_2many):
             """
             if not isinstance(pkey, sql.literal):
                 raise TypeError("pkey must be an sql.literal instance!")
+
+            self._unlink([pkey])
+
+        def unlink_many(self, child_objects):
+            """
+            Remove the entries from the link relation that link each of
+            CHILD_OBJECTS to the parent dbobj using one DELETE statement
+            per ds.prefetch_chunk_size children.
+            """
+            own_key = self.relationship.child_own_key()
+            self._unlink(map(own_key.sql_literal, child_objects))
+
+        def replace(self, child_objects):
+            """
+            Make CHILD_OBJECTS the only child objects linked to the
+            parent. The current links are SELECTed once and only the
+            difference is written: one DELETE ... IN per
+            ds.prefetch_chunk_size obsolete links and one multi-row
+            INSERT per ds.insert_chunk_size new ones. Child objects that
+            have not been stored are inserted as for append_many().
+            """
+            children = self._check_children(child_objects)
+            linked = self.linked_keys()
+
+            wanted = set(map(lambda (key, child): key, children))
+            own_key = self.relationship.child_own_key()
+            self._unlink(map(own_key.sql_literal_class,
+                             filter(lambda key: not key in wanted, linked)))
+            self._link(filter(lambda (key, child): not key in linked,
+                              children))
+
+        def linked_keys(self):
+            """
+            Return the set of child_own_key values the parent is linked
+            to according to the link relation.
+            """
+            column = self.relationship.child_link_column()
+            convert = self.relationship.child_own_key().__convert__
+            query = sql.select(( sql.column(column), ),
+                               self.relationship.link_relation,
+                               self.link_where())
+            return set(map(lambda row: convert(row[0]),
+                           self.ds().execute(query).fetchall()))
+
+        def link_where(self):
+            """
+            Return the WHERE clause that selects the parent's rows from
+            the link relation.
+            """
+            return sql.where(
+                self.relationship.parent_link_column(self.dbobj),
+                " = ",
+                self.relationship.parent_own_key(
+                                      self.dbobj).sql_literal(self.dbobj))
+
+        def _check_children(self, child_objects):
+            """
+            Make sure all of CHILD_OBJECTS are instances of the child
+            class and stored and return a list of ( key, child_object, )
+            pairs, one for each child_own_key value.
+            """
+            child_objects = list(child_objects)
+            for dbobj in child_objects:
+                if not isinstance(dbobj, self.child_class()):
+                    msg = "This relationship can only handle %s" % \
+                                           repr(self.child_class())
+                    raise TypeError(msg)
+
+            # The many2many relationship will insert fresh objects
+            # into the database.
+            fresh = filter(lambda dbobj: not dbobj.__is_stored__(),
+                           child_objects)
+            if len(fresh) > 0:
+                self.ds().insert_many(fresh)
+
+            own_key = self.relationship.child_own_key()
+            ret = []
+            seen = set()
+            for dbobj in child_objects:
+                key = own_key.__get__(dbobj)
+                if not key in seen:
+                    seen.add(key)
+                    ret.append( ( key, dbobj, ) )
+                    
+            return ret
+
+        def _link(self, children):
+            """
+            INSERT rows into the link relation for CHILDREN, a list of
+            ( key, child_object, ) pairs as returned by _check_children().
+            """
+            self.forget()
+
+            if len(children) == 0:
+                return
             
-            cmd = sql.delete(self.relationship.link_relation,
-                    sql.where(self.relationship.parent_link_column(self.dbobj),
-                              " = ",
-                              self.dbobj.__primary_key__.sql_literal(),
-                              " AND ",
-                              self.relationship.child_link_column(),
-                              " = ",
-                              pkey))
-                             
-            self.ds().execute(cmd)
+            ds = self.ds()
+            parent = self.relationship.parent_own_key(
+                self.dbobj).sql_literal(self.dbobj)
+            own_key = self.relationship.child_own_key()
+            rows = map(lambda (key, dbobj): ( parent,
+                                              own_key.sql_literal(dbobj), ),
+                       children)
+            columns = ( self.relationship.parent_link_column(self.dbobj),
+                        self.relationship.child_link_column(), )
             
+            if ds.multi_row_insert:
+                size = ds.insert_chunk_size
+            else:
+                size = 1
+                
+            for a in range(0, len(rows), size):
+                ds.execute(sql.insert(self.relationship.link_relation,
+                                      columns, *rows[a:a+size]))
+
+        def _unlink(self, literals):
+            """
+            DELETE the rows from the link relation that link the parent
+            to the children whoes child_link_column is in LITERALS.
+            """
+            self.forget()
+
+            ds = self.ds()
+            column = sql.column(self.relationship.child_link_column())
+            size = ds.prefetch_chunk_size
+            for a in range(0, len(literals), size):
+                where = sql.where.and_(
+                    self.link_where(),
+                    sql.where.in_(column, literals[a:a+size]))
+                ds.execute(sql.delete(self.relationship.link_relation,
+                                      where))
             
     
     def __init__(self, child_class, link_relation,
@@ -524,17 +795,9 @@ class many2many(_2many):
             raise ValueError( ("You must assing a sequence of %s to this "
                                "dbproperty!") % repr(self.child_class))
             
-        # delete all links from the link_relation that point to the dbobj
-        command = sql.delete(self.link_relation,
-                             sql.where(self.parent_link_column(dbobj),
-                                       " = ",
-                                       dbobj.__primary_key__.sql_literal()))
-        dbobj.__ds__().execute(command)
-
-        # use the result class to (re-)insert the links
+        # only write the difference to the current links
         result = self.result(dbobj, self)
-
-        result.append(*value)
+        result.replace(value)
         
     def reverse(cls, original_dbclass, attribute_name,
                 title=None):
@@ -593,6 +856,59 @@ class many2many(_2many):
         else:
             return self._child_link_column
 
+    def join_where(self):
+        """
+        Return the WHERE clause that limits the JOIN of the link relation
+        and the child relation to the linked rows.
+        """
+        return sql.where(
+            sql.column(self.child_class.__primary_key__,
+                       self.child_class.__view__),
+            " = ",
+            sql.column(self.child_link_column(), self.link_relation))
+
+    def __prefetch__(self, ds, dbobjs):
+        """
+        Select the child objects linked to all of DBOBJS at once and
+        store them in the dbobjs, so that select() and len() without
+        clauses will not query the database.
+        """
+        if len(dbobjs) == 0:
+            return
+
+        parents = {}
+        for dbobj in dbobjs:
+            key = dbobj.__primary_key__.value()
+            if not parents.has_key(key):
+                parents[key] = ( dbobj.__primary_key__.sql_literal(), [], )
+            parents[key][1].append(dbobj)
+
+        parent_column = sql.column(self.parent_link_column(dbobjs[0]),
+                                   self.link_relation)
+        convert = dbobjs[0].__primary_key__.attribute().__convert__
+        
+        columns = self.child_class.__select_expressions__(True)
+        materialize = self.child_class.__materializer__(columns)
+        relations = ( self.link_relation, self.child_class.__view__, )
+        
+        literals = map(lambda (l, d): l, parents.values())
+        children = {}
+        size = ds.prefetch_chunk_size
+        for a in range(0, len(literals), size):
+            where = sql.where.and_(self.join_where(),
+                                   sql.where.in_(parent_column,
+                                                 literals[a:a+size]))
+            query = sql.select(columns + ( parent_column, ), relations, where)
+            cursor = ds.execute(query)
+            for tpl in cursor.fetchall():
+                children.setdefault(convert(tpl[-1]), []).append(
+                    materialize(ds, tpl))
+
+        for key, (literal, dbobjs) in parents.items():
+            for dbobj in dbobjs:
+                setattr(dbobj, self.cache_attribute_name(),
+                        children.get(key, [])[:])
+
 
         
 
@@ -629,7 +945,81 @@ class many2one(relationship):
         self.cache = cache
         
     def __set_from_result__(self, ds, dbobj, value):
-        setattr(dbobj, self.data_attribute_name(), value)
+        self.store_value(dbobj, value)
+
+    def __prefetch__(self, ds, dbobjs):
+        """
+        Select the child objects of all of DBOBJS at once and store
+        them in the dbobjs' cache attribute. This is a no-op unless the
+        relationship has been created with cache=True.
+        """
+        if not self.cache:
+            return
+
+        cache_name = self.data_attribute_name() + "_cache"
+
+        if self.column is not None:
+            key_attribute = keys.primary_key(self.child_class).attribute()
+            key_names = ( key_attribute.attribute_name, )
+            columns = ( key_attribute.column, )
+        else:
+            foreign_key = None
+            
+        wanted = {}
+        for dbobj in dbobjs:
+            if self.column is not None:
+                value = datatype.__get__(self, dbobj)
+                if value is None:
+                    setattr(dbobj, cache_name, None)
+                    continue
+
+                known = ds.__known_dbobj__(self.child_class, value)
+                if known is not None:
+                    setattr(dbobj, cache_name, known)
+                    continue
+                
+                key = ( value, )
+                literals = ( key_attribute.sql_literal_class(value), )
+            else:
+                foreign_key = keys.foreign_key(dbobj, self.child_class,
+                                               self.foreign_key,
+                                               self.child_key)
+                if not foreign_key.isset():
+                    # __get__() will deal with it.
+                    continue
+
+                key = foreign_key.values()
+                if None in key:
+                    if filter(lambda v: v is not None, key) == []:
+                        setattr(dbobj, cache_name, None)
+                    # Otherwise __get__() will raise IllegalForeignKey
+                    continue
+                
+                literals = tuple(foreign_key.sql_literals())
+
+            if not wanted.has_key(key):
+                wanted[key] = ( literals, [], )
+            wanted[key][1].append(dbobj)
+
+        if len(wanted) == 0:
+            return
+
+        if self.column is None:
+            key_names = foreign_key.other_attribute_names()
+            columns = tuple(foreign_key.other_columns())
+
+        found = {}
+        for child in _select_in(ds, self.child_class, columns,
+                                map(lambda (l, d): l, wanted.values())):
+            key = tuple(map(lambda name: getattr(child, name), key_names))
+            found[key] = child
+
+        # Keys that don't refer to a child are left to __get__(), so it
+        # will behave as it would without prefetching.
+        for key, (literals, dbobjs) in wanted.items():
+            if found.has_key(key):
+                for dbobj in dbobjs:
+                    setattr(dbobj, cache_name, found[key])
 
     def __init_dbclass__(self, dbclass, attribute_name):
         if self.column is None and self.foreign_key is None:
@@ -681,7 +1071,27 @@ class many2one(relationship):
                 raise IllegalForeignKey("For a many2one relationship with a "+\
                                         "multi column key, either all attrs "+\
                                         "must be set or all must be None.")
-            
+
+            # If the foreign key refers to the child's primary key, the
+            # identity map may already know the child.
+            if self.child_class.__primary_key__ is not None:
+                primary_key = keys.primary_key(self.child_class)
+            else:
+                primary_key = None
+                
+            if primary_key is not None and \
+                   set(foreign_key.other_attribute_names()) == \
+                   set(primary_key.key_attributes):
+                values = dict(zip(foreign_key.other_attribute_names(),
+                                  foreign_key.values()))
+                key = tuple(map(values.get, primary_key.key_attributes))
+                ret = ds.__known_dbobj__(self.child_class, key)
+                if ret is not None:
+                    if self.cache:
+                        setattr(dbobj, self.data_attribute_name() + "_cache",
+                                ret)
+                    return ret
+
             result = ds.select(self.child_class,
                                foreign_key.other_where())
 
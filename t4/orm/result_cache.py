@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+
+"""
+This module implements an in-memory cache for the rows returned by
+SELECT queries. A datasource uses it once its enable_result_cache()
+method has been called::
+
+   ds.enable_result_cache(max_size=1000, ttl=300,
+                          ttls={ country: None, session: 0, })
+
+   countries = ds.select(country, sql.orderby('name')) # query
+   countries = ds.select(country, sql.orderby('name')) # cache hit
+
+The cache is keyed by the rendered SQL of the query (and its
+parameters) and keeps the raw row tuples, so dbobjs are rebuilt by
+the materializer for each hit and never shared between callers. It
+holds at most max_size entries and evicts the least recently used
+one first. The time to live may be set per dbclass, None meaning
+forever and 0 meaning the dbclass' queries are not cached at all.
+
+The relations a query reads from are taken from the FROM and JOIN
+clauses of its SQL, those of subqueries included. Queries for which
+that fails are not cached.
+
+The entries are invalidated by relation whenever the datasource
+executes a modifying statement (see datasource_base.execute()) or
+flushes updates and, as configured, on commit() and rollback().
+Note that changes made by other connections go unnoticed until the
+entries expire, so choose ttls for data that may change outside of
+your process.
+"""
+
+import re, time
+from string import *
+from types import *
+from collections import OrderedDict
+
+from t4 import sql
+
+
+_modified_relation_re = re.compile(
+    r"\s*(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+([^\s(]+)", re.IGNORECASE)
+
+def relation_name(relation):
+    """
+    Return the normalized name of RELATION, a sql.relation instance
+    or string, used to identify cache entries.
+    """
+    return lower(replace(replace(str(relation), '"', ""), "`", ""))
+
+_string_literal_re = re.compile(r"'(?:[^']|'')*'")
+_from_re = re.compile(r"\b(?:FROM|JOIN)\b", re.IGNORECASE)
+_identifier_re = re.compile(r'\s*((?:"[^"]+"|`[^`]+`|[\w$]+)'
+                            r'(?:\.(?:"[^"]+"|`[^`]+`|[\w$]+))*)')
+_alias_re = re.compile(r"\s*(?:AS\s+)?([\w$]+)", re.IGNORECASE)
+_not_aliases = set([ "where", "group", "order", "having", "limit",
+                     "offset", "union", "intersect", "except", "join",
+                     "inner", "left", "right", "full", "cross",
+                     "natural", "on", "using", "for", "window", ])
+
+def read_relations(command):
+    """
+    Return the set of normalized names of the relations the SQL
+    COMMAND reads from: those following a FROM or JOIN keyword
+    anywhere in the query, including subqueries in its WHERE clause,
+    and the rest of a comma separated FROM list. If a FROM is followed
+    by something else than a relation name or a subquery, return None.
+    """
+    # String literals may contain anything.
+    command = _string_literal_re.sub("''", command)
+    
+    ret = set()
+    for match in _from_re.finditer(command):
+        pos = match.end()
+        while True:
+            if command[pos:].lstrip().startswith("("):
+                # A subquery, its own FROM is matched by the loop.
+                break
+            
+            identifier = _identifier_re.match(command, pos)
+            if identifier is None:
+                return None
+            ret.add(relation_name(identifier.group(1)))
+            pos = identifier.end()
+
+            alias = _alias_re.match(command, pos)
+            if alias is not None and \
+                   lower(alias.group(1)) not in _not_aliases:
+                pos = alias.end()
+
+            rest = command[pos:].lstrip()
+            if rest.startswith(","):
+                pos = len(command) - len(rest) + 1
+            else:
+                break
+
+    if len(ret) == 0:
+        return None
+    else:
+        return ret
+
+def modified_relation(command):
+    """
+    Return the normalized name of the relation modified by COMMAND, an
+    sql.insert, sql.update or sql.delete instance or an SQL string, or
+    None if it can't be determined.
+    """
+    if isinstance(command, (sql.insert, sql.update, sql.delete,)):
+        return relation_name(command.relation)
+    elif type(command) == StringType:
+        match = _modified_relation_re.match(command)
+        if match is not None:
+            return relation_name(match.group(1))
+
+    return None
+
+
+class result_cache:
+    """
+    A size bounded LRU cache of query results as lists of row tuples.
+    
+    @ivar hits: Number of queries answered from the cache.
+    @ivar misses: Number of cacheable queries that had to be run.
+    @ivar invalidations: Number of entries removed because a relation
+       they read from has been modified.
+    @ivar evictions: Number of entries removed to make room for new ones.
+    """
+    def __init__(self, max_size=1000, ttl=None, ttls={},
+                 clear_on_commit=False, clear_on_rollback=True):
+        """
+        @param max_size: Maximum number of entries.
+        @param ttl: Default time to live of the entries in seconds. None
+           means they don't expire, 0 that nothing is cached unless a
+           ttl is set for the dbclass.
+        @param ttls: Dict mapping dbclasses to their time to live.
+        @param clear_on_commit: Empty the cache on commit(), so that
+           changes made by other connections become visible.
+        @param clear_on_rollback: Empty the cache on rollback().
+        """
+        self.max_size = max_size
+        self.default_ttl = ttl
+        self.ttls = dict(ttls)
+        self.clear_on_commit = clear_on_commit
+        self.clear_on_rollback = clear_on_rollback
+        
+        self.clear()
+        self.reset_stats()
+
+    def ttl(self, dbclass):
+        """
+        Return the time to live for the results of DBCLASS.
+        """
+        return self.ttls.get(dbclass, self.default_ttl)
+
+    def set_ttl(self, dbclass, ttl):
+        self.ttls[dbclass] = ttl
+
+    def get(self, key):
+        """
+        Return the rows stored for KEY or None, if there is no such
+        entry or it has expired.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            rows, relations, expires = entry
+            if expires is None or expires > time.time():
+                # Re-inserting the entry makes it the most recently used.
+                self._entries[key] = entry
+                self.hits += 1
+                return rows
+            else:
+                self._forget(key, relations)
+
+        self.misses += 1
+        return None
+
+    def put(self, key, relations, rows, ttl):
+        """
+        Store ROWS for KEY. RELATIONS is the set of names of the
+        relations the query read from.
+        """
+        if self._entries.has_key(key):
+            self._forget(key, self._entries.pop(key)[1])
+            
+        if ttl is None:
+            expires = None
+        else:
+            expires = time.time() + ttl
+
+        self._entries[key] = ( rows, relations, expires, )
+        for relation in relations:
+            self._by_relation.setdefault(relation, set()).add(key)
+
+        while len(self._entries) > self.max_size:
+            key, ( rows, relations, expires, ) = \
+                 self._entries.popitem(last=False)
+            self._forget(key, relations)
+            self.evictions += 1
+
+    def invalidate(self, relation):
+        """
+        Remove the entries that have read from RELATION, a relation
+        name as returned by relation_name(). If RELATION is None, all
+        entries are removed.
+        """
+        if relation is None:
+            self.invalidations += len(self._entries)
+            self.clear()
+            return
+        
+        for key in self._by_relation.pop(relation, ()):
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._forget(key, entry[1])
+                self.invalidations += 1
+
+    def _forget(self, key, relations):
+        for relation in relations:
+            keys = self._by_relation.get(relation, None)
+            if keys is not None:
+                keys.discard(key)
+                if len(keys) == 0:
+                    del self._by_relation[relation]
+                    
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        self._entries = OrderedDict()
+        self._by_relation = {}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def hit_rate(self):
+        """
+        Return the share of cacheable queries answered from the cache
+        as a float between 0 and 1.
+        """
+        if self.hits + self.misses == 0:
+            return 0.0
+        else:
+            return float(self.hits) / (self.hits + self.misses)
+        
+    def stats(self):
+        """
+        Return a dict containing the hits, misses, hit_rate,
+        invalidations, evictions and number of entries (size) of this
+        cache.
+        """
+        return { "hits": self.hits,
+                 "misses": self.misses,
+                 "hit_rate": self.hit_rate(),
+                 "invalidations": self.invalidations,
+                 "evictions": self.evictions,
+                 "size": len(self._entries), }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; -*-
+
+##  This file is part of the t4 Python module collection. 
+##
+##  Copyright 2008-12 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+##
+##  I have added a copy of the GPL in the file COPYING
+
+
+"""
+A query profiler for the statements sent through sql.cursor_wrapper.
+
+Once started, the profiler records for each query its statement shape
+(the SQL with all literals and placeholders replaced by '?'), its
+duration, the number of rows fetched from its cursor and the first
+caller outside the t4 package. The queries are aggregated per shape::
+
+   >>> p = query_profiler()
+   >>> p.start()
+   >>> with p.scope('GET /countries'):
+   ...    for country in ds.select(country):
+   ...        print country.cities.len()
+   >>> p.stop()
+   >>> p.report()
+
+Queries run within a scope are kept in the scope's queries list. If a
+SELECT of the same shape is run from the same line of code
+n_plus_one_threshold times within one scope, this is reported as an
+N+1 pattern: it is appended to the scope's suspects list and passed to
+the profiler's n_plus_one() method, which writes a message to the
+debug log. The example above will trigger it for the cities' count.
+
+Scopes are local to the thread that opened them, so each request of a
+multi threaded server may have its own.
+"""
+
+import sys, os.path, re, time, math, threading
+from string import *
+from types import *
+
+import t4
+from t4 import sql
+from t4.debug import debug
+
+_t4_dir = os.path.dirname(os.path.abspath(t4.__file__)) + os.sep
+
+_string_re = re.compile(r"'(?:[^']|'')*'")
+_number_re = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?")
+_placeholder_re = re.compile(r"%s|\$\d+")
+_list_re = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_whitespace_re = re.compile(r"\s+")
+
+def statement_shape(command):
+    """
+    Return COMMAND with all literals, placeholders and lists of those
+    replaced by '?' and whitespace normalized, so that statements
+    that differ only in their parameters have the same shape::
+
+       >>> statement_shape("SELECT * FROM city WHERE id IN (1, 2, 3)")
+       'SELECT * FROM city WHERE id IN (?)'
+    """
+    command = _string_re.sub("?", command)
+    command = _number_re.sub("?", command)
+    command = _placeholder_re.sub("?", command)
+    command = _list_re.sub("(?)", command)
+    return strip(_whitespace_re.sub(" ", command))
+
+def caller():
+    """
+    Return a 'filename:line in function' string naming the innermost
+    frame on the stack that does not belong to the t4 package.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if not os.path.abspath(filename).startswith(_t4_dir):
+            return "%s:%i in %s" % ( filename, frame.f_lineno,
+                                     frame.f_code.co_name, )
+        frame = frame.f_back
+
+    return None
+
+class query:
+    """
+    A single query as recorded by the profiler.
+    """
+    def __init__(self, command, params, shape, caller, stats):
+        self.command = command
+        self.params = params
+        self.shape = shape
+        self.caller = caller
+        self.stats = stats
+        self.start = time.time()
+        self.duration = None
+        self.rows = 0
+
+    def fetched(self, rows):
+        """
+        Called by the cursor wrapper for rows fetched from the cursor.
+        """
+        self.rows += rows
+        self.stats.rows += rows
+
+    def __repr__(self):
+        return "<query %s (%.6fs, %i rows) from %s>" % (
+            repr(self.shape), self.duration or 0.0, self.rows, self.caller, )
+
+class shape_stats:
+    """
+    Aggregate timing of all queries of one statement shape. Only the
+    most recent max_samples durations are retained for the p95.
+    """
+    def __init__(self, shape, max_samples):
+        self.shape = shape
+        self.max_samples = max_samples
+        self.count = 0
+        self.total = 0.0
+        self.rows = 0
+        self.durations = []
+
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.durations.append(duration)
+        if len(self.durations) > self.max_samples:
+            del self.durations[0]
+
+    def avg(self):
+        if self.count == 0:
+            return 0.0
+        else:
+            return self.total / self.count
+
+    def p95(self):
+        if len(self.durations) == 0:
+            return 0.0
+        
+        durations = sorted(self.durations)
+        idx = int(math.ceil(len(durations) * 0.95)) - 1
+        return durations[max(idx, 0)]
+
+    def as_dict(self):
+        return { "shape": self.shape,
+                 "count": self.count,
+                 "total": self.total,
+                 "avg": self.avg(),
+                 "p95": self.p95(),
+                 "rows": self.rows, }
+
+class scope:
+    """
+    A request scope as opened by query_profiler.scope(). 
+    """
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.queries = []
+        self.suspects = []
+        self._counts = {}
+        
+    def __enter__(self):
+        self.profiler._scopes().append(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.profiler._scopes().remove(self)
+
+    def add(self, query):
+        self.queries.append(query)
+
+        if not upper(query.shape[:6]) == "SELECT":
+            return
+        
+        key = ( query.shape, query.caller, )
+        count = self._counts.get(key, 0) + 1
+        self._counts[key] = count
+        
+        if count == self.profiler.n_plus_one_threshold:
+            self.suspects.append( ( query.shape, query.caller, ) )
+            self.profiler.n_plus_one(self, query.shape, query.caller)
+
+    def duration(self):
+        return sum([ q.duration for q in self.queries ])
+
+class query_profiler:
+    """
+    The profiler aggregates the queries sent to the database while it
+    is active. Only one profiler may be active at a time.
+    """
+    def __init__(self, n_plus_one_threshold=5, max_samples=1000):
+        """
+        @param n_plus_one_threshold: Number of times a SELECT of the same
+           shape may be run from the same caller within a scope before
+           it is reported as an N+1 pattern.
+        @param max_samples: Number of durations per shape retained to
+           calculate the 95th percentile.
+        """
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def start(self):
+        """
+        Make this the profiler sql.cursor_wrapper reports to.
+        """
+        sql.profiler = self
+
+    def stop(self):
+        if sql.profiler is self:
+            sql.profiler = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def reset(self):
+        """
+        Discard the aggregated statistics.
+        """
+        self._lock.acquire()
+        try:
+            self._stats = {}
+        finally:
+            self._lock.release()
+
+    def scope(self, name=None):
+        """
+        Return a context manager that collects the queries run by the
+        current thread within it.
+        """
+        return scope(self, name)
+
+    def _scopes(self):
+        if not hasattr(self._local, "scopes"):
+            self._local.scopes = []
+        return self._local.scopes
+
+    def current_scope(self):
+        """
+        Return the innermost scope open in this thread or None.
+        """
+        scopes = self._scopes()
+        if len(scopes) == 0:
+            return None
+        else:
+            return scopes[-1]
+
+    def begin(self, command, params):
+        """
+        Called by the cursor wrapper before COMMAND is executed.
+        """
+        shape = statement_shape(command)
+        
+        self._lock.acquire()
+        try:
+            stats = self._stats.get(shape, None)
+            if stats is None:
+                stats = shape_stats(shape, self.max_samples)
+                self._stats[shape] = stats
+        finally:
+            self._lock.release()
+
+        return query(command, params, shape, caller(), stats)
+
+    def end(self, query):
+        """
+        Called by the cursor wrapper after the query has been executed.
+        """
+        query.duration = time.time() - query.start
+
+        self._lock.acquire()
+        try:
+            query.stats.add(query.duration)
+        finally:
+            self._lock.release()
+
+        scope = self.current_scope()
+        if scope is not None:
+            scope.add(query)
+
+    def n_plus_one(self, scope, shape, caller):
+        """
+        Called when an N+1 pattern has been detected in SCOPE. This
+        writes a message to the debug log, overload it to report
+        elsewhere.
+        """
+        print >> debug, "N+1 query in scope %s: %s from %s" % (
+            repr(scope.name), shape, caller, )
+
+    def stats(self):
+        """
+        Return a list of dicts with the keys shape, count, total, avg,
+        p95 and rows, one for each statement shape, the one with the
+        largest total duration first.
+        """
+        self._lock.acquire()
+        try:
+            ret = map(lambda s: s.as_dict(), self._stats.values())
+        finally:
+            self._lock.release()
+            
+        ret.sort(key=lambda d: d["total"], reverse=True)
+        return ret
+
+    def report(self, fp=sys.stderr, limit=20):
+        """
+        Write the LIMIT statement shapes with the largest total duration
+        to FP.
+        """
+        print >> fp, "%6s %10s %10s %10s %8s  %s" % (
+            "count", "total", "avg", "p95", "rows", "statement", )
+        for d in self.stats()[:limit]:
+            print >> fp, "%6i %10.6f %10.6f %10.6f %8i  %s" % (
+                d["count"], d["total"], d["avg"], d["p95"], d["rows"],
+                d["shape"], )
@@ -55,7 +55,7 @@ The way it works is best described by example::
 """
 __author__ = "Diedrich Vorberg <diedrich@tux4web.de>"
 
-import json, decimal
+import re, json, decimal
 from string import *
 from types import *
 
@@ -82,6 +82,14 @@ class backend:
     escaped_chars = ( ('"', r'\"',),
                       ("'", r"\'",),
                       ("%", "%%",), )
+
+    # The placeholder direct_literals use for their parameters in the
+    # SQL code. It must match the DBAPI module's paramstyle.
+    placeholder = "%s"
+
+    # If set, all literals are passed to the DBAPI module as parameters
+    # rather than being escaped into the SQL code. See the sql class.
+    parameterized = False
     
     def identifyer_quotes(self, name):
         return '"%s"' % name
@@ -128,10 +136,22 @@ class mysql_backend(backend):
     # doesn't make sense on binary data for instance...
 
 class firebird_backend(backend):
-    pass
+    placeholder = "?"
 
 class gadfly_backend(backend):
-    pass
+    placeholder = "?"
+
+class sqlite_backend(backend):
+    """
+    Backend definition for SQLite. Single quotes are escaped by
+    doubling them, backslashes and percent signs have no special
+    meaning. SQLite can't handle NUL characters in the query string, so
+    they are concatenated into the literal using char(0).
+    """
+    escaped_chars = ( ("'", "''",),
+                      ("\0", "' || char(0) || '",), )
+
+    placeholder = "?"
 
 
 class sql:
@@ -157,15 +177,32 @@ class sql:
        of the SQL statement that have not been escaped by this module but
        shall be passed to cursor.execute() as second argument. Corresponding
        ?s will be contained in the SQL statement.
+    @var parameterized: If set, all literals are put into params and
+       represented by placeholders in the SQL code, so that the query text
+       only depends on the statement's structure and escaping is left to
+       the DBAPI module. Defaults to the backend's parameterized
+       attribute.
     """
     
-    def __init__(self, ds):
+    def __init__(self, ds, parameterized=None):
         if not isinstance(ds, backend):
             raise TypeError("sql takes a datasource as argument")
         
         self.ds = ds
         self.params = []
 
+        if parameterized is None:
+            self.parameterized = ds.parameterized
+        else:
+            self.parameterized = parameterized
+
+    def param(self, value):
+        """
+        Append VALUE to params and return the backend's placeholder.
+        """
+        self.params.append(value)
+        return self.ds.placeholder
+
     def __call__(self, *args):
         """
         The arguments must either provide an __sql__() function or be
@@ -302,28 +339,42 @@ class literal(_part):
     def __sql__(self, runner):
         return self._sql
 
-class integer_literal(literal):    
+class number_literal(literal):
+    """
+    Base class for the numeric literals. The number is kept in
+    _content to be passed as a parameter in parameterized mode.
+    """
+    def __sql__(self, runner):
+        if runner.parameterized:
+            return runner.param(self._content)
+        else:
+            return self._sql
+    
+class integer_literal(number_literal):
     def __init__(self, i):
         if type(i) != IntType and type(i) != LongType:
             raise TypeError(
                 "integer_literal takes an integer as argument, not a " +\
                     repr(type(i)))
+        self._content = i
         self._sql = str(i)
 
-class float_literal(literal):
+class float_literal(number_literal):
     def __init__(self, i):
         if type(i) != FloatType and type(i) != LongType:
             raise TypeError(
                 "float_literal takes an float as argument, not a " + \
                     repr(type(i)))
+        self._content = i
         self._sql = str(i)
 
-class decimal_literal(literal):
+class decimal_literal(number_literal):
     def __init__(self, i):
         if not isinstance(i, decimal.Decimal):
             raise TypeError(
                 "decimal_literal takes a decimal.Decimal "
                 "instance as argument, not a " + repr(type(i)))
+        self._content = i
         self._sql = str(i)
 
 class string_literal(literal):
@@ -335,6 +386,9 @@ class string_literal(literal):
         self._content = str(s)
 
     def __sql__(self, runner):
+        if runner.parameterized:
+            return runner.param(self._content)
+        
         s = runner.ds.escape_string(self._content)
         sql = runner.ds.string_quotes(s)
 
@@ -356,6 +410,9 @@ class unicode_literal(literal):
 
     def __sql__(self, runner):
         s = self._content.encode(runner.ds.backend_encoding(), self._errors)
+        if runner.parameterized:
+            return runner.param(s)
+        
         s = runner.ds.escape_string(s)
         sql = runner.ds.string_quotes(s)
 
@@ -374,12 +431,14 @@ class idna_literal(unicode_literal):
             remote = remote.encode("idna")
 
             s = "%s@%s" % ( local, remote, )
-            s = runner.ds.escape_string(s)
-            sql = runner.ds.string_quotes(s)
         else:
             s = self._content.encode("idna")
-            s = runner.ds.escape_string(s)
-            sql = runner.ds.string_quotes(s)
+
+        if runner.parameterized:
+            return runner.param(s)
+        
+        s = runner.ds.escape_string(s)
+        sql = runner.ds.string_quotes(s)
 
         return sql
 
@@ -388,16 +447,19 @@ class bool_literal(literal):
         self._content = bool(b)
 
     def __sql__(self, runner):
-        if self._content:
+        if runner.parameterized:
+            return runner.param(self._content)
+        elif self._content:
             return "TRUE"
         else:
             return "FALSE"
 
 class direct_literal(literal):
     """
-    This returns a %s as SQL code and the content you pass to the
-    constructor to be quoted by the cursor's implementation rather
-    than by the backend class' mechanism.
+    This returns a placeholder (%s for most backends) as SQL code and
+    the content you pass to the constructor to be quoted by the
+    cursor's implementation rather than by the backend class'
+    mechanism.
 
     Refer to he sql class' __call__() method.
     """
@@ -405,8 +467,7 @@ class direct_literal(literal):
         self._content = content
 
     def __sql__(self, runner):
-        runner.params.append(self._content)
-        return "%s"
+        return runner.param(self._content)
     
 
 class json_literal(string_literal):
@@ -657,6 +718,42 @@ class where(clause, expression):
         return ret
     and_ = classmethod(and_)
 
+    def in_(cls, columns, literals):
+        """
+        Return a where clause that matches those rows whoes COLUMNS
+        equal one of the LITERALS. COLUMNS may be a single column, in
+        which case LITERALS is a sequence of literals and the clause
+        will use IN, or a sequence of columns, in which case LITERALS
+        must be a sequence of tuples of literals, one for each column.
+        """
+        literals = list(literals)
+
+        if len(literals) < 1:
+            raise ValueError("Empty input for in_()")
+
+        if type(columns) in ( TupleType, ListType, ) and len(columns) == 1:
+            columns = columns[0]
+            literals = map(lambda tpl: tpl[0], literals)
+
+        if type(columns) not in ( TupleType, ListType, ):
+            ret = where(columns, " IN (")
+            for literal in literals:
+                ret._parts.append(literal)
+                ret._parts.append(",")
+            ret._parts[-1] = ")" # replace the last comma
+        else:
+            ret = where()
+            for tpl in literals:
+                ret._parts.append("(")
+                for column, literal in zip(columns, tpl):
+                    ret._parts += [ column, "=", literal, "AND", ]
+                ret._parts[-1] = ")" # replace the last AND
+                ret._parts.append("OR")
+            del ret._parts[-1] # remove the last OR
+
+        return ret
+    in_ = classmethod(in_)
+
 class order_by(clause):
     """
     Encapsulate the ORDER BY clause of a SELECT statement. Takes a
@@ -754,14 +851,16 @@ class select(statement):
                 raise TypeError("%s is not an SQL clause" % repr(c))
             
     def __sql__(self, runner):
+        # The parts are converted in the order they appear in the SQL,
+        # so the runner's params line up with the placeholders.
+        columns = flatten_identifyer_list(runner, self._columns)
+        relations = flatten_identifyer_list(runner, self._relations)
+
         clauses = filter(lambda a: a is not None, self._clauses)
         clauses.sort(lambda a, b: cmp(a.rank, b.rank))
         clauses = map(runner, clauses)
         clauses = join(clauses, " ")
 
-        columns = flatten_identifyer_list(runner, self._columns)
-        relations = flatten_identifyer_list(runner, self._relations)
-
         return "SELECT %(columns)s FROM %(relations)s %(clauses)s" % locals()
 
     @property
@@ -820,6 +919,10 @@ class insert(statement):
             tuples = join(tuples, ", ")
                                 
             return INSERT + " VALUES " + tuples
+
+    @property
+    def relation(self):
+        return self._relation
     
 class update(statement):
     """
@@ -843,7 +946,6 @@ class update(statement):
         
     def __sql__(self, runner):
         relation = runner(self._relation)
-        where = runner(self._where)
 
         info = []
         for column, value in self._info.items():
@@ -853,9 +955,16 @@ class update(statement):
             info.append( "%s = %s" % (column, value,) )
 
         info = join(info, ", ")
+
+        # The where clause comes last in the SQL and so must its params.
+        where = runner(self._where)
         
         return "UPDATE %(relation)s SET %(info)s %(where)s" % locals()
 
+    @property
+    def relation(self):
+        return self._relation
+
 
 class delete(statement):
     """
@@ -875,6 +984,10 @@ class delete(statement):
         else:
             return "DELETE FROM %(relation)s" % locals()
 
+    @property
+    def relation(self):
+        return self._relation
+
 class left_join(clause, expression):
     def __init__(self, relation, *parts):
         if hasattr(relation, "__relation__"): relation = relation.__relation__
@@ -900,16 +1013,181 @@ class right_join(clause, expression):
 class nil(expression, clause, statement):
     def __sql__(self, runner):
         return ""
+
+
+# Statement templates
+
+_slot_re = re.compile(r"\0(\d+)\0")
+
+class slot(clause):
+    """
+    The place of a literal (or any other part) in a statement
+    template, see L{template_cache}. A slot may also take a clause's
+    place in a statement, in which case it ranks like a where clause.
+    """
+    rank = 1
     
+    def __init__(self, index):
+        self._index = index
+
+    def __sql__(self, runner):
+        return "\0%i\0" % self._index
+
+class template:
+    """
+    The SQL code of a statement rendered once for a backend, split at
+    its slots. Binding the template to a list of literals only
+    converts those literals and joins the pieces.
+    """
+    def __init__(self, ds, statement):
+        runner = sql(ds, parameterized=False)
+        code = runner(statement)
+
+        if len(runner.params) > 0:
+            raise ValueError("Statement templates can't contain "
+                             "direct_literals, use slots.")
+
+        parts = _slot_re.split(code)
+        self._fragments = parts[::2]
+        self._indices = map(int, parts[1::2])
+
+    def bind(self, runner, literals):
+        ret = [ self._fragments[0], ]
+        for index, fragment in zip(self._indices, self._fragments[1:]):
+            ret.append(runner(literals[index]))
+            ret.append(fragment)
+
+        return join(ret, "")
+
+class template_cache:
+    """
+    The template cache memoizes the SQL code of statements that are
+    built over and over again with the same structure (the ORM's
+    primary key SELECTs for instance) per backend class. The
+    statements are identified by a key chosen by the caller. Literals
+    are put into the statement as L{slot}s and passed to the template
+    for each use. Use L{bound} statements to access the cache.
+
+    @ivar hits: Number of times a template has been found in the cache.
+    @ivar misses: Number of templates created.
+    @ivar enabled: If False, bound statements are built and rendered
+       each time, bypassing the cache.
+    """
+    def __init__(self):
+        self.enabled = True
+        self.clear()
+
+    def template(self, ds, key, build, arity):
+        """
+        Return the template for KEY and DS' backend. On a miss, BUILD
+        is called with ARITY slots to create the statement.
+        """
+        k = ( ds.__class__, key, )
+        try:
+            ret = self._templates[k]
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            ret = template(ds, build(*map(slot, range(arity))))
+            self._templates[k] = ret
+
+        return ret
+
+    def stats(self):
+        """
+        Return a dict containing the hits, misses and number of
+        templates (size) of this cache.
+        """
+        return { "hits": self.hits,
+                 "misses": self.misses,
+                 "size": len(self._templates), }
+
+    def discard(self, item):
+        """
+        Remove the templates whoes key contains ITEM, a dbclass for
+        instance, because the statements built for it have changed.
+        """
+        for k in self._templates.keys():
+            if item in k[1]:
+                del self._templates[k]
+
+    def clear(self):
+        """
+        Remove all templates and reset the counters.
+        """
+        self._templates = {}
+        self.hits = 0
+        self.misses = 0
+
+statement_cache = template_cache()
+
+class bound(statement):
+    """
+    A statement taken from the L{statement_cache}, along with the
+    literals for its slots. The build function must take as many
+    arguments as there are literals and return the statement. It is
+    called with slots when the template is created and with the
+    literals if the cache is disabled or the statement is needed as
+    such (see statement()).
+
+      query = sql.bound(( 'person by id', ), 
+                        lambda id: sql.select(( 'name', ), 'person',
+                                              sql.where('id = ', id)),
+                        ( sql.integer_literal(23), ))
+    """
+    def __init__(self, key, build, literals):
+        self._key = key
+        self._build = build
+        self._literals = tuple(literals)
+
+    # Whether the statement built for a key is a SELECT, see is_select().
+    _selects = {}
+    
+    def statement(self):
+        """
+        Return the statement built with the literals.
+        """
+        return self._build(*self._literals)
+
+    def is_select(self):
+        """
+        Tell whether the statement is a SELECT. The answer is
+        remembered by key.
+        """
+        ret = bound._selects.get(self._key, None)
+        if ret is None:
+            ret = isinstance(self.statement(), select)
+            bound._selects[self._key] = ret
+        return ret
+
+    def __sql__(self, runner):
+        if statement_cache.enabled:
+            template = statement_cache.template(runner.ds, self._key,
+                                                self._build,
+                                                len(self._literals))
+            return template.bind(runner, self._literals)
+        else:
+            return runner(self.statement())
+
+# The query profiler cursor_wrapper reports to, if any. See
+# t4.profiler.query_profiler.start().
+profiler = None
+
 class cursor_wrapper:
     """
     The cursor wrapper takes a regular database cursor and 'wraps' it
     up so that its execute() method understands sql.* objects as
-    parameters. 
+    parameters.
+
+    If a query profiler is active, each execute() is reported to it
+    along with the number of rows fetched afterwards. With neither the
+    sql log nor the profiler switched on, execute() does no work
+    beyond passing the command on to the cursor.
     """
     def __init__(self, ds, cursor):
         self._ds = ds
         self._cursor = cursor
+        self._query = None
 
     def __getattr__(self, name):
         return getattr(self._cursor, name)
@@ -923,12 +1201,49 @@ class cursor_wrapper:
             command = runner(command)
             params = runner.params
 
+        if params is not None:
+            params = tuple(params)
+            
+        if sqllog:
+            if params is None:
+                print >> sqllog, self._cursor, command
+            else:
+                print >> sqllog, self._cursor, command, " || ", repr(params)
+
+        if profiler is None:
+            self._query = None
+            self._execute(command, params)
+        else:
+            query = profiler.begin(command, params)
+            try:
+                self._execute(command, params)
+            finally:
+                profiler.end(query)
+            self._query = query
+
+    def _execute(self, command, params):
         if params is None:
-            print >> sqllog, self._cursor, command
             self._cursor.execute(command)
         else:
-            print >> sqllog, self._cursor, command, " || ", repr(params)
-            self._cursor.execute(command, tuple(params))
+            self._cursor.execute(command, params)
+
+    def fetchone(self):
+        tpl = self._cursor.fetchone()
+        if self._query is not None and tpl is not None:
+            self._query.fetched(1)
+        return tpl
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        if self._query is not None:
+            self._query.fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        if self._query is not None:
+            self._query.fetched(len(rows))
+        return rows
 
 
 def join_tokens(lst, sep):
@@ -0,0 +1,202 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+
+"""
+Test the async_datasource front end with a SQLite file shared by the
+workers' datasources.
+"""
+
+import os, tempfile, threading, unittest
+from time import sleep
+
+from t4 import sql
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.relationships import one2many
+from t4.orm.exceptions import WrongThread
+
+from t4.orm.datasource import datasource
+from t4.orm.async_datasource import async_datasource, FutureTimeout
+
+
+class item(dbobject):
+    id = common_serial()
+    name = text()
+
+class tag(dbobject):
+    id = common_serial()
+    item_id = integer()
+    name = text()
+
+item.tags = one2many(tag)
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.file = tempfile.mkstemp(".sqlite")
+        os.close(fd)
+        
+        ds = self.connect()
+        ds.execute("CREATE TABLE item (id INTEGER PRIMARY KEY, name TEXT)")
+        for a in range(25):
+            ds.execute("INSERT INTO item (name) VALUES ('%i')" % a)
+        ds.execute("CREATE TABLE tag (id INTEGER PRIMARY KEY, "
+                   "item_id INTEGER, name TEXT)")
+        for a in range(1, 4):
+            ds.execute("INSERT INTO tag (item_id, name) "
+                       "VALUES (%i, 'a'), (%i, 'b')" % ( a, a, ))
+        ds.commit()
+        ds.close()
+        
+        self.ads = async_datasource(self.connect, workers=2, batch_size=10)
+
+    def tearDown(self):
+        self.ads.close()
+        os.unlink(self.file)
+
+    def connect(self):
+        return datasource("adapter=sqlite file=%s" % self.file)
+
+    def count(self):
+        return self.ads.submit(lambda ds: ds.count(item)).result()
+    
+    def test_select(self):
+        cursor = self.ads.select(item, sql.orderby("id")).result()
+        self.assertEqual(map(len, cursor.batches()), [ 10, 10, 5, ])
+        self.assertEqual(self.ads.stats()["pinned"], 0)
+
+        cursor = self.ads.select(item, sql.where("id > 20"),
+                                 batch_size=2).result()
+        self.assertEqual(map(lambda i: i.name, cursor),
+                         [ "20", "21", "22", "23", "24", ])
+        
+        # A cursor holds its worker until it is closed.
+        cursor = self.ads.select(item).result()
+        self.assertEqual(len(cursor.fetch().result()), 10)
+        self.assertEqual(self.ads.stats()["pinned"], 1)
+        cursor.close().result()
+        self.assertEqual(self.ads.stats()["pinned"], 0)
+        self.assertEqual(cursor.fetch().result(), [])
+
+        future = self.ads.select(item, sql.where("nonsense = 1"))
+        self.assertRaises(Exception, future.result)
+        self.assertEqual(self.ads.stats()["failed"], 1)
+        
+    def test_transaction(self):
+        tx = self.ads.transaction()
+        tx.insert(item(name="new"))
+        ds = tx.submit(lambda ds: ds).result()
+        
+        # The other worker serves requests meanwhile.
+        other = self.ads.submit(lambda ds: ds).result()
+        self.assert_(other is not ds)
+        self.assertEqual(self.count(), 25)
+        self.assertEqual(self.ads.stats()["pinned"], 1)
+
+        cursor = tx.select(item, sql.where("name = 'new'")).result()
+        new = list(cursor)[0]
+        new.name = "newer"
+        tx.flush_updates()
+        self.assert_(tx.submit(lambda ds: ds).result() is ds)
+        tx.rollback().result()
+        self.assertEqual(self.ads.stats()["pinned"], 0)
+        self.assertEqual(self.count(), 25)
+
+        tx.insert(item(name="new"))
+        tx.commit().result()
+        self.assertEqual(self.count(), 26)
+
+        self.ads.insert(item(name="auto")).result()
+        self.assertEqual(self.count(), 27)
+
+    def test_relationship(self):
+        # The tags are read after the cursor has freed its worker.
+        cursor = self.ads.select(item, sql.where("id < 5"), sql.orderby("id"),
+                                 prefetch="tags").result()
+        items = list(cursor)
+        self.assertEqual(self.ads.stats()["pinned"], 0)
+        self.assertEqual(map(lambda i: map(lambda t: t.name, i.tags), items),
+                         [ [ "a", "b", ], ] * 3 + [ [], ])
+
+        # Lazy loading on this thread does not touch the worker's
+        # connection.
+        cursor = self.ads.select(item, sql.where("id = 1")).result()
+        first = list(cursor)[0]
+        self.assertRaises(WrongThread, list, first.tags)
+        self.assertRaises(WrongThread, len, first.tags)
+
+        # A transaction's requests may load it on its worker.
+        tx = self.ads.transaction()
+        first = list(tx.select(item, sql.where("id = 1")).result())[0]
+        tags = tx.submit(lambda ds: map(lambda t: t.name,
+                                        first.tags)).result()
+        self.assertEqual(tags, [ "a", "b", ])
+        tx.rollback().result()
+        
+    def test_queue(self):
+        ads = async_datasource(self.connect, workers=1, queue_size=1)
+        event = threading.Event()
+        blocker = ads.submit(lambda ds: event.wait())
+        sleep(0.05)
+        
+        queued = ads.submit(lambda ds: ds.count(item))
+        self.assertRaises(FutureTimeout, queued.result, 0.01)
+        
+        # The queue is full, so submitting waits.
+        def submit():
+            ads.submit(lambda ds: None).result()
+        thread = threading.Thread(target=submit)
+        thread.start()
+        sleep(0.05)
+        
+        stats = ads.stats()
+        self.assertEqual(stats["busy"], 1)
+        self.assertEqual(stats["queued"], 1)
+        self.assertEqual(stats["queue_full_waits"], 1)
+
+        event.set()
+        thread.join()
+        self.assertEqual(queued.result(), 25)
+
+        stats = ads.stats()
+        self.assertEqual(stats["completed"], 3)
+        self.assertEqual(stats["max_queued"], 1)
+        self.assert_(stats["max_wait_time"] >= 0.05)
+        self.assert_(stats["wait_time"] >= stats["max_wait_time"])
+
+        done = []
+        queued.add_done_callback(done.append)
+        self.assertEqual(done, [ queued, ])
+        
+        ads.close()
+        self.assertRaises(Exception, ads.submit, lambda ds: None)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+
+"""
+Test flush_updates(batch=True) with the SQLite adapter, with literals
+in the SQL and as parameters.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.debug import sqllog
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+
+from t4.orm.datasource import datasource
+
+
+class person(dbobject):
+    id = common_serial()
+    name = text()
+    height = integer()
+
+class membership(dbobject):
+    __primary_key__ = ( "club", "member", )
+    club = text()
+    member = text()
+    role = text()
+    
+
+class test(unittest.TestCase):
+
+    connection_string = "adapter=sqlite"
+    
+    def setUp(self):
+        self.ds = datasource(self.connection_string)
+
+        self.ds.execute("""CREATE TABLE person (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              height INTEGER
+                           )""")
+        self.ds.execute("""CREATE TABLE membership (
+                              club TEXT,
+                              member TEXT,
+                              role TEXT
+                           )""")
+        for a in range(1, 6):
+            self.ds.execute("INSERT INTO person (name, height) "
+                            "VALUES ('Person %i', %i)" % ( a, 170 + a, ))
+        self.ds.execute("INSERT INTO membership VALUES "
+                        "('chess', 'Kai', 'member'), "
+                        "('chess', 'Ute', 'member'), "
+                        "('golf', 'Kai', 'member')")
+        self.ds.commit()
+        
+        self.people = list(self.ds.select(person, sql.orderby("id")))
+        
+        sqllog.buffer_size = 100
+        sqllog.reset()
+
+    def tearDown(self):
+        sqllog.buffer_size = 0
+        sqllog.reset()
+
+    def updates(self):
+        return len(filter(lambda q: q.startswith("UPDATE"), sqllog.queries))
+
+    def rows(self, query="SELECT name, height FROM person ORDER BY id"):
+        return map(tuple, self.ds.execute(query).fetchall())
+    
+    def test_values(self):
+        names = [ None, "O'Neil", "Two ''quotes''", "Ut\xc3\xa9", "Five", ]
+        for p, name in zip(self.people, names):
+            p.name = name
+            p.height = 180
+        self.ds.flush_updates(batch=True)
+
+        self.assertEqual(self.updates(), 1)
+        self.assertEqual(self.rows(),
+                         zip(names, [ 180, ] * 5))
+
+    def test_expressions(self):
+        # Literals and expressions for the same column are mixed in
+        # one CASE.
+        self.people[0].height = 200
+        for p in self.people[1:]:
+            p.height = sql.expression("height + 1")
+        self.ds.flush_updates(batch=True)
+
+        self.assertEqual(self.updates(), 1)
+        self.assertEqual(map(lambda r: r[1], self.rows()),
+                         [ 200, 173, 174, 175, 176, ])
+
+        # The expressions' values have been selected after the UPDATE.
+        self.assertEqual(map(lambda p: p.height, self.people),
+                         [ 200, 173, 174, 175, 176, ])
+
+    def test_chunks(self):
+        self.ds.update_batch_size = 2
+        for p in self.people:
+            p.height = p.height * 2
+        self.ds.flush_updates(batch=True)
+        
+        self.assertEqual(self.updates(), 3)
+        self.assertEqual(map(lambda r: r[1], self.rows()),
+                         [ 342, 344, 346, 348, 350, ])
+
+    def test_groups(self):
+        # A dbobj with a different set of changed columns is updated
+        # on its own.
+        for p in self.people[:3]:
+            p.height = 190
+        self.people[3].name = "Four"
+        self.ds.flush_updates(batch=True)
+
+        self.assertEqual(self.updates(), 2)
+        self.assertEqual(self.rows()[:4],
+                         [ ( "Person 1", 190, ), ( "Person 2", 190, ),
+                           ( "Person 3", 190, ), ( "Four", 174, ), ])
+        
+    def test_multiple_column_key(self):
+        for m in self.ds.select(membership):
+            if m.member == "Kai":
+                m.role = m.club + " captain"
+        self.ds.flush_updates(batch=True)
+
+        self.assertEqual(self.updates(), 1)
+        self.assertEqual(self.rows("SELECT club, member, role "
+                                   "FROM membership ORDER BY club, member"),
+                         [ ( "chess", "Kai", "chess captain", ),
+                           ( "chess", "Ute", "member", ),
+                           ( "golf", "Kai", "golf captain", ), ])
+        
+class parameterized_test(test):
+    connection_string = "adapter=sqlite parameterized=1"
+    
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+
+"""
+Run the benchmark workloads at a small scale and test the comparison
+of reports.
+"""
+
+import unittest
+
+from t4.orm.benchmark import measure, run, compare
+from t4.orm.benchmark.workloads import workloads, by_name
+
+
+class test(unittest.TestCase):
+
+    def queries(self, report):
+        ret = {}
+        for result in report["results"]:
+            ret[result["workload"]] = result["queries"]
+        return ret
+    
+    def test_workloads(self):
+        report = run(workloads, scale=0.001, fork=False)
+        self.assertEqual(len(report["results"]),
+                         sum(map(lambda w: len(w.sizes), workloads)))
+        for result in report["results"]:
+            self.assertEqual(result["ops"], result["size"])
+            self.assert_(result["ops_per_sec"] > 0)
+
+        queries = self.queries(report)
+        self.assertEqual(queries["materializer"], 0)
+        self.assertEqual(queries["select"], 1)
+        self.assertEqual(queries["n_plus_one"], 2)
+        self.assertEqual(queries["prefetch"], 2)
+        self.assertEqual(queries["delayed"], 11)
+        self.assertEqual(queries["undefer"], 2)
+        self.assertEqual(queries["update"], 10)
+        self.assertEqual(queries["batch_update"], 1)
+
+    def test_fork(self):
+        n_plus_one, = by_name([ "n_plus_one", ])
+        result = measure(n_plus_one, 10)
+        self.assertEqual(result["workload"], "n_plus_one")
+        self.assertEqual(result["queries"], 11)
+        self.assert_(result["peak_memory_kb"] >= 0)
+        self.assertRaises(ValueError, by_name, [ "nonsense", ])
+
+    def test_compare(self):
+        baseline = { "results": [
+            { "workload": "a", "size": 10, "ops_per_sec": 1000.0,
+              "queries": 5, "peak_memory_kb": 10000, },
+            { "workload": "b", "size": 10, "ops_per_sec": 1000.0,
+              "queries": 5, "peak_memory_kb": 10000, }, ] }
+        report = { "results": [
+            { "workload": "a", "size": 10, "ops_per_sec": 850.0,
+              "queries": 5, "peak_memory_kb": 11500, },
+            { "workload": "b", "size": 10, "ops_per_sec": 700.0,
+              "queries": 6, "peak_memory_kb": 14000, },
+            { "workload": "c", "size": 10, "ops_per_sec": 1.0,
+              "queries": 100, "peak_memory_kb": 100000, }, ] }
+
+        self.assertEqual(compare(baseline, report), [
+            "b (10): 700 ops/sec, baseline 1000",
+            "b (10): 6 queries, baseline 5",
+            "b (10): 14000 kB peak memory, baseline 10000 kB", ])
+        self.assertEqual(len(compare(baseline, report, tolerance=0.1)), 5)
+        self.assertEqual(compare(baseline, baseline), [])
+        
+if __name__ == '__main__':
+    unittest.main()
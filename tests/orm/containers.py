@@ -0,0 +1,204 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test the sqltuple and sqldict containers with the SQLite adapter.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.debug import sqllog
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.containers import sqltuple, sqldict
+from t4.orm.exceptions import ObjectMustBeInserted
+
+from t4.orm.datasource import datasource
+
+
+class person(dbobject):
+    id = common_serial()
+    name = text()
+    tags = sqltuple("tag", text(column="name"), sql.orderby("name"),
+                    child_key="person_id")
+    settings = sqldict("setting", text(column="key"), text(column="value"),
+                       child_key="person_id")
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE person (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE tag (
+                              person_id INTEGER,
+                              name TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE setting (
+                              person_id INTEGER,
+                              key TEXT,
+                              value TEXT
+                           )""")
+        for name in ( "Diedrich", "Heike", "Jason", ):
+            self.ds.insert(person(name=name))
+            
+        self.ds.execute("INSERT INTO tag VALUES (1, 'a'), (1, 'b'), (1, 'b'), "
+                        "(1, 'c'), (2, 'x')")
+        self.ds.execute("INSERT INTO setting VALUES (1, 'lang', 'de'), "
+                        "(1, 'tz', 'CET'), (2, 'lang', 'en')")
+        self.ds.commit()
+        
+        sqllog.buffer_size = 100
+        sqllog.reset()
+
+    def tearDown(self):
+        sqllog.buffer_size = 0
+        sqllog.reset()
+
+    def statements(self, kind):
+        return filter(lambda q: q.startswith(kind), sqllog.queries)
+
+    def rows(self, relation, person_id):
+        return self.ds.execute(
+            "SELECT * FROM %s WHERE person_id = %i ORDER BY 2" % (
+                relation, person_id, )).fetchall()
+    
+    def test_sqltuple_diff(self):
+        me = self.ds.select_by_primary_key(person, 1)
+        me.tags = ( "b", "c", "d", "e", "d", )
+        self.assertEqual(me.tags, ( "b", "c", "d", "e", "d", ))
+        
+        # Nothing is written before the flush.
+        self.assertEqual(len(self.rows("tag", 1)), 4)
+        sqllog.reset()
+        self.ds.flush_updates()
+
+        # One DELETE for a and b, one INSERT for b, d, d and e.
+        self.assertEqual(len(self.statements("DELETE")), 1)
+        self.assertEqual(len(self.statements("INSERT")), 1)
+        self.assertEqual(map(lambda row: row[1], self.rows("tag", 1)),
+                         [ "b", "c", "d", "d", "e", ])
+        self.assertEqual(self.rows("tag", 2), [ ( 2, "x", ), ])
+
+        me.tags += ( "f", )
+        sqllog.reset()
+        self.ds.commit()
+        self.assertEqual(len(self.statements("DELETE")), 0)
+        self.assertEqual(len(self.statements("INSERT")), 1)
+
+    def test_sqldict_diff(self):
+        me = self.ds.select_by_primary_key(person, 1)
+        me.settings["lang"] = "fr"
+        me.settings["theme"] = "dark"
+        me.settings["tz"] = "UTC"
+        me.settings.update(editor="vi")
+        del me.settings["theme"]
+        
+        self.assertEqual(me.settings, { "lang": "fr", "tz": "UTC",
+                                        "editor": "vi", })
+        sqllog.reset()
+        self.ds.flush_updates()
+
+        self.assertEqual(len(self.statements("DELETE")), 0)
+        self.assertEqual(len(self.statements("INSERT")), 1)
+        self.assertEqual(len(self.statements("UPDATE")), 1)
+        self.assertEqual(self.rows("setting", 1),
+                         [ ( 1, "editor", "vi", ),
+                           ( 1, "lang", "fr", ),
+                           ( 1, "tz", "UTC", ), ])
+
+        me.settings = { "lang": "de", }
+        self.ds.flush_updates()
+        self.assertEqual(self.rows("setting", 1), [ ( 1, "lang", "de", ), ])
+        self.assertEqual(self.rows("setting", 2), [ ( 2, "lang", "en", ), ])
+
+    def test_sqldict_methods(self):
+        me = self.ds.select_by_primary_key(person, 1)
+        self.assertEqual(me.settings.pop("tz"), "CET")
+        self.assertEqual(me.settings.pop("tz", None), None)
+        self.assertEqual(me.settings.setdefault("lang", "fr"), "de")
+        self.assertEqual(me.settings.setdefault("theme", "dark"), "dark")
+        self.ds.flush_updates()
+        self.assertEqual(self.rows("setting", 1),
+                         [ ( 1, "lang", "de", ), ( 1, "theme", "dark", ), ])
+
+        you = self.ds.select_by_primary_key(person, 2)
+        self.assertEqual(you.settings.popitem(), ( "lang", "en", ))
+        self.ds.flush_updates()
+        self.assertEqual(self.rows("setting", 2), [])
+
+        me.settings.clear()
+        self.ds.commit()
+        self.assertEqual(self.rows("setting", 1), [])
+        
+    def test_prefetch(self):
+        people = list(self.ds.select(person, sql.orderby("id"),
+                                     prefetch=( "tags", "settings", )))
+        sqllog.reset()
+
+        self.assertEqual(map(lambda p: p.tags, people),
+                         [ ( "a", "b", "b", "c", ), ( "x", ), (), ])
+        self.assertEqual(map(lambda p: p.settings, people),
+                         [ { "lang": "de", "tz": "CET", },
+                           { "lang": "en", }, {}, ])
+        self.assertEqual(self.statements("SELECT"), [])
+
+        people[2].settings["lang"] = "it"
+        self.ds.flush_updates()
+        self.assertEqual(self.rows("setting", 3), [ ( 3, "lang", "it", ), ])
+
+    def test_rollback(self):
+        me = self.ds.select_by_primary_key(person, 1)
+        me.tags = ( "q", )
+        me.settings["lang"] = "fr"
+        self.ds.rollback()
+
+        # The discarded changes are not written by the next commit.
+        you = self.ds.select_by_primary_key(person, 2)
+        you.name = "Someone"
+        self.ds.commit()
+        self.assertEqual(map(lambda row: row[1], self.rows("tag", 1)),
+                         [ "a", "b", "b", "c", ])
+        self.assertEqual(self.rows("setting", 1),
+                         [ ( 1, "lang", "de", ), ( 1, "tz", "CET", ), ])
+
+        # The dbobj's containers are loaded from the database again.
+        self.assertEqual(me.tags, ( "a", "b", "b", "c", ))
+        self.assertEqual(me.settings, { "lang": "de", "tz": "CET", })
+        
+    def test_unstored(self):
+        me = person(name="Nobody")
+        self.assertRaises(ObjectMustBeInserted, setattr, me, "tags", ( "a", ))
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test counting with the SQLite adapter: Counts remembered by results,
+totals selected along with a page of rows and the fallback of
+approximate counts to exact ones.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.debug import sqllog
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.relationships import one2many
+
+from t4.orm.datasource import datasource
+
+
+class country(dbobject):
+    id = common_serial()
+    name = text()
+
+class city(dbobject):
+    id = common_serial()
+    name = text()
+    country_id = integer()
+
+country.cities = one2many(city)
+    
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE country (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE city (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              country_id INTEGER
+                           )""")
+        self.ds.execute("INSERT INTO country (name) VALUES ('Germany')")
+        for a in range(25):
+            self.ds.execute("INSERT INTO city (name, country_id) "
+                            "VALUES ('city%i', 1)" % a)
+        self.ds.commit()
+        
+        sqllog.buffer_size = 100
+        sqllog.reset()
+
+    def tearDown(self):
+        sqllog.buffer_size = 0
+        sqllog.reset()
+
+    def selects(self):
+        return len(filter(lambda q: q.startswith("SELECT"), sqllog.queries))
+
+    def test_memoized(self):
+        result = self.ds.select(city, sql.where("id > 5"))
+        self.assertEqual(result.count(), 20)
+        self.assertEqual(result.count(), 20)
+        self.assertEqual(self.selects(), 2)
+
+    def test_with_total(self):
+        result = self.ds.select(city, sql.where("id > 5"), sql.orderby("id"),
+                                sql.limit(10), sql.offset(5),
+                                with_total=True)
+        # The total is known before the rows are retrieved...
+        self.assertEqual(result.count(), 20)
+        self.assertEqual(map(lambda c: c.id, result), range(11, 21))
+        self.assertEqual(result.count(), 20)
+        self.assertEqual(self.selects(), 1)
+
+        # ...and after.
+        result = self.ds.select(city, sql.limit(3), with_total=True)
+        self.assertEqual(len(list(result)), 3)
+        self.assertEqual(result.count(), 25)
+        self.assertEqual(self.selects(), 2)
+
+        # An empty page needs a COUNT query.
+        result = self.ds.select(city, sql.offset(30), sql.limit(3),
+                                with_total=True)
+        self.assertEqual(result.count(), 25)
+        self.assertEqual(self.selects(), 4)
+
+    def test_2many_len(self):
+        germany = self.ds.select_by_primary_key(country, 1)
+        self.assertEqual(len(germany.cities), 25)
+        self.assertEqual(len(germany.cities), 25)
+        self.assertEqual(self.selects(), 2)
+
+        # The count is kept by the dbobj, not by the result object.
+        cities = germany.cities
+        cities.append(city(name="Bremen"))
+        self.assertEqual(len(germany.cities), 26)
+        self.assertEqual(cities.len(sql.where("id > 20")), 6)
+
+    def test_2many_len_writes(self):
+        germany = self.ds.select_by_primary_key(country, 1)
+        self.assertEqual(len(germany.cities), 25)
+
+        # Writing the child relation makes len() count again.
+        self.ds.insert(city(name="Bremen", country_id=1))
+        self.assertEqual(len(germany.cities), 26)
+        self.ds.delete_by_primary_key(city, 1)
+        self.assertEqual(len(germany.cities), 25)
+
+        hamburg = self.ds.select_by_primary_key(city, 2)
+        hamburg.country_id = 2
+        self.ds.flush_updates()
+        self.assertEqual(len(germany.cities), 24)
+
+        # Other relations don't.
+        sqllog.reset()
+        self.ds.insert(country(name="France"))
+        self.assertEqual(len(germany.cities), 24)
+        self.assertEqual(self.selects(), 1) # the insert's
+        
+    def test_2many_len_rollback(self):
+        germany = self.ds.select_by_primary_key(country, 1)
+        self.ds.execute("DELETE FROM city WHERE id > 20")
+        self.assertEqual(len(germany.cities), 20)
+        self.ds.rollback()
+        self.assertEqual(len(germany.cities), 25)
+        
+    def test_approximate(self):
+        # SQLite provides no estimates, the counts are exact.
+        self.assertEqual(self.ds.count(city, approximate=True), 25)
+        self.assertEqual(self.ds.select(city).count(approximate=True), 25)
+        germany = self.ds.select_by_primary_key(country, 1)
+        self.assertEqual(germany.cities.len(approximate=True), 25)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+
+"""
+Test the datasource's identity map with the SQLite adapter.
+"""
+
+import gc, unittest
+
+from t4 import sql
+from t4.debug import sqllog
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.relationships import *
+
+from t4.orm.datasource import datasource
+
+
+class author(dbobject):
+    id = common_serial()
+    name = text()
+
+class book(dbobject):
+    id = common_serial()
+    title = text()
+    author_id = integer()
+
+book.author = many2one(author)
+    
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE author (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE book (
+                              id INTEGER PRIMARY KEY,
+                              title TEXT,
+                              author_id INTEGER
+                           )""")
+        self.ds.execute("INSERT INTO author (name) VALUES ('Kafka'), "
+                        "('Mann'), ('Fontane')")
+        self.ds.execute("INSERT INTO book (title, author_id) VALUES "
+                        "('Der Process', 1), ('Buddenbrooks', 2)")
+        self.ds.commit()
+        
+        self.ds.enable_identity_map()
+        
+        sqllog.buffer_size = 100
+        sqllog.reset()
+
+    def tearDown(self):
+        sqllog.buffer_size = 0
+        sqllog.reset()
+
+    def selects(self):
+        return len(filter(lambda q: q.startswith("SELECT"), sqllog.queries))
+
+    def test_lookup(self):
+        kafka = self.ds.select_by_primary_key(author, 1)
+        self.assert_(self.ds.select_by_primary_key(author, 1) is kafka)
+        self.assertEqual(self.selects(), 1)
+
+        # Results yield the known dbobj, as do many2one relationships
+        # without a query.
+        authors = list(self.ds.select(author, sql.orderby("id")))
+        self.assert_(authors[0] is kafka)
+        self.failIf(authors[1] is kafka)
+        
+        process = self.ds.select_by_primary_key(book, 1)
+        sqllog.reset()
+        self.assert_(process.author is kafka)
+        self.assertEqual(self.selects(), 0)
+
+        # So does select_for_update().
+        self.assert_(self.ds.select_for_update(author, 1) is kafka)
+        self.failIf(self.ds.select_for_update(author, 4) is kafka)
+        
+    def test_insert(self):
+        new = author(name="Brecht")
+        self.ds.insert(new)
+        many = [ author(name="Hesse"), author(name="Musil"), ]
+        self.ds.insert_many(many)
+
+        sqllog.reset()
+        self.assert_(self.ds.select_by_primary_key(author, new.id) is new)
+        self.assert_(self.ds.select_by_primary_key(author,
+                                                   many[1].id) is many[1])
+        self.assertEqual(self.selects(), 0)
+        
+    def test_delete(self):
+        kafka = self.ds.select_by_primary_key(author, 1)
+        mann = self.ds.select_by_primary_key(author, 2)
+        fontane = self.ds.select_by_primary_key(author, 3)
+
+        self.ds.delete_by_primary_key(author, 1)
+        self.assertEqual(self.ds.select_by_primary_key(author, 1), None)
+        self.assert_(self.ds.select_by_primary_key(author, 2) is mann)
+
+        # delete() forgets all of the dbclass' dbobjs.
+        self.ds.delete(author, sql.where("id = 3"))
+        self.assertEqual(self.ds.select_by_primary_key(author, 3), None)
+        other = self.ds.select_by_primary_key(author, 2)
+        self.failIf(other is mann)
+        self.assertEqual(other.name, "Mann")
+
+    def test_rollback(self):
+        kafka = self.ds.select_by_primary_key(author, 1)
+        kafka.name = "Franz Kafka"
+        self.ds.rollback()
+
+        other = self.ds.select_by_primary_key(author, 1)
+        self.failIf(other is kafka)
+        self.assertEqual(other.name, "Kafka")
+
+    def test_weak_references(self):
+        kafka = self.ds.select_by_primary_key(author, 1)
+        self.assertEqual(len(self.ds._identity_map), 1)
+        del kafka
+        gc.collect()
+        self.assertEqual(len(self.ds._identity_map), 0)
+
+    def test_disabled(self):
+        self.ds.enable_identity_map(False)
+        a = self.ds.select_by_primary_key(author, 1)
+        b = self.ds.select_by_primary_key(author, 1)
+        self.failIf(a is b)
+        self.assertEqual(self.selects(), 2)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -256,7 +256,7 @@ class dotted_quad(Long):
     def __set_from_result__(self, ds, dbobj, value):
         # We know that value is of integer or long type, no need to test
         # it.
-        setattr(dbobj, self.data_attribute_name(), value)
+        self.store_value(dbobj, value)
     
     def __get__(self, dbobj, owner=None):
         i = Long.__get__(self, dbobj, owner)
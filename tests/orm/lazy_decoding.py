@@ -0,0 +1,157 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test the lazy decoding of serialized datatypes and the csv and
+dict_to_object wrappers with the SQLite adapter.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.datatypes import _encoded
+
+from t4.orm.datasource import datasource
+
+
+class report(dbobject):
+    id = common_serial()
+    data = pickle(pickle_protocol=0)
+    options = python_literal()
+    tags = csv(Unicode())
+    info = dict_to_object(python_literal())
+
+class report_summary(dbobject):
+    __relation__ = "report"
+    
+    id = common_serial()
+    data = delayed(pickle(pickle_protocol=0), group="payload")
+    options = delayed(python_literal(), group="payload")
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE report (
+                              id INTEGER PRIMARY KEY,
+                              data TEXT,
+                              options TEXT,
+                              tags TEXT,
+                              info TEXT
+                           )""")
+        self.ds.insert(report(data={ "rows": [ 1, 2, 3, ], },
+                              options=( "a", 1, ),
+                              tags=( u"x", u"y", ),
+                              info={ "author": "Diedrich", }))
+        self.ds.commit()
+
+        self.decoded = []
+        for property in ( report.data, report.options, ):
+            property.decode = self.counting(property, property.decode)
+
+    def tearDown(self):
+        for property in ( report.data, report.options, ):
+            del property.decode
+        
+    def counting(self, property, decode):
+        def counting_decode(raw):
+            self.decoded.append(property.attribute_name)
+            return decode(raw)
+        return counting_decode
+
+    def slot(self, dbobj, name):
+        return dbobj.__values__[report.__dbproperty__(name).slot]
+
+    def test_lazy(self):
+        r = self.ds.select_by_primary_key(report, 1)
+        self.assertEqual(self.decoded, [])
+        self.assertEqual(self.slot(r, "data").__class__, _encoded)
+
+        self.assertEqual(r.data, { "rows": [ 1, 2, 3, ], })
+        self.failUnless(r.data is r.data)
+        self.assertEqual(r.options, ( "a", 1, ))
+        self.assertEqual(self.decoded, [ "data", "options", ])
+
+    def test_sql_literal(self):
+        r = self.ds.select_by_primary_key(report, 1)
+        raw = self.slot(r, "data").raw
+        
+        report.data.encode = None # must not be called
+        try:
+            r.data
+            literal = report.data.sql_literal(r)
+        finally:
+            del report.data.encode
+            
+        self.assertEqual(literal._content, str(raw))
+
+        r.data = { "rows": [], }
+        r.options = None
+        self.ds.commit()
+        
+        r = self.ds.select_by_primary_key(report, 1)
+        self.assertEqual(r.data, { "rows": [], })
+        self.assertEqual(r.options, None)
+
+    def test_unchanged(self):
+        r = self.ds.select_by_primary_key(report, 1)
+        r.data = { "rows": [ 1, 2, 3, ], }
+        r.options = ( "a", 1, )
+        self.assertEqual(r.__changed_columns__(), [])
+        self.assertEqual(self.slot(r, "data").__class__, _encoded)
+
+        r.options = ( "b", )
+        self.assertEqual(map(lambda (column, properties): str(column),
+                             r.__changed_columns__()), [ "options", ])
+        
+    def test_wrappers(self):
+        r = self.ds.select_by_primary_key(report, 1)
+        self.assertEqual(r.tags, ( u"x", u"y", ))
+        self.failUnless(r.tags is r.tags)
+        self.assertEqual(r.info.author, "Diedrich")
+        self.failUnless(r.info is r.info)
+
+        r.tags = ( u"z", )
+        self.assertEqual(r.tags, ( u"z", ))
+        r.info = { "author": "Heike", }
+        self.assertEqual(r.info.author, "Heike")
+
+    def test_delayed(self):
+        r = self.ds.select_by_primary_key(report_summary, 1)
+        self.assertEqual(r.data, { "rows": [ 1, 2, 3, ], })
+        # options has been loaded along with data but stays encoded.
+        slot = report_summary.options.slot
+        self.assertEqual(r.__dict__[" delayed"][slot].__class__, _encoded)
+        self.assertEqual(r.options, ( "a", 1, ))
+        
+if __name__ == '__main__':
+    unittest.main()
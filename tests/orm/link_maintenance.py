@@ -0,0 +1,167 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test the set based link maintenance of the many2many relationship with
+the SQLite adapter.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.debug import sqllog
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.relationships import many2many
+
+from t4.orm.datasource import datasource
+
+
+class user(dbobject):
+    id = common_serial()
+    login = text()
+
+class permission(dbobject):
+    id = common_serial()
+    name = text()
+
+user.permissions = many2many(permission, "user_to_permission")
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE user (
+                              id INTEGER PRIMARY KEY,
+                              login TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE permission (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE user_to_permission (
+                              user_id INTEGER,
+                              permission_id INTEGER,
+                              PRIMARY KEY (user_id, permission_id)
+                           )""")
+        
+        for login in ( "diedrich", "heike", ):
+            self.ds.insert(user(login=login))
+        for a in range(10):
+            self.ds.insert(permission(name="p%i" % a))
+        self.ds.execute("INSERT INTO user_to_permission VALUES "
+                        "(1, 1), (1, 2), (1, 3), (2, 1)")
+        self.ds.commit()
+
+        self.me = self.ds.select_by_primary_key(user, 1)
+        self.permissions = list(self.ds.select(permission,
+                                               sql.orderby("id")))
+        
+        sqllog.buffer_size = 100
+        sqllog.reset()
+
+    def tearDown(self):
+        sqllog.buffer_size = 0
+        sqllog.reset()
+
+    def statements(self, kind):
+        return filter(lambda q: q.startswith(kind), sqllog.queries)
+
+    def links(self, user_id):
+        return map(lambda row: row[0], self.ds.execute(
+            "SELECT permission_id FROM user_to_permission "
+            "WHERE user_id = %i ORDER BY 1" % user_id).fetchall())
+
+    def test_append_many(self):
+        # 2 and 3 are linked already, 5 is given twice.
+        self.me.permissions.append_many(self.permissions[1:6] + \
+                                            [ self.permissions[4], ])
+
+        self.assertEqual(len(self.statements("INSERT")), 1)
+        self.assertEqual(self.links(1), [ 1, 2, 3, 4, 5, 6, ])
+        self.assertEqual(self.links(2), [ 1, ])
+
+        self.me.permissions.append(self.permissions[9])
+        self.assertEqual(self.links(1), [ 1, 2, 3, 4, 5, 6, 10, ])
+
+    def test_append_unstored(self):
+        fresh = [ permission(name="new1"), permission(name="new2"), ]
+        self.me.permissions.append_many(fresh)
+        self.assertEqual(map(lambda p: p.__is_stored__(), fresh),
+                         [ True, True, ])
+        self.assertEqual(self.links(1), [ 1, 2, 3, 11, 12, ])
+        
+    def test_unlink_many(self):
+        self.me.permissions.unlink_many(self.permissions[:2])
+        self.assertEqual(len(self.statements("DELETE")), 1)
+        self.assertEqual(self.links(1), [ 3, ])
+        self.assertEqual(self.links(2), [ 1, ])
+
+        self.me.permissions.unlink(self.permissions[2])
+        self.assertEqual(self.links(1), [])
+
+    def test_replace(self):
+        self.me.permissions.replace(self.permissions[2:5])
+        self.assertEqual(len(self.statements("DELETE")), 1)
+        self.assertEqual(len(self.statements("INSERT")), 1)
+        self.assertEqual(self.links(1), [ 3, 4, 5, ])
+        self.assertEqual(self.links(2), [ 1, ])
+
+        sqllog.reset()
+        self.me.permissions = self.permissions[2:5]
+        self.assertEqual(len(self.statements("DELETE")), 0)
+        self.assertEqual(len(self.statements("INSERT")), 0)
+        
+        self.me.permissions = []
+        self.assertEqual(self.links(1), [])
+
+    def test_chunks(self):
+        self.ds.insert_chunk_size = 2
+        self.ds.prefetch_chunk_size = 2
+
+        self.me.permissions.replace(self.permissions[3:8])
+        self.assertEqual(len(self.statements("INSERT")), 3)
+        self.assertEqual(self.links(1), [ 4, 5, 6, 7, 8, ])
+
+        sqllog.reset()
+        self.me.permissions.unlink_many(self.permissions)
+        self.assertEqual(len(self.statements("DELETE")), 5)
+        self.assertEqual(self.links(1), [])
+        
+    def test_all(self):
+        result, active_keys = self.me.permissions.all()
+        self.assertEqual(active_keys, set([ ( 1, ), ( 2, ), ( 3, ), ]))
+        linked = filter(lambda p: p.__primary_key__.values() in active_keys,
+                        result)
+        self.assertEqual(map(lambda p: p.name, linked),
+                         [ "p0", "p1", "p2", ])
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8; mode: python; ispell-local-dictionary: "english" -*-
+
+##  This file is part of the t4 Python module collection.
+##
+##  Copyright 2002-2011 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+"""
+Measure how many rows per second are turned into dbobjects, once
+through dbobject.__from_result__() with a dict per row (the way
+result.next() used to work) and once through the dbclass'
+materializer. The rows are made up in memory, so no database is
+needed and only the cost of materialization is measured.
+
+The functions are shared with the materializer and dict_per_row
+workloads of t4.orm.benchmark, which run the full benchmark suite.
+
+Usage: materializer_benchmark.py [rows]
+"""
+
+import sys, time
+
+from t4.orm.benchmark.workloads import fake_datasource, rows, \
+     dict_per_row, materializer
+
+def measure(function, ds, data):
+    start = time.time()
+    function(ds, data)
+    return len(data) / (time.time() - start)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = 100000
+
+    ds = fake_datasource()
+    data = rows(count)
+
+    before = measure(dict_per_row, ds, data)
+    after = measure(materializer, ds, data)
+
+    print "%i rows" % count
+    print "dict per row:  %10.0f rows/sec" % before
+    print "materializer:  %10.0f rows/sec" % after
+    print "speedup:       %10.1fx" % ( after / before, )
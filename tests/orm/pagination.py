@@ -0,0 +1,130 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test keyset pagination with the SQLite adapter.
+"""
+
+import unittest
+from datetime import date as py_date
+
+from t4 import sql
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.relationships import *
+from t4.orm.pagination import encode_token, decode_token
+
+from t4.orm.datasource import datasource
+
+
+class country(dbobject):
+    id = common_serial()
+    name = text()
+
+class city(dbobject):
+    id = common_serial()
+    name = text()
+    country_id = integer()
+    founded = date()
+
+country.cities = one2many(city)
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE country (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE city (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              country_id INTEGER,
+                              founded DATE
+                           )""")
+
+        self.germany = country(name="Germany")
+        self.ds.insert(self.germany)
+        
+        # Several cities share a name, so the primary key decides
+        # their order.
+        names = [ "Berlin", "Bonn", "Bonn", "Essen", "Hamm", "Hamm",
+                  "Hamm", "Köln", "Mainz", "Ulm", ]
+        self.ds.insert_many([ city(name=name, country_id=self.germany.id,
+                                   founded=py_date(1901 + a, 1, 1))
+                              for a, name in enumerate(names) ])
+        self.ds.insert(city(name="Wien", country_id=self.germany.id + 1,
+                            founded=py_date(1900, 1, 1)))
+
+    def tearDown(self):
+        self.ds.close()
+
+    def pages(self, paginate, **kw):
+        ret = []
+        token = None
+        while True:
+            page = paginate(after=token, **kw)
+            ret.append(map(lambda c: c.id, page))
+            token = page.token
+            if token is None:
+                return ret
+
+    def test_order_by_name(self):
+        pages = self.pages(lambda **kw: self.ds.paginate(city, **kw),
+                           order_by="name", page_size=3)
+        self.assertEqual(pages, [ [ 1, 2, 3, ], [ 4, 5, 6, ],
+                                  [ 7, 8, 9, ], [ 10, 11, ], ])
+
+        pages = self.pages(lambda **kw: self.ds.paginate(city, **kw),
+                           order_by="name", page_size=4, desc=True)
+        self.assertEqual(pages, [ [ 11, 10, 9, 8, ], [ 7, 6, 5, 4, ],
+                                  [ 3, 2, 1, ], ])
+
+    def test_where(self):
+        pages = self.pages(lambda **kw: self.ds.paginate(
+                city, sql.where("name <> 'Hamm'"), **kw),
+                           order_by=( "founded", ), page_size=5)
+        self.assertEqual(pages, [ [ 11, 1, 2, 3, 4, ], [ 8, 9, 10, ], ])
+
+    def test_one2many(self):
+        pages = self.pages(self.germany.cities.paginate,
+                           order_by="name", page_size=4)
+        self.assertEqual(pages, [ [ 1, 2, 3, 4, ], [ 5, 6, 7, 8, ],
+                                  [ 9, 10, ], ])
+
+    def test_token(self):
+        values = ( "Köln", u"K\xf6ln", 23, py_date(2011, 3, 1), None, )
+        self.assertEqual(decode_token(encode_token(values)), values)
+        self.assertRaises(ValueError, decode_token, "garbage")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test the datasource pool with SQLite datasources.
+"""
+
+import os, tempfile, threading, time, unittest
+
+from t4.orm.datasource import datasource
+from t4.orm.pool import pool, PoolTimeout
+
+
+def borrow_in_thread(pool, count):
+    """
+    Borrow COUNT datasources from POOL in as many threads, because a
+    thread that borrows twice gets the same datasource.
+    """
+    ret = []
+    def borrow():
+        ret.append(pool.borrow())
+
+    for a in range(count):
+        thread = threading.Thread(target=borrow)
+        thread.start()
+        thread.join()
+        
+    return ret
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.file = tempfile.mkstemp(".sqlite")
+        os.close(fd)
+        
+        self.pool = datasource("adapter=sqlite file=%s pool=1,3 "
+                               "pool_timeout=0.2" % self.file)
+
+    def tearDown(self):
+        self.pool.close()
+        os.unlink(self.file)
+
+    def test_checkout(self):
+        with self.pool.checkout() as ds:
+            ds.execute("CREATE TABLE t ( i INTEGER )")
+            ds.execute("INSERT INTO t VALUES (1)")
+            ds.commit()
+            
+            # Nested checkouts in the same thread yield the same datasource.
+            with self.pool.checkout() as again:
+                self.assert_(again is ds)
+
+        with self.pool.checkout() as other:
+            # The datasource this thread used before is preferred.
+            self.assert_(other is ds)
+            self.assertEqual(other.query_one("SELECT i FROM t")[0], 1)
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["busy"], 0)
+
+    def test_ds(self):
+        # The interface of the pgsql adapter's former pool.
+        with self.pool.ds() as ds:
+            self.assertEqual(self.pool.stats()["busy"], 1)
+            ds.execute("CREATE TABLE t ( i INTEGER )")
+        self.assertEqual(self.pool.stats()["busy"], 0)
+
+        ds = self.pool.ds()
+        ds.execute("INSERT INTO t VALUES (1)")
+        self.assertEqual(ds.query_one("SELECT i FROM t")[0], 1)
+        self.assertEqual(self.pool.stats()["busy"], 1)
+        self.pool.giveback(ds.ds)
+        
+    def test_timeout(self):
+        borrowed = borrow_in_thread(self.pool, 3)
+        self.assertRaises(PoolTimeout, self.pool.borrow)
+
+        def giveback():
+            time.sleep(0.05)
+            self.pool.giveback(borrowed[0])
+
+        # Another thread returns a datasource while we wait.
+        thread = threading.Thread(target=giveback)
+        thread.start()
+        ds = self.pool.borrow(timeout=5.0)
+        thread.join()
+        self.assert_(ds is borrowed[0])
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["waits"], 2)
+        self.assertEqual(stats["timeouts"], 1)
+
+    def test_validation(self):
+        with self.pool.checkout() as ds:
+            pass
+        
+        # A closed connection fails ping() and is replaced.
+        ds.close()
+        with self.pool.checkout() as other:
+            self.assert_(other is not ds)
+            self.assert_(other.ping())
+
+        self.assertEqual(self.pool.stats()["failed_validations"], 1)
+        
+    def test_eviction(self):
+        p = pool(lambda: datasource("adapter=sqlite"), min=1, max=3,
+                 max_idle=0.0)
+        for ds in borrow_in_thread(p, 3): p.giveback(ds)
+        self.assertEqual(p.stats()["idle"], 3)
+
+        p.evict()
+        stats = p.stats()
+        self.assertEqual(stats["idle"], 1)
+        self.assertEqual(stats["closed"], 2)
+
+        p = pool(lambda: datasource("adapter=sqlite"), min=0, max=1,
+                 max_age=0.0)
+        with p.checkout() as ds:
+            pass
+        self.assertEqual(p.stats()["size"], 0)
+
+    def test_threads(self):
+        with self.pool.checkout() as ds:
+            ds.execute("CREATE TABLE t ( i INTEGER )")
+            ds.commit()
+            
+        errors = []
+        def work():
+            try:
+                for a in range(10):
+                    with self.pool.checkout(timeout=10.0) as ds:
+                        ds.execute("INSERT INTO t VALUES (1)")
+                        ds.commit()
+            except Exception, e:
+                errors.append(e)
+
+        threads = [ threading.Thread(target=work) for a in range(6) ]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+
+        self.assertEqual(errors, [])
+        self.assert_(self.pool.stats()["created"] <= 3)
+        with self.pool.checkout() as ds:
+            self.assertEqual(ds.query_one("SELECT COUNT(*) FROM t")[0], 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+
+"""
+Test prefetching one2many, many2many and many2one relationships with
+the SQLite adapter.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.debug import sqllog
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.relationships import *
+
+from t4.orm.datasource import datasource
+
+
+class country(dbobject):
+    id = common_serial()
+    name = text()
+
+class city(dbobject):
+    id = common_serial()
+    name = text()
+    country_id = integer()
+
+country.cities = one2many(city)
+city.country = many2one(country)
+
+class user(dbobject):
+    id = common_serial()
+    login = text()
+
+class permission(dbobject):
+    id = common_serial()
+    name = text()
+
+user.permissions = many2many(permission, "user_to_permission")
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE country (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE city (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              country_id INTEGER
+                           )""")
+        self.ds.execute("""CREATE TABLE user (
+                              id INTEGER PRIMARY KEY,
+                              login TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE permission (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE user_to_permission (
+                              user_id INTEGER,
+                              permission_id INTEGER
+                           )""")
+
+        # Austria and Spain have no cities.
+        self.ds.execute("INSERT INTO country (name) VALUES ('Germany'), "
+                        "('France'), ('Austria'), ('Italy'), ('Spain')")
+        self.ds.execute("INSERT INTO city (name, country_id) VALUES "
+                        "('Hamburg', 1), ('Paris', 2), ('Berlin', 1), "
+                        "('Rome', 4), ('Milan', 4), ('Turin', 4), "
+                        "('Atlantis', NULL)")
+
+        # Heike has no permissions.
+        self.ds.execute("INSERT INTO user (login) VALUES ('diedrich'), "
+                        "('kai'), ('heike')")
+        self.ds.execute("INSERT INTO permission (name) VALUES ('read'), "
+                        "('write'), ('admin')")
+        self.ds.execute("INSERT INTO user_to_permission VALUES "
+                        "(1, 1), (1, 2), (1, 3), (2, 1)")
+        self.ds.commit()
+        
+        sqllog.buffer_size = 100
+        sqllog.reset()
+
+    def tearDown(self):
+        sqllog.buffer_size = 0
+        sqllog.reset()
+
+    def selects(self):
+        return len(filter(lambda q: q.startswith("SELECT"), sqllog.queries))
+
+    def names(self, dbobjs, attribute="name"):
+        return sorted(map(lambda dbobj: getattr(dbobj, attribute), dbobjs))
+    
+    def test_one2many(self):
+        countries = list(self.ds.select(country, sql.orderby("id"),
+                                        prefetch=( "cities", )))
+        self.assertEqual(self.selects(), 2)
+
+        sqllog.reset()
+        self.assertEqual(map(lambda c: self.names(c.cities), countries),
+                         [ [ "Berlin", "Hamburg", ], [ "Paris", ], [],
+                           [ "Milan", "Rome", "Turin", ], [], ])
+        self.assertEqual(map(lambda c: len(c.cities), countries),
+                         [ 2, 1, 0, 3, 0, ])
+        self.assertEqual(self.selects(), 0)
+
+        # Clauses are not answered from the prefetched children.
+        self.assertEqual(len(list(countries[0].cities.select(
+                        sql.where("name = 'Berlin'")))), 1)
+        self.assertEqual(self.selects(), 1)
+
+    def test_many2many(self):
+        users = list(self.ds.select(user, sql.orderby("id"),
+                                    prefetch=( "permissions", )))
+        self.assertEqual(self.selects(), 2)
+
+        sqllog.reset()
+        self.assertEqual(map(lambda u: self.names(u.permissions), users),
+                         [ [ "admin", "read", "write", ], [ "read", ], [], ])
+        self.assertEqual(map(lambda u: len(u.permissions), users),
+                         [ 3, 1, 0, ])
+        self.assertEqual(self.selects(), 0)
+
+    def test_many2one(self):
+        cities = list(self.ds.select(city, sql.orderby("id"),
+                                     prefetch=( "country", )))
+        self.assertEqual(self.selects(), 2)
+
+        sqllog.reset()
+        self.assertEqual(map(lambda c: c.country and c.country.name, cities),
+                         [ "Germany", "France", "Germany", "Italy", "Italy",
+                           "Italy", None, ])
+        self.assertEqual(self.selects(), 0)
+
+        # Cities of the same country share one dbobj.
+        self.assert_(cities[0].country is cities[2].country)
+
+    def test_chunks(self):
+        self.ds.prefetch_chunk_size = 2
+        
+        countries = list(self.ds.select(country, sql.orderby("id"),
+                                        prefetch=( "cities", )))
+        self.assertEqual(self.selects(), 4) # 5 countries, 3 chunks
+        self.assertEqual(map(lambda c: len(c.cities), countries),
+                         [ 2, 1, 0, 3, 0, ])
+
+        sqllog.reset()
+        users = list(self.ds.select(user, sql.orderby("id"),
+                                    prefetch=( "permissions", )))
+        self.assertEqual(self.selects(), 3) # 3 users, 2 chunks
+        self.assertEqual(map(lambda u: len(u.permissions), users),
+                         [ 3, 1, 0, ])
+
+        sqllog.reset()
+        cities = list(self.ds.select(city, prefetch=( "country", )))
+        self.assertEqual(self.selects(), 3) # 3 countries, 2 chunks
+        self.assertEqual(self.names(filter(None, map(lambda c: c.country,
+                                                     cities))),
+                         [ "France", "Germany", "Germany", "Italy", "Italy",
+                           "Italy", ])
+        self.assertEqual(self.selects(), 3)
+
+    def test_empty(self):
+        self.ds.execute("DELETE FROM city")
+        sqllog.reset()
+        
+        countries = list(self.ds.select(country, prefetch=( "cities", )))
+        self.assertEqual(map(lambda c: len(c.cities), countries), [ 0, ] * 5)
+        self.assertEqual(self.selects(), 2)
+
+        # Nothing selected, nothing to prefetch.
+        sqllog.reset()
+        self.assertEqual(list(self.ds.select(city, prefetch=( "country", ))),
+                         [])
+        self.assertEqual(self.selects(), 1)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test the query profiler and the disabled sql log with the SQLite
+adapter.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.debug import sqllog
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.relationships import *
+from t4.profiler import query_profiler, statement_shape
+
+from t4.orm.datasource import datasource
+
+
+class country(dbobject):
+    id = common_serial()
+    name = text()
+
+class city(dbobject):
+    id = common_serial()
+    name = text()
+    country_id = integer()
+
+country.cities = one2many(city)
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE country (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE city (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              country_id INTEGER
+                           )""")
+
+        for name in ( "Germany", "France", "Italy", "Spain", "Austria", ):
+            c = country(name=name)
+            self.ds.insert(c)
+            c.cities.append(city(name=name + " City"))
+            
+        self.ds.commit()
+
+        self.profiler = query_profiler(n_plus_one_threshold=5)
+        self.profiler.start()
+
+    def tearDown(self):
+        self.profiler.stop()
+        
+    def test_shape(self):
+        self.assertEqual(
+            statement_shape("SELECT * FROM city  WHERE id IN (1, 2, 3)\n"
+                            " AND name = 'O''Neil' AND x > -2.5"),
+            "SELECT * FROM city WHERE id IN (?) AND name = ? AND x > ?")
+        self.assertEqual(statement_shape("SELECT $1, %s"),
+                         "SELECT ?, ?")
+        
+    def test_aggregate(self):
+        for a in range(3):
+            for c in self.ds.select(country):
+                pass
+
+        stats = self.profiler.stats()
+        selects = filter(lambda d: d["shape"].startswith("SELECT"), stats)
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(selects[0]["count"], 3)
+        self.assertEqual(selects[0]["rows"], 15)
+        self.assert_(selects[0]["total"] >= selects[0]["p95"])
+
+        self.profiler.stop()
+        list(self.ds.select(country))
+        self.assertEqual(self.profiler.stats(), stats)
+        
+    def test_n_plus_one(self):
+        reported = []
+        self.profiler.n_plus_one = lambda scope, shape, caller: \
+            reported.append(shape)
+        
+        with self.profiler.scope("list") as scope:
+            for c in self.ds.select(country):
+                for a in c.cities: pass
+
+        self.assertEqual(len(scope.queries), 6)
+        self.assertEqual(len(scope.suspects), 1)
+        shape, caller = scope.suspects[0]
+        self.assertEqual(reported, [ shape, ])
+        self.assert_("FROM city" in shape)
+        self.assert_(__file__.rstrip("c") in caller)
+
+        # A single query per scope is fine.
+        for c in self.ds.select(country):
+            with self.profiler.scope("detail") as scope:
+                for a in c.cities: pass
+            self.assertEqual(scope.suspects, [])
+
+    def test_sqllog_disabled(self):
+        self.assertFalse(sqllog)
+        sqllog.buffer_size = 10
+        try:
+            self.assert_(sqllog)
+            self.ds.execute("SELECT 1")
+            self.assert_("SELECT 1" in sqllog.queries)
+        finally:
+            sqllog.buffer_size = 0
+            sqllog.reset()
+
+        sqllog.write("SELECT 2\n")
+        self.assertEqual(sqllog.queries, [])
+        
+if __name__ == '__main__':
+    unittest.main()
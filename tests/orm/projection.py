@@ -0,0 +1,174 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test the datasource's select_values() and select_rows() methods with
+the SQLite adapter.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.debug import sqllog
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.relationships import one2many
+
+from t4.orm.datasource import datasource
+
+
+class person(dbobject):
+    id = common_serial()
+    name = Unicode()
+    height = Float()
+    tags = csv(Unicode())
+    notes = delayed(python_literal())
+    
+class pet(dbobject):
+    id = common_serial()
+    name = Unicode()
+    person_id = integer()
+
+person.pets = one2many(pet)
+
+class shouting(text):
+    """
+    A datatype with a __set_from_result__() of its own.
+    """
+    def __set_from_result__(self, ds, dbobj, value):
+        if value is None: value = "nothing"
+        self.store_value(dbobj, value.upper())
+
+class site(dbobject):
+    id = common_serial()
+    domain = PDomain()
+    root = path()
+    motto = shouting()
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE person (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              height INTEGER,
+                              tags TEXT,
+                              notes TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE pet (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              person_id INTEGER
+                           )""")
+        self.ds.execute("INSERT INTO person VALUES "
+                        "(1, 'Diedrich', 180, 'a,b', '{1: 2}'), "
+                        "(2, 'Heike', 170, NULL, NULL), "
+                        "(3, 'Jason', 175, 'c', '[]')")
+        self.ds.execute("INSERT INTO pet VALUES (1, 'Rex', 1), (2, 'Tom', 3)")
+        self.ds.execute("""CREATE TABLE site (
+                              id INTEGER PRIMARY KEY,
+                              domain TEXT,
+                              root TEXT,
+                              motto TEXT
+                           )""")
+        self.ds.execute("INSERT INTO site VALUES "
+                        "(1, 'tux4web.de', 'a/b/c', 'hello'), "
+                        "(2, 'xn--mller-kva.de', 'd', NULL)")
+        self.ds.commit()
+
+        sqllog.buffer_size = 100
+        sqllog.reset()
+
+    def tearDown(self):
+        sqllog.buffer_size = 0
+        sqllog.reset()
+        
+    def test_values(self):
+        values = list(self.ds.select_values(person, ( "id", "name", ),
+                                            sql.where("height > 172"),
+                                            sql.orderby("id")))
+        self.assertEqual(values, [ ( 1, u"Diedrich", ), ( 3, u"Jason", ), ])
+        self.assertEqual(type(values[0][1]), UnicodeType)
+        
+        # Only the requested columns are selected.
+        self.assertEqual(filter(lambda q: q.startswith("SELECT"),
+                                sqllog.queries),
+                         [ "SELECT id, name FROM person WHERE height > 172 "
+                           "ORDER BY id", ])
+        
+        ids = list(self.ds.select_values(person, "id", sql.orderby("id")))
+        self.assertEqual(ids, [ 1, 2, 3, ])
+
+    def test_conversion(self):
+        rows = list(self.ds.select_values(person,
+                                          ( "height", "tags", "notes", ),
+                                          sql.orderby("id")))
+        self.assertEqual(rows, [ ( 180.0, ( u"a", u"b", ), { 1: 2, }, ),
+                                 ( 170.0, None, None, ),
+                                 ( 175.0, ( u"c", ), [], ), ])
+        self.assertEqual(type(rows[0][0]), FloatType)
+
+    def test_set_from_result(self):
+        # Overloaded __set_from_result__() methods yield what select()
+        # stores in the dbobjs.
+        attributes = ( "domain", "root", "motto", )
+        rows = list(self.ds.select_values(site, attributes, sql.orderby("id")))
+        self.assertEqual(rows, [ ( u"tux4web.de", ( "a", "b", "c", ),
+                                   "HELLO", ),
+                                 ( u"m\xfcller.de", ( "d", ), "NOTHING", ), ])
+        self.assertEqual(rows, map(
+            lambda s: tuple(map(lambda a: getattr(s, a), attributes)),
+            self.ds.select(site, sql.orderby("id"))))
+        
+    def test_rows(self):
+        rows = list(self.ds.select_rows(person, ( "id", "name", ),
+                                        sql.orderby("id"), batch_size=2))
+        self.assertEqual(map(lambda row: row.name, rows),
+                         [ u"Diedrich", u"Heike", u"Jason", ])
+        self.assertEqual(rows[0], ( 1, u"Diedrich", ))
+        self.assertEqual(rows[0].__class__,
+                         self.ds.select_rows(person, ( "id", "name", )
+                                             ).next().__class__)
+
+    def test_join(self):
+        rows = list(self.ds.select_rows(
+            pet, ( "name", ),
+            sql.left_join("person", "person.id = pet.person_id"),
+            sql.where("person.height > 172"),
+            sql.orderby("pet.id")))
+        self.assertEqual(map(lambda row: row.name, rows), [ u"Rex", u"Tom", ])
+
+    def test_relationship(self):
+        self.assertRaises(TypeError, list,
+                          self.ds.select_values(person, ( "pets", )))
+        
+if __name__ == '__main__':
+    unittest.main()
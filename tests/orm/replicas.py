@@ -0,0 +1,152 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test read replica routing with two SQLite files standing in for the
+primary and the replica. They are not actually replicated, each has
+a row of its own, so the rows selected tell which one has been used.
+"""
+
+import os, tempfile, shutil, unittest
+
+from t4 import sql
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+
+from t4.orm.datasource import datasource
+
+
+class server(dbobject):
+    id = common_serial()
+    name = text()
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.primary = self.connect("primary")
+        self.replica = self.connect("replica")
+        self.primary.add_replica(self.replica)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def connect(self, name):
+        ds = datasource("adapter=sqlite file=%s" % os.path.join(
+            self.tmp, name + ".db"))
+        ds.execute("CREATE TABLE server (id INTEGER PRIMARY KEY, name TEXT)")
+        ds.execute("INSERT INTO server (name) VALUES ('%s')" % name)
+        ds.commit()
+        return ds
+        
+    def names(self, **kw):
+        return map(lambda s: s.name,
+                   self.primary.select(server, sql.orderby("id"), **kw))
+    
+    def test_routing(self):
+        self.assertEqual(self.names(), [ "replica", ])
+        self.assertEqual(self.primary.count(server), 1)
+        self.assertEqual(self.names(on_primary=True), [ "primary", ])
+
+        # After the first write, reads stick to the primary...
+        self.primary.insert(server(name="new"))
+        self.assertEqual(self.names(), [ "primary", "new", ])
+        
+        # ...until the end of the transaction.
+        self.primary.commit()
+        self.assertEqual(self.names(), [ "replica", ])
+
+        dbobj = self.primary.select_by_primary_key(server, 1)
+        self.assertEqual(dbobj.name, "replica")
+        dbobj.name = "changed"
+        self.primary.flush_updates()
+        self.assertEqual(self.names(), [ "changed", "new", ])
+        self.primary.rollback()
+        self.assertEqual(self.names(), [ "replica", ])
+
+    def test_writes(self):
+        # DDL runs on the primary and makes reads stick to it.
+        self.primary.execute("CREATE TABLE t (id INTEGER)")
+        self.assertEqual(self.names(), [ "primary", ])
+        self.primary.commit()
+        self.primary.execute("SELECT * FROM t", on_primary=True)
+        self.assertRaises(Exception, self.replica.execute, "SELECT * FROM t")
+        
+        # So does an INSERT after a line break.
+        self.primary.execute("""
+            INSERT INTO server (name) VALUES ('new')""")
+        self.assertEqual(self.names(), [ "primary", "new", ])
+        self.primary.commit()
+        self.assertEqual(self.names(), [ "replica", ])
+
+    def test_is_read(self):
+        for command in ( "SELECT * FROM server",
+                         "\n  select 1",
+                         "WITH a AS (SELECT 1) SELECT * FROM a",
+                         sql.select("*", "server"), ):
+            self.assert_(self.primary.is_read(command), command)
+
+        for command in ( "\n  INSERT INTO server (name) VALUES ('a')",
+                         "CREATE TABLE t (id INTEGER)",
+                         "SELECT * FROM server FOR UPDATE",
+                         "SELECT * FROM server FOR SHARE",
+                         "SELECT nextval('server_id_seq')",
+                         "WITH a AS (DELETE FROM server) SELECT 1",
+                         "LOCK TABLE server",
+                         "SET search_path TO x",
+                         sql.delete("server", sql.where("id = 1")), ):
+            self.failIf(self.primary.is_read(command), command)
+        
+    def test_round_robin(self):
+        other = self.connect("other")
+        self.primary.add_replica(other)
+
+        names = map(lambda a: self.names()[0], range(4))
+        self.assertEqual(sorted(names),
+                         [ "other", "other", "replica", "replica", ])
+        self.failIfEqual(names[0], names[1])
+
+        self.primary.replica_policy = "least_busy"
+        names = map(lambda a: self.names()[0], range(4))
+        self.assertEqual(sorted(names),
+                         [ "other", "other", "replica", "replica", ])
+        
+    def test_failure(self):
+        self.replica.close()
+        self.assertEqual(self.names(), [ "primary", ])
+        self.assertEqual(self.primary.replicas(), [])
+
+        # A replica that responds again is put back into rotation.
+        self.replica.connect()
+        self.primary.check_replicas()
+        self.assertEqual(self.primary.replicas(), [ self.replica, ])
+        self.assertEqual(self.names(), [ "replica", ])
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test the datasource's result cache with the SQLite adapter.
+"""
+
+import unittest
+from time import sleep
+
+from t4 import sql
+from t4.debug import sqllog
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.relationships import one2many
+
+from t4.orm import result_cache
+from t4.orm.datasource import datasource
+
+
+class country(dbobject):
+    id = common_serial()
+    name = text()
+
+class city(dbobject):
+    id = common_serial()
+    name = text()
+    country_id = integer()
+
+country.cities = one2many(city)
+    
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE country (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE city (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              country_id INTEGER
+                           )""")
+        self.ds.execute("INSERT INTO country (name) VALUES ('Germany'), "
+                        "('France')")
+        self.ds.execute("INSERT INTO city (name, country_id) VALUES "
+                        "('Hamburg', 1), ('Berlin', 1), ('Paris', 2)")
+        self.ds.commit()
+        
+        self.ds.enable_result_cache(max_size=3)
+        
+        sqllog.buffer_size = 100
+        sqllog.reset()
+
+    def tearDown(self):
+        sqllog.buffer_size = 0
+        sqllog.reset()
+
+    def selects(self):
+        return len(filter(lambda q: q.startswith("SELECT"), sqllog.queries))
+
+    def names(self, dbclass, *clauses):
+        return map(lambda dbobj: dbobj.name,
+                   self.ds.select(dbclass, sql.orderby("id"), *clauses))
+    
+    def test_hits(self):
+        self.assertEqual(self.names(country), [ "Germany", "France", ])
+        self.assertEqual(self.names(country), [ "Germany", "France", ])
+        self.assertEqual(self.ds.count(city), 3)
+        self.assertEqual(self.ds.count(city), 3)
+        self.assertEqual(self.selects(), 2)
+
+        # Each hit creates new dbobjs.
+        a = self.ds.select_by_primary_key(country, 1)
+        b = self.ds.select_by_primary_key(country, 1)
+        self.failIf(a is b)
+        self.assertEqual(a.name, b.name)
+        
+        stats = self.ds.result_cache_stats()
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["misses"], 3)
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_invalidation(self):
+        self.names(country)
+        self.names(city)
+        germany = self.ds.select_by_primary_key(country, 1)
+        self.assertEqual(len(self.ds._result_cache), 3)
+        
+        # A modifying statement only invalidates the entries that
+        # read from its relation.
+        self.ds.execute("UPDATE city SET name = 'Munich' WHERE id = 2")
+        self.assertEqual(len(self.ds._result_cache), 2)
+        self.assertEqual(self.names(city), [ "Hamburg", "Munich", "Paris", ])
+
+        # So do the UPDATEs written by flush_updates().
+        germany.name = "Deutschland"
+        self.ds.flush_updates()
+        self.assertEqual(self.names(country), [ "Deutschland", "France", ])
+
+        self.ds.insert(city(name="Lyon", country_id=2))
+        self.assertEqual(len(list(germany.cities)), 2)
+        self.assertEqual(self.ds.count(city), 4)
+
+        self.ds.rollback()
+        self.assertEqual(len(self.ds._result_cache), 0)
+        self.assertEqual(self.ds.count(city), 3)
+
+    def test_subquery(self):
+        # A relation that is only read in a subquery is tracked, too.
+        where = sql.where("id IN (SELECT country_id FROM city "
+                          "WHERE name = 'Lyon')")
+        self.assertEqual(self.names(country, where), [])
+        self.assertEqual(self.names(country, where), [])
+        self.assertEqual(self.selects(), 1)
+
+        self.ds.insert(city(name="Lyon", country_id=2))
+        sqllog.reset()
+        self.assertEqual(self.names(country, where), [ "France", ])
+        self.assertEqual(self.selects(), 1)
+        
+        self.assertEqual(result_cache.read_relations(
+                "SELECT * FROM a x, b AS y JOIN c ON x.id = c.id "
+                "WHERE s = 'FROM d'"), set([ "a", "b", "c", ]))
+        self.assertEqual(result_cache.read_relations("SELECT 1"), None)
+        
+    def test_lru(self):
+        self.names(country)
+        self.names(city)
+        self.ds.count(country)
+        self.names(country) # makes it the most recently used
+        self.ds.count(city)
+
+        stats = self.ds.result_cache_stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["size"], 3)
+
+        sqllog.reset()
+        self.names(country)
+        self.assertEqual(self.selects(), 0)
+        self.names(city)
+        self.assertEqual(self.selects(), 1)
+
+    def test_ttls(self):
+        self.ds.enable_result_cache(ttl=0, ttls={ country: 0.05, })
+
+        self.names(city)
+        self.names(city)
+        self.assertEqual(self.selects(), 2)
+
+        self.names(country)
+        self.names(country)
+        self.assertEqual(self.selects(), 3)
+
+        sleep(0.1)
+        self.names(country)
+        self.assertEqual(self.selects(), 4)
+        
+if __name__ == '__main__':
+    unittest.main()
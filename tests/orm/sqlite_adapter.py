@@ -0,0 +1,227 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test the SQLite adapter. The tests use an in-memory database, so
+unlike the other tests in this directory they don't need a database
+server to run.
+"""
+
+import unittest, sqlite3
+from datetime import datetime as py_datetime, date as py_date, \
+     time as py_time
+
+from t4 import sql
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.relationships import *
+from t4.orm.adapters.sqlite.datatypes import serial, blob
+
+from t4.orm.datasource import datasource
+
+
+class person(dbobject):
+    id = common_serial()
+    name = Unicode()
+    height = integer()
+    born = date()
+    registered = datetime()
+    wakes_up = time()
+    active = boolean()
+
+class document(dbobject):
+    id = serial()
+    person_id = integer()
+    title = text()
+    data = blob()
+
+person.documents = one2many(document)
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite file=:memory:")
+
+        self.ds.execute("""CREATE TABLE person (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              height INTEGER,
+                              born DATE,
+                              registered DATETIME,
+                              wakes_up TIME,
+                              active BOOLEAN
+                           )""")
+        
+        self.ds.execute("""CREATE TABLE document (
+                              id INTEGER PRIMARY KEY,
+                              person_id INTEGER,
+                              title TEXT,
+                              data BLOB
+                           )""")
+
+    def tearDown(self):
+        self.ds.close()
+
+    def test_insert_and_select(self):
+        diedrich = person(name=u"Diedrich Vorberg", height=186,
+                          born=py_date(1976, 7, 20),
+                          registered=py_datetime(2011, 3, 1, 12, 30, 15),
+                          wakes_up=py_time(6, 30),
+                          active=True)
+        self.ds.insert(diedrich)
+        self.assertEqual(diedrich.id, 1)
+        
+        self.ds.flush_updates()
+        self.ds.commit()
+
+        p = self.ds.select_by_primary_key(person, 1)
+        self.assertEqual(p.name, u"Diedrich Vorberg")
+        self.assertEqual(p.born, py_date(1976, 7, 20))
+        self.assertEqual(p.registered, py_datetime(2011, 3, 1, 12, 30, 15))
+        self.assertEqual(p.wakes_up, py_time(6, 30))
+        self.assertEqual(p.active, True)
+
+    def test_dates_and_times(self):
+        self.ds.execute("INSERT INTO person (name, born, registered, wakes_up) "
+                        "VALUES ('a', '1976-07-20', '2011-03-01T12:30:15.5', "
+                        "'06:30')")
+        p = self.ds.select_by_primary_key(person, 1)
+        self.assertEqual(p.born, py_date(1976, 7, 20))
+        self.assertEqual(p.registered,
+                         py_datetime(2011, 3, 1, 12, 30, 15, 500000))
+        self.assertEqual(p.wakes_up, py_time(6, 30))
+        self.assertEqual(list(self.ds.select_values(person, "registered")),
+                         [ py_datetime(2011, 3, 1, 12, 30, 15, 500000), ])
+        
+        # The conversion is left to the datatypes, Python's own sqlite3
+        # converters are not replaced.
+        self.failIf(sqlite3.converters.has_key("DATETIME"))
+        self.assertEqual(sqlite3.converters["DATE"].__module__,
+                         "sqlite3.dbapi2")
+        
+        # Time zones are not silently dropped.
+        self.ds.execute("UPDATE person SET registered = "
+                        "'2011-03-01 12:30:15+02:00'")
+        self.assertRaises(ValueError, self.ds.select_by_primary_key, person, 1)
+        self.assertRaises(ValueError, parse_datetime, "2011-03-01 12:30Z")
+        self.assertRaises(ValueError, parse_datetime, "2011-03-01 nonsense")
+        
+    def test_strings(self):
+        tricky = u"Quotes ' \" backslash \\ percent % question? " + \
+                 u"nul \0 umlauts \xe4\xf6\xfc"
+        self.ds.insert(person(name=tricky))
+        
+        p, = list(self.ds.select(person))
+        self.assertEqual(p.name, tricky)
+
+    def test_serial_and_blob(self):
+        data = "".join(map(chr, range(256)))
+        
+        doc = document(title="Binary", data=data)
+        self.ds.insert(doc)
+        self.assertEqual(doc.id, 1)
+
+        doc = document(title="Another", data="\0")
+        self.ds.insert(doc)
+        self.assertEqual(doc.id, 2)
+
+        doc = self.ds.select_by_primary_key(document, 1)
+        self.assertEqual(doc.data, data)
+
+    def test_insert_many(self):
+        people = [ person(name=u"Person %i" % a, height=a)
+                   for a in range(10) ]
+        self.ds.insert_many(people)
+        
+        self.assertEqual([ p.id for p in people ], range(1, 11))
+        self.assertEqual(self.ds.count(person), 10)
+
+    def test_stream(self):
+        self.ds.insert_many([ person(name=u"Person %i" % a, height=a)
+                              for a in range(10) ])
+
+        result = self.ds.select(person, sql.order_by("id"),
+                                stream=True, batch_size=3)
+        self.assertEqual([ p.height for p in result ], range(10))
+        self.assertEqual(result.cursor, None)
+
+        with self.ds.select(person, batch_size=4) as result:
+            self.assertEqual(result.next().height, 0)
+        self.assertEqual(result.cursor, None)
+
+    def test_one2many(self):
+        diedrich = person(name=u"Diedrich")
+        self.ds.insert(diedrich)
+        diedrich.documents.append(document(title="One"),
+                                  document(title="Two"))
+
+        titles = [ doc.title for doc in diedrich.documents ]
+        titles.sort()
+        self.assertEqual(titles, [ "One", "Two", ])
+
+    def test_update(self):
+        self.ds.insert(person(name=u"Diedrich", height=185))
+        
+        p = self.ds.select_by_primary_key(person, 1)
+        p.height = 186
+        self.ds.commit()
+
+        cursor = self.ds.execute("SELECT height FROM person")
+        self.assertEqual(cursor.fetchone()[0],
+                         186)
+
+
+class test_parameterized(test):
+    """
+    Run the same tests with all literals passed as query parameters.
+    """
+    def setUp(self):
+        test.setUp(self)
+        self.ds.parameterized = True
+
+    def test_query_text(self):
+        query = sql.select(( "id", ), "person",
+                           sql.where("name = ", sql.unicode_literal(u"O'Neil"),
+                                     " AND height > ", sql.integer_literal(180),
+                                     " AND active = ", sql.bool_literal(True)))
+        runner = sql.sql(self.ds)
+        self.assertEqual(runner(query),
+                         "SELECT id FROM person WHERE "
+                         "name = ? AND height > ? AND active = ?")
+        self.assertEqual(runner.params, [ "O'Neil", 180, True, ])
+
+        runner = sql.sql(self.ds, parameterized=False)
+        self.assertEqual(runner(query),
+                         "SELECT id FROM person WHERE "
+                         "name = 'O''Neil' AND height > 180 AND active = TRUE")
+        self.assertEqual(runner.params, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
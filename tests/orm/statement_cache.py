@@ -0,0 +1,139 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test the statement cache with the SQLite adapter.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+from t4.orm.containers import sqltuple
+
+from t4.orm.datasource import datasource
+
+
+class person(dbobject):
+    id = common_serial()
+    name = Unicode()
+    notes = delayed(text())
+    nicknames = sqltuple("nickname", text(column="name"),
+                         child_key="person_id")
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE person (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              notes TEXT
+                           )""")
+        self.ds.execute("""CREATE TABLE nickname (
+                              person_id INTEGER,
+                              name TEXT
+                           )""")
+
+        for name in ( u"Diedrich", u"Heike", u"Jason", ):
+            self.ds.insert(person(name=name, notes="Notes on " + str(name)))
+            
+        sql.statement_cache.clear()
+
+    def tearDown(self):
+        sql.statement_cache.clear()
+        sql.statement_cache.enabled = True
+        self.ds.close()
+
+    def test_bound(self):
+        query = lambda id: sql.bound(( "test_bound", ),
+                                     lambda id: sql.select(( "name", ),
+                                                           "person",
+                                                           sql.where("id = ",
+                                                                     id)),
+                                     ( sql.integer_literal(id), ))
+
+        runner = sql.sql(self.ds)
+        self.assertEqual(runner(query(1)), runner(query(1).statement()))
+        self.assertEqual(runner(query(2)), "SELECT name FROM person "
+                                           "WHERE id = 2")
+        self.assertEqual(sql.statement_cache.stats(),
+                         { "hits": 1, "misses": 1, "size": 1, })
+
+        runner = sql.sql(self.ds, parameterized=True)
+        self.assertEqual(runner(query(3)), "SELECT name FROM person "
+                                           "WHERE id = ?")
+        self.assertEqual(runner.params, [ 3, ])
+
+    def test_select_by_primary_key(self):
+        for id in ( 1, 2, 3, 1, ):
+            p = self.ds.select_by_primary_key(person, id)
+            self.assertEqual(p.id, id)
+
+        self.assertEqual(sql.statement_cache.misses, 1)
+        self.assertEqual(sql.statement_cache.hits, 3)
+
+        self.assertEqual(self.ds.select_by_primary_key(person, 4), None)
+
+    def test_new_property(self):
+        class member(dbobject):
+            __relation__ = "person"
+            id = common_serial()
+            name = Unicode()
+
+        self.assertEqual(self.ds.select_by_primary_key(member, 1).name,
+                         u"Diedrich")
+
+        # Adding a dbproperty discards the class' templates.
+        member.notes = text()
+        self.assertEqual(sql.statement_cache.stats()["size"], 0)
+        self.assertEqual(self.ds.select_by_primary_key(member, 2).notes,
+                         "Notes on Heike")
+        
+    def test_delayed_and_sqltuple(self):
+        for p in self.ds.select(person, sql.order_by("id")):
+            self.assertEqual(p.notes, "Notes on " + str(p.name))
+            self.assertEqual(p.nicknames, ())
+
+        # One template each for the delayed and the sqltuple queries
+        self.assertEqual(sql.statement_cache.misses, 2)
+        self.assertEqual(sql.statement_cache.hits, 4)
+
+    def test_disabled(self):
+        sql.statement_cache.enabled = False
+
+        p = self.ds.select_by_primary_key(person, 2)
+        self.assertEqual(p.name, u"Heike")
+        self.assertEqual(sql.statement_cache.stats()["size"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
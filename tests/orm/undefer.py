@@ -0,0 +1,136 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test grouped loading of delayed properties with the SQLite adapter.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.debug import sqllog
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+
+from t4.orm.datasource import datasource
+
+
+class document(dbobject):
+    id = common_serial()
+    title = text()
+    body = delayed(text(), group="content")
+    attachment = delayed(text(), group="content", cache=True)
+    notes = delayed(text())
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE document (
+                              id INTEGER PRIMARY KEY,
+                              title TEXT,
+                              body TEXT,
+                              attachment TEXT,
+                              notes TEXT
+                           )""")
+        for a in range(1, 8):
+            self.ds.execute("INSERT INTO document VALUES "
+                            "(%i, 'Doc %i', 'body %i', 'att %i', 'notes %i')" \
+                                % ( a, a, a, a, a, ))
+        self.ds.commit()
+        
+        sqllog.buffer_size = 100
+        sqllog.reset()
+
+    def tearDown(self):
+        sqllog.buffer_size = 0
+        sqllog.reset()
+
+    def selects(self):
+        return filter(lambda q: q.startswith("SELECT"), sqllog.queries)
+        
+    def test_group(self):
+        doc = self.ds.select_by_primary_key(document, 1)
+        sqllog.reset()
+
+        self.assertEqual(doc.body, "body 1")
+        self.assertEqual(doc.attachment, "att 1")
+        self.assertEqual(len(self.selects()), 1)
+
+        # The attachment is cached, the body is not.
+        self.assertEqual(doc.attachment, "att 1")
+        self.assertEqual(len(self.selects()), 1)
+        self.assertEqual(doc.body, "body 1")
+        self.assertEqual(len(self.selects()), 2)
+
+        # Properties outside the group are loaded on their own.
+        self.assertEqual(doc.notes, "notes 1")
+        self.assertEqual(len(self.selects()), 3)
+
+    def test_modified_member(self):
+        doc = self.ds.select_by_primary_key(document, 2)
+        doc.attachment = "new"
+        self.assertEqual(doc.body, "body 2")
+        self.assertEqual(doc.attachment, "new")
+        
+    def test_undefer(self):
+        result = self.ds.select(document, sql.where("id > 2"))
+        sqllog.reset()
+        
+        docs = list(result.undefer("body"))
+        self.assertEqual(len(self.selects()), 1)
+        
+        self.assertEqual(map(lambda d: d.body, docs),
+                         map(lambda a: "body %i" % a, range(3, 8)))
+        self.assertEqual(map(lambda d: d.attachment, docs),
+                         map(lambda a: "att %i" % a, range(3, 8)))
+        self.assertEqual(len(self.selects()), 1)
+
+        # The values that are not cached have been used up.
+        self.assertEqual(docs[0].body, "body 3")
+        self.assertEqual(len(self.selects()), 2)
+
+    def test_undefer_chunks(self):
+        self.ds.prefetch_chunk_size = 3
+        docs = list(self.ds.select(document, undefer=( "attachment",
+                                                       "notes", )))
+        sqllog.reset()
+        self.assertEqual(map(lambda d: d.notes, docs),
+                         map(lambda a: "notes %i" % a, range(1, 8)))
+        self.assertEqual(map(lambda d: d.attachment, docs),
+                         map(lambda a: "att %i" % a, range(1, 8)))
+        self.assertEqual(self.selects(), [])
+        
+    def test_not_delayed(self):
+        result = self.ds.select(document)
+        self.assertRaises(TypeError, result.undefer, "title")
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+#/usr/bin/env python
+# -*- coding: iso-8859-1 -*-
+
+##  This file is part of orm, The Object Relational Membrane Version 2.
+##
+##  Copyright 2002-2006 by Diedrich Vorberg <diedrich@tux4web.de>
+##
+##  All Rights Reserved
+##
+##  For more Information on orm see the README file.
+##
+##  This program is free software; you can redistribute it and/or modify
+##  it under the terms of the GNU General Public License as published by
+##  the Free Software Foundation; either version 2 of the License, or
+##  (at your option) any later version.
+##
+##  This program is distributed in the hope that it will be useful,
+##  but WITHOUT ANY WARRANTY; without even the implied warranty of
+##  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##  GNU General Public License for more details.
+##
+##  You should have received a copy of the GNU General Public License
+##  along with this program; if not, write to the Free Software
+##  Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA  02110-1301  USA
+##
+##  I have added a copy of the GPL in the file gpl.txt.
+
+
+"""
+Test the storage of dbproperty values in the dbobjs' __values__ list
+with the SQLite adapter.
+"""
+
+import unittest
+
+from t4 import sql
+from t4.orm.dbobject import dbobject
+from t4.orm.datatypes import *
+
+from t4.orm.datasource import datasource
+
+
+class item(dbobject):
+    id = common_serial()
+    name = text()
+    code = text(column="name")
+
+class priced_item(item):
+    __relation__ = "item"
+    price = integer()
+
+
+class test(unittest.TestCase):
+
+    def setUp(self):
+        self.ds = datasource("adapter=sqlite")
+
+        self.ds.execute("""CREATE TABLE item (
+                              id INTEGER PRIMARY KEY,
+                              name TEXT,
+                              price INTEGER
+                           )""")
+        self.ds.insert(priced_item(name="spoon", price=3))
+        self.ds.commit()
+
+    def test_slots(self):
+        # Properties on the same column share a slot, inherited ones
+        # keep theirs.
+        self.assertEqual(item.__slot_names__, [ " id", " name", ])
+        self.assertEqual(priced_item.__slot_names__,
+                         [ " id", " name", " price", ])
+        self.assertEqual(item.name.slot, item.code.slot)
+        self.assertEqual(priced_item.name.slot, item.name.slot)
+
+        spoon = self.ds.select_by_primary_key(priced_item, 1)
+        self.assertEqual(spoon.__values__, [ 1, "spoon", 3, ])
+        self.assertEqual(spoon.code, "spoon")
+        self.assertEqual(item.name.__get__(spoon), "spoon")
+        self.assertFalse(spoon.__dict__.has_key(" name"))
+
+        fork = item(name="fork")
+        self.assertEqual(fork.__values__, [ UNSET, "fork", ])
+        self.assertRaises(AttributeError, getattr, fork, "id")
+        self.assertRaises(AttributeError, priced_item.price.__get__, fork)
+
+    def test_changes(self):
+        spoon = self.ds.select_by_primary_key(priced_item, 1)
+        self.assertEqual(spoon.__changed__, 0)
+        
+        spoon.price = sql.expression("price + 1")
+        self.assertFalse(priced_item.price.isset(spoon))
+        self.assert_(priced_item.price.is_set_to_an_expression(spoon))
+
+        spoon.code = "Spoon"
+        self.assertEqual(map(lambda (c, d): str(c),
+                             spoon.__changed_columns__()),
+                         [ "name", "price", ])
+
+        self.ds.flush_updates()
+        self.assertEqual(spoon.__changed__, 0)
+        self.assertEqual(self.ds.execute(
+                "SELECT name, price FROM item").fetchall(),
+                         [ ( "Spoon", 4, ), ])
+
+        spoon = self.ds.select_by_primary_key(priced_item, 1)
+        spoon.name = "Spoon"
+        self.assertEqual(spoon.__changed__, 0)
+        
+if __name__ == '__main__':
+    unittest.main()